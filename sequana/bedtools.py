@@ -19,6 +19,8 @@
 """Utilities for the genome coverage"""
 import re
 import ast
+import collections
+import io
 import os
 import sys
 
@@ -31,6 +33,7 @@ from sequana.lazy import pylab
 
 from sequana import logger
 from sequana.tools import gc_content, genbank_features_parser
+from sequana.running_median import _rolling_median
 from sequana.errors import SequanaException
 
 from easydev import do_profile
@@ -38,6 +41,235 @@ from easydev import do_profile
 __all__ = ["GenomeCov", "ChromosomeCov", "DoubleThresholds"]
 
 
+def _as_counts(values):
+    """Return coverage values with the smallest unsigned integer type
+
+    Values that are not positive integers are returned as float32.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu" or (len(values) and values.min() < 0):
+        return values.astype(np.float32)
+    maximum = values.max() if len(values) else 0
+    for dtype in (np.uint16, np.uint32):
+        if maximum <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
+
+
+def _dropna(values):
+    # values without NaN (integer arrays are returned as is)
+    if values.dtype.kind == "f":
+        return values[~np.isnan(values)]
+    return values
+
+
+def _scan_bed(filename, chunksize=16777216):
+    """Return the byte range of each chromosome found in a BED file
+
+    :param filename: a BED file (not compressed) as created by samtools
+        depth or bedtools genomecov. The rows of a chromosome must be
+        contiguous.
+    :return: list of tuples (name, start, stop, number of rows)
+
+    The file is read by blocks. Within a block, the boundaries between
+    chromosomes are found by binary search on the line starts so that no
+    Python loop over the rows is required.
+    """
+    ranges = []
+    name = None
+    start = 0
+    nrows = 0
+    pending = b""
+    offset = 0
+    with open(filename, "rb") as fin:
+        while True:
+            chunk = fin.read(chunksize)
+            if not chunk:
+                break
+            data = pending + chunk
+            base = offset - len(pending)
+            offset += len(chunk)
+            end = data.rfind(b"\n") + 1
+            pending = data[end:]
+            if end == 0:
+                continue
+            data = data[:end]
+
+            # start of each complete line in the block
+            starts = np.flatnonzero(np.frombuffer(data, np.uint8) == 10) + 1
+            starts = np.concatenate([[0], starts[:-1]])
+            N = len(starts)
+
+            def get_name(i):
+                pos = int(starts[i])
+                return data[pos:data.index(b"\t", pos)]
+
+            i = 0
+            while i < N:
+                this = get_name(i)
+                if this != name:
+                    if name is not None:
+                        ranges.append((name.decode(), start, base +
+                            int(starts[i]), nrows))
+                    name = this
+                    start = base + int(starts[i])
+                    nrows = 0
+                # first line (after i) of another chromosome
+                if get_name(N - 1) == name:
+                    stop = N
+                else:
+                    low, high = i, N - 1
+                    while high - low > 1:
+                        mid = (low + high) // 2
+                        if get_name(mid) == name:
+                            low = mid
+                        else:
+                            high = mid
+                    stop = high
+                nrows += stop - i
+                i = stop
+    if pending.strip():
+        raise ValueError("Last line of %s is incomplete" % filename)
+    if name is not None:
+        ranges.append((name.decode(), start, offset, nrows))
+    return ranges
+
+
+def _segment_reduce(ufunc, values, starts, stops):
+    # reduce values[start:stop] for each (start, stop) with a ufunc
+    indices = np.empty(2 * len(starts), dtype=np.int64)
+    indices[0::2] = starts
+    indices[1::2] = stops
+    # an extra value so that the last stop may be the length of the data
+    values = np.concatenate([values, values[:1]])
+    return ufunc.reduceat(values, indices)[0::2]
+
+
+def _segment_mean(values, starts, stops):
+    """Mean of values[start:stop] for each (start, stop) as in Pandas
+
+    Integers are summed as float64 (exact). Floats are summed in their own
+    precision with the pairwise summation of NumPy, one segment at a time,
+    so that the results are the same as :meth:`pandas.Series.mean`.
+    """
+    counts = stops - starts
+    if values.dtype.kind in "iub":
+        sums = _segment_reduce(np.add, values.astype(np.float64), starts,
+                               stops)
+        return sums / counts
+    sums = np.array([np.add.reduce(values[start:stop]) for start, stop in
+                     zip(starts, stops)], dtype=values.dtype)
+    return sums / counts.astype(values.dtype)
+
+
+def _count_coverage(alignments, lengths, min_mapq=1, batch_size=1000000):
+    """Return the per-base coverage computed from an iterator of alignments
+
+    :param alignments: iterator of :class:`pysam.AlignedSegment`
+    :param dict lengths: lengths of the contigs indexed by reference id
+    :param int min_mapq: alignments with a lower mapping quality are not
+        counted in the filtered coverage
+    :param int batch_size: number of alignments buffered before being added
+        to the coverage
+    :return: dictionary indexed by reference id with tuples (coverage,
+        filtered coverage) for all contigs in *lengths*
+
+    As in bedtools genomecov, unmapped reads are ignored and an alignment
+    covers all positions from its first to its last aligned base. Start and
+    end of the alignments are added by batch to a difference array (+1 at
+    the start, -1 after the end) so that the coverage is the cumulative sum
+    of that array.
+    """
+    diffs = {}
+
+    def add(diff, positions, value):
+        positions, counts = np.unique(positions, return_counts=True)
+        diff[positions] += value * counts
+
+    def flush(tids, starts, ends, quals):
+        tids = np.array(tids)
+        starts = np.array(starts)
+        ends = np.array(ends)
+        filtered = np.array(quals) >= min_mapq
+        for tid in np.unique(tids):
+            if tid not in diffs:
+                diffs[tid] = (np.zeros(lengths[tid] + 1, np.int32),
+                              np.zeros(lengths[tid] + 1, np.int32))
+            mask = tids == tid
+            for diff, keep in zip(diffs[tid], (mask, mask & filtered)):
+                add(diff, starts[keep], 1)
+                add(diff, ends[keep], -1)
+
+    tids, starts, ends, quals = [], [], [], []
+    for read in alignments:
+        end = read.reference_end
+        if end is None or read.flag & 4:
+            continue
+        tids.append(read.reference_id)
+        starts.append(read.reference_start)
+        ends.append(end)
+        quals.append(read.mapping_quality)
+        if len(tids) == batch_size:
+            flush(tids, starts, ends, quals)
+            tids, starts, ends, quals = [], [], [], []
+    if tids:
+        flush(tids, starts, ends, quals)
+
+    results = {}
+    for tid, length in lengths.items():
+        if tid in diffs:
+            results[tid] = tuple(_as_counts(np.cumsum(diff[:-1],
+                dtype=np.int32)) for diff in diffs.pop(tid))
+        else:
+            results[tid] = (_as_counts(np.zeros(length, np.int32)),
+                            _as_counts(np.zeros(length, np.int32)))
+    return results
+
+
+def _get_bam_coverage(args):
+    # coverage of one contig of an indexed BAM file (used within a Pool)
+    filename, contig, min_mapq = args
+    import pysam
+    with pysam.AlignmentFile(filename) as bam:
+        tid = bam.get_tid(contig)
+        lengths = {tid: bam.lengths[tid]}
+        return _count_coverage(bam.fetch(contig), lengths, min_mapq)[tid]
+
+
+def _read_bam_coverage(filename, min_mapq=1, threads=1):
+    """Return the per-base coverage of all contigs of a BAM file
+
+    :param str filename: a BAM file. Contigs are processed in parallel if the
+        file is indexed. Otherwise, the file is read once.
+    :param int min_mapq: alignments with a lower mapping quality are not
+        counted in the filtered coverage
+    :param int threads: number of processes
+    :return: list of tuples (contig, coverage, filtered coverage) in the
+        order of the BAM header.
+    """
+    import pysam
+    with pysam.AlignmentFile(filename) as bam:
+        names = bam.references
+        lengths = dict(enumerate(bam.lengths))
+        indexed = bam.has_index()
+        if not indexed or threads == 1 or len(names) == 1:
+            results = _count_coverage(bam.fetch(until_eof=True), lengths,
+                                      min_mapq)
+            return [(name, ) + results[tid] for tid, name in enumerate(names)]
+
+    from multiprocessing import Pool
+    # largest contigs first so that the pool is not idle at the end
+    order = sorted(lengths, key=lambda tid: -lengths[tid])
+    pool = Pool(threads)
+    try:
+        jobs = {tid: pool.apply_async(_get_bam_coverage,
+                    ((filename, names[tid], min_mapq),)) for tid in order}
+        return [(name, ) + jobs[tid].get() for tid, name in enumerate(names)]
+    finally:
+        pool.close()
+        pool.join()
+
+
 class DoubleThresholds(object):
     """Simple structure to handle the double threshold for negative and
     positive sides
@@ -168,13 +400,17 @@ class GenomeCov(object):
 
     """
     def __init__(self, input_filename, genbank_file=None,
-                 low_threshold=-3, high_threshold=3, ldtr=0.5, hdtr=0.5):
+                 low_threshold=-3, high_threshold=3, ldtr=0.5, hdtr=0.5,
+                 lazy=False, threads=1):
         """.. rubric:: constructor
 
         :param str input_filename: the input data with results of a bedtools
             genomecov run. This is just a 3-column file. The first column is a
             string (chromosome), second column is the base postion and third
-            is the coverage.
+            is the coverage. A BAM file may also be provided, in which case
+            the coverage is computed directly (no intermediate BED file). The
+            fourth column (mapq0) is then the coverage without the alignments
+            that have a mapping quality of zero.
         :param str genbank_file: annotation file of your referenve.
         :param float low_threshold: threshold used to identify under-covered
             genomic region of interest (ROI). Must be negative
@@ -186,17 +422,35 @@ class GenomeCov(object):
         :param float rdtr: fraction of the low_threshold to be used to define
             the intermediate threshold in the double threshold method. Must be
             between 0 and 1.
+        :param bool lazy: if True, the BED file is only scanned to get the
+            position of each chromosome in the file. The data of a chromosome
+            is then read when accessed and can be freed with
+            :meth:`ChromosomeCov.release`. This is useful for large genomes
+            that are analysed one chromosome at a time. With a BAM file, the
+            coverage of a chromosome is computed when accessed, which
+            requires an index.
+        :param int threads: number of processes used to compute the coverage
+            of the contigs of an indexed BAM file.
 
         """
         # Keep information if the genome is circular and the window size used
         self._circular = None
         self._feature_dict = None
+        self._feature_index = {}
         self._gc_window_size = None
         self._genbank_filename = None
         self._window_size = None
+        self._gc_params = None
+        self.lazy = lazy
+        self.threads = threads
         # the user choice have the priorities over csv file
         if genbank_file:
             self.genbank_filename = genbank_file
+        if isinstance(input_filename, str) and input_filename.endswith(".bam"):
+            self.thresholds = DoubleThresholds(low_threshold, high_threshold,
+                                               ldtr, hdtr)
+            self.chr_list = self._read_bam(input_filename)
+            return
         # check is the input is a csv of a previous analysis
         try:
             self.chr_list = self._read_csv(input_filename)
@@ -222,7 +476,7 @@ class GenomeCov(object):
         if len(self.chr_list) != len(other.chr_list):
             return False
         for a,b in zip(self.chr_list, other.chr_list):
-            if all(a.df['cov'] == b.df['cov']) is False:
+            if not np.array_equal(a.data['cov'], b.data['cov']):
                 return False
         return True
 
@@ -263,6 +517,45 @@ class GenomeCov(object):
                      "GenomeCov.genbank_filename is set.")
         sys.exit(1)
 
+    def _get_feature_index(self, chrom_name):
+        """Return the :class:`_FeatureIndex` of a chromosome
+
+        The index is built the first time a chromosome is annotated and kept
+        for the next calls. None is returned if there is no genbank or if the
+        chromosome is not found in the genbank.
+        """
+        if chrom_name in self._feature_index:
+            return self._feature_index[chrom_name]
+        features = self.feature_dict
+        name = chrom_name
+        if features and chrom_name not in features.keys():
+            # in the genbank, the names appears as e.g. JB12345
+            # but in the fasta or BED files, it may be something like
+            # gi|269939526|emb|FN433596.1|
+            # so they do not match. We can try to guess it
+            msg = """Chromosome name (%s) not found
+                in the genbank. Make sure the chromosome names in
+                the BAM/BED files are compatible with the genbank
+                content. Genbank files contains the following keys """
+            for this in features.keys():
+                msg += "\n                        - %s" % this
+
+            name = [x for x in chrom_name.split("|") if x]
+            name = name[-1] # assume the accession is last
+            name = name.split('.')[0] # remove version
+            if name in features.keys():
+                msg += "\n Guessed the chromosome name to be: %s" % name
+            else:
+                features = None
+            logger.warning(msg % chrom_name)
+        if features:
+            index = _FeatureIndex(features[name],
+                                  FilteredGenomeCov._feature_not_wanted)
+        else:
+            index = None
+        self._feature_index[chrom_name] = index
+        return index
+
     @property
     def gc_window_size(self):
         """ Get or set the window size to compute the GC content.
@@ -292,6 +585,7 @@ class GenomeCov(object):
             self._genbank_filename = os.path.realpath(genbank_filename)
             self._feature_dict = genbank_features_parser(
                 genbank_filename)
+            self._feature_index = {}
         else:
             logger.error("FileNotFoundError: The genbank file doesn't exist.")
             sys.exit(1)
@@ -317,6 +611,14 @@ class GenomeCov(object):
         """ Read bed generated by samtools depth tools and create
         :class:'ChromosomeCov' list.
         """
+        if self.lazy and not input_filename.endswith(".gz"):
+            return [ChromosomeCov(None, self, self.thresholds,
+                        filerange=(input_filename, start, stop),
+                        chrom_name=name, size=size)
+                    for name, start, stop, size in _scan_bed(input_filename)]
+        if self.lazy:
+            logger.warning("%s is compressed. Lazy mode is not available and "
+                           "all chromosomes are read now" % input_filename)
         df = pd.read_table(input_filename, header=None)
         df = df.rename(columns={0: "chr", 1: "pos", 2: "cov", 3: "mapq0"})
         chr_list = self._set_chr_list(df)
@@ -324,6 +626,30 @@ class GenomeCov(object):
         # useful if one wants to recompute GC content with different window
         return chr_list
 
+    def _read_bam(self, input_filename):
+        """ Compute the coverage of each contig of a BAM file and create
+        :class:`ChromosomeCov` list.
+        """
+        import pysam
+        with pysam.AlignmentFile(input_filename) as bam:
+            indexed = bam.has_index()
+            contigs = list(zip(bam.references, bam.lengths))
+        if self.lazy and indexed:
+            return [ChromosomeCov(None, self, self.thresholds,
+                        filerange=(input_filename, name), chrom_name=name,
+                        size=length) for name, length in contigs]
+        if self.lazy:
+            logger.warning("%s is not indexed. Coverage of all contigs is "
+                           "computed now" % input_filename)
+        chr_list = []
+        for name, cov, mapq0 in _read_bam_coverage(input_filename,
+                                                   threads=self.threads):
+            chrom = ChromosomeCov(None, self, self.thresholds,
+                                  chrom_name=name, size=len(cov))
+            chrom._set_counts(cov, mapq0)
+            chr_list.append(chrom)
+        return chr_list
+
     def _read_csv(self, input_filename):
         """ Read csv generated by :class:'GenomeCov' and create
         :class:'ChromosomeCov' list.
@@ -379,34 +705,58 @@ class GenomeCov(object):
                 mid = int(self.window_size/2)
                 chrom.range = [mid, -mid]
             chrom.mixture_fitting = mixture.EM(
-                chrom.df['scale'][chrom.range[0]:chrom.range[1]])
+                chrom.data['scale'][chrom.range[0]:chrom.range[1]])
         return chr_list
 
     def _set_chr_list(self, df):
         df = df.set_index("chr", drop=False)
-        return [ChromosomeCov(df.loc[key], self, self.thresholds) for key in
+        return [ChromosomeCov(df.loc[[key]], self, self.thresholds) for key in
                 df.index.unique()]
 
     def compute_gc_content(self, fasta_file, window_size=101, circular=False,
-                           letters=['G', 'C', 'c', 'g']):
+                           letters=['G', 'C', 'c', 'g'], threads=1):
         """ Compute GC content of genome sequence.
 
         :param str fasta_file: fasta file name.
         :param int window_size: size of the sliding window.
         :param bool circular: if the genome is circular (like bacteria
             chromosome)
+        :param int threads: number of chromosomes processed in parallel
 
         Store the results in the :attr:`ChromosomeCov.df` attribute (dataframe)
             with a column named *gc*.
 
+        In lazy mode, the GC content of the chromosomes that are not loaded
+        is computed from the reference when they are accessed. The reference
+        is indexed (.fai) if possible; otherwise (e.g. read-only directory),
+        it is read sequentially to find each chromosome.
         """
         self.gc_window_size = window_size
         self.circular = circular
-        gc_dict = gc_content(fasta_file, self.gc_window_size, circular,
-                             letters=letters)
+        if self.lazy:
+            import pysam
+            try:
+                names = set(pysam.FastaFile(fasta_file).references)
+                indexed = True
+            except (IOError, OSError, ValueError):
+                logger.warning("%s cannot be indexed. It will be read "
+                               "sequentially" % fasta_file)
+                with pysam.FastxFile(fasta_file) as fasta:
+                    names = set(record.name for record in fasta)
+                indexed = False
+            self._gc_params = (fasta_file, self.gc_window_size, circular,
+                               letters, indexed)
+        else:
+            gc_dict = gc_content(fasta_file, self.gc_window_size, circular,
+                                 letters=letters, threads=threads)
+            names = gc_dict.keys()
         for chrom in self.chr_list:
-            if chrom.chrom_name in gc_dict.keys():
-                chrom.df["gc"] = gc_dict[chrom.chrom_name]
+            if chrom.chrom_name in names:
+                if self.lazy:
+                    if chrom.is_loaded:
+                        chrom._set_column("gc", chrom._get_gc_content())
+                else:
+                    chrom._set_column("gc", gc_dict[chrom.chrom_name])
             else:
                 msg = ("The chromosome (or contig) %s in your"
                        " BED/BAM file was not found in the reference provided."
@@ -425,7 +775,10 @@ class GenomeCov(object):
         """
         stats = {}
         for chrom in self.chr_list:
+            loaded = chrom.is_loaded
             stats[chrom.chrom_name] = chrom.get_stats(output=output)
+            if not loaded:
+                chrom.release()
         return stats
 
     def hist(self, logx=True, logy=True, fignum=1, N=20, lw=2, **kwargs):
@@ -440,9 +793,6 @@ class GenomeCov(object):
         :param str output_filename: csv output file name.
         :param **dict kwargs: parameters of :meth:`pandas.DataFrame.to_csv`.
         """
-        # Concatenate all df
-        df_list = [chrom.get_df() for chrom in self.chr_list]
-        df = pd.concat(df_list)
         header = ("# sequana_coverage thresholds:{0} window_size:{1} circular:"
                   "{2}".format(self.thresholds.get_args(), self.window_size,
                   self.circular))
@@ -454,7 +804,12 @@ class GenomeCov(object):
             print(header, file=fp)
             for chrom in self.chr_list:
                 print("# {0}".format(chrom.get_gaussians()), file=fp)
-            df.to_csv(fp, **kwargs)
+            # chromosomes are written one after the other
+            for i, chrom in enumerate(self.chr_list):
+                loaded = chrom.is_loaded
+                chrom.get_df().to_csv(fp, header=(i == 0), **kwargs)
+                if not loaded:
+                    chrom.release()
 
 
 class ChromosomeCov(object):
@@ -484,19 +839,49 @@ class ChromosomeCov(object):
     .. seealso:: sequana_coverage standalone application
     """
 
-    def __init__(self, df, genomecov, thresholds=None):
+    def __init__(self, df, genomecov, thresholds=None, filerange=None,
+                 chrom_name=None, size=None):
         """.. rubric:: constructor
 
         :param df: dataframe with position for a chromosome used within
             :class:`GenomeCov`. Must contain the following columns:
-            ["chr", "pos", "cov"]
+            ["chr", "pos", "cov"]. May be None if *filerange* is provided.
         :param thresholds: a data structure :class:`DoubleThresholds` that holds
             the double threshold values.
-
+        :param filerange: a tuple (filename, start, stop) with the byte range
+            of the chromosome in a BED file or a tuple (filename, name) for a
+            contig of an indexed BAM file. The data is then read when
+            accessed.
+        :param str chrom_name: name of the chromosome (lazy mode only)
+        :param int size: number of positions (lazy mode only)
+
+        The data is not stored as a dataframe but as NumPy arrays: positions
+        are implicit if contiguous, coverage columns use the smallest
+        unsigned integer type and other columns (e.g., running median,
+        zscore, GC content) are float32. The :attr:`df` dataframe is built on
+        demand.
         """
         self._bed = genomecov
-        self.df = df.set_index("pos", drop=False)
-        self.chrom_name = str(df["chr"].iloc[0])
+        self._filerange = filerange
+        # dataframe returned by the df attribute (written back to the arrays
+        # when they are used)
+        self._df = None
+        # size, mean coverage and coefficient of variation are kept when the
+        # data of a lazy chromosome is released
+        self._summary = {}
+        self._data = None
+        # set by compute_zscore_by_block
+        self._block_params = None
+        self._block_cache = None
+        self._start = 1
+        self._pos = None
+        if df is None:
+            self.chrom_name = chrom_name
+            if size is not None:
+                self._summary["size"] = size
+        else:
+            self.chrom_name = str(df["chr"].iloc[0])
+            self._set_df(df)
 
         try:
             self.thresholds = thresholds.copy()
@@ -507,9 +892,9 @@ class ChromosomeCov(object):
         stats = self.get_stats(output="dataframe")
         stats.set_index("name", inplace=True)
         def _getter(data, key):
-            return data.ix[key].Value
+            return data.loc[key].Value
 
-        txt = "\nGenome length: %s" % int(len(self.df))
+        txt = "\nGenome length: %s" % int(len(self))
         txt += "\nSequencing depth (DOC): %8.2f " % _getter(stats,'DOC')
         txt += "\nSequencing depth (median): %8.2f " % _getter(stats, 'Median')
         txt += "\nBreadth of coverage (BOC) (percent): %.2f " % _getter(
@@ -521,7 +906,147 @@ class ChromosomeCov(object):
         return txt
 
     def __len__(self):
-        return self.df.__len__()
+        if self._data is None and "size" in self._summary:
+            return self._summary["size"]
+        return len(self.data["cov"])
+
+    def _get_data(self):
+        if self._df is not None:
+            # the dataframe may have been changed in place
+            self._set_df(self._df)
+        if self._data is None:
+            if len(self._filerange) == 2:
+                self._read_bam()
+            else:
+                self._set_df(self._read_bed())
+        return self._data
+    data = property(_get_data, doc="dictionary of NumPy arrays (one per column)")
+
+    def _get_df(self, rows=slice(None)):
+        # build a dataframe for a subset of rows (slice or boolean mask)
+        pos = self.pos[rows]
+        df = pd.DataFrame({"chr": self.chrom_name, "pos": pos}, index=pos)
+        for name, values in self.data.items():
+            df[name] = values[rows]
+        return df
+
+    def _get_cached_df(self):
+        if self._df is None:
+            df = self._get_df()
+            # counts are not kept in small unsigned types so that they can be
+            # changed in place (e.g. df["cov"] += 100)
+            for name in ("cov", "mapq0"):
+                if name in df.columns:
+                    df[name] = df[name].astype(np.int64)
+            self._df = df
+        return self._df
+
+    def _set_df(self, df):
+        self._df = None
+        data = collections.OrderedDict()
+        pos = np.asarray(df["pos"])
+        if len(pos) and np.all(np.diff(pos) == 1):
+            self._start = int(pos[0])
+            self._pos = None
+        else:
+            self._pos = pos
+        for name in df.columns:
+            if name in {"chr", "pos"}:
+                continue
+            if name in {"cov", "mapq0"}:
+                data[name] = _as_counts(df[name].values)
+            else:
+                data[name] = np.asarray(df[name], dtype=np.float32)
+        self._data = data
+    df = property(_get_cached_df, _set_df, doc="""dataframe with the chromosome data
+
+        The dataframe is built when this attribute is accessed and kept until
+        the data is used again: changes made in place (e.g.
+        ``chrom.df["cov"] += 100``) are then written back to the arrays and
+        the dataframe is built again on the next access.""")
+
+    def _get_pos(self):
+        if self._pos is not None:
+            return self._pos
+        return np.arange(self._start, self._start + len(self))
+    pos = property(_get_pos, doc="positions of the chromosome")
+
+    def _get_is_loaded(self):
+        return self._data is not None
+    is_loaded = property(_get_is_loaded,
+        doc="False if the data of a lazy chromosome is not in memory")
+
+    def _set_column(self, name, values):
+        # derived columns are stored as float32
+        self.data[name] = np.asarray(values, dtype=np.float32)
+
+    def _read_bed(self):
+        # read the chromosome from its byte range in the BED file
+        filename, start, stop = self._filerange
+        with open(filename, "rb") as fin:
+            fin.seek(start)
+            data = fin.read(stop - start)
+        df = pd.read_table(io.BytesIO(data), header=None)
+        df = df.rename(columns={0: "chr", 1: "pos", 2: "cov", 3: "mapq0"})
+        if self.bed._gc_params:
+            df["gc"] = self._get_gc_content()
+        return df
+
+    def _read_bam(self):
+        # compute the coverage of the contig from an indexed BAM file
+        filename, name = self._filerange
+        self._set_counts(*_get_bam_coverage((filename, name, 1)))
+
+    def _set_counts(self, cov, mapq0):
+        # set the data from coverage arrays starting at position 1
+        data = collections.OrderedDict()
+        data["cov"] = _as_counts(cov)
+        data["mapq0"] = _as_counts(mapq0)
+        self._start = 1
+        self._pos = None
+        self._data = data
+        if self.bed._gc_params:
+            self._set_column("gc", self._get_gc_content())
+
+    def _get_gc_content(self):
+        import pysam
+        from sequana.tools import _get_window_content
+        filename, window_size, circular, letters, indexed = self.bed._gc_params
+        if indexed:
+            sequence = pysam.FastaFile(filename).fetch(self.chrom_name)
+        else:
+            with pysam.FastxFile(filename) as fasta:
+                sequence = next(record.sequence for record in fasta
+                                if record.name == self.chrom_name)
+        return _get_window_content(sequence, window_size, letters, circular)
+
+    def release(self):
+        """Free the data of a chromosome read lazily from a BED or BAM file
+
+        The size, mean coverage and coefficient of variation are kept. Other
+        columns (e.g. running median and zscore) are lost and the raw data
+        is read again if accessed. Nothing is done if the chromosome was not
+        created in lazy mode.
+        """
+        if self._filerange is None or self._data is None:
+            return
+        self._summary = self.summary
+        self._data = None
+        self._df = None
+
+    def _get_summary(self):
+        if self._data is None and "mean_cov" in self._summary:
+            return dict(self._summary)
+        return {"size": len(self), "mean_cov": self.get_mean_cov(),
+                "var_coef": self.get_var_coef()}
+
+    def _set_summary(self, summary):
+        self._summary = dict(summary)
+    summary = property(_get_summary, _set_summary, doc="""size, mean coverage
+        and coefficient of variation of the chromosome
+
+        Setting the summary of a released chromosome (e.g. computed by another
+        process) avoids reading its data again to get these values.""")
 
     @property
     def bed(self):
@@ -536,19 +1061,23 @@ class ChromosomeCov(object):
     def columns(self):
         """ Return immutable ndarray implementing an ordered, sliceable set.
         """
-        return self.df.columns
+        return pd.Index(["chr", "pos"] + list(self.data.keys()))
 
     def get_df(self):
-        return self.df.set_index("chr", drop=True)
+        return self._get_df().set_index("chr", drop=True)
 
     def get_size(self):
         return self.__len__()
 
     def get_mean_cov(self):
-        return self.df["cov"].mean()
+        if self._data is None and "mean_cov" in self._summary:
+            return self._summary["mean_cov"]
+        return self.data["cov"].mean()
 
     def get_var_coef(self):
-        return np.sqrt(self.df["cov"].var()) / self.get_mean_cov()
+        if self._data is None and "var_coef" in self._summary:
+            return self._summary["var_coef"]
+        return self.data["cov"].std(ddof=1) / self.get_mean_cov()
 
     def get_gaussians(self):
         return "{0}: {1}".format(self.chrom_name, self.gaussians_params)
@@ -570,33 +1099,39 @@ class ChromosomeCov(object):
         column named *ma*.
 
         """
-        N = len(self.df['cov'])
+        cov = self.data['cov']
+        N = len(cov)
         assert n < N/2
         from sequana.stats import moving_average
 
-        ret = np.cumsum(np.array(self.df["cov"]), dtype=float)
+        ret = np.cumsum(cov, dtype=float)
         ret[n:] = ret[n:] - ret[:-n]
         ma = ret[n - 1:] / n
         mid = int(n / 2)
-        self.df["ma"] = pd.Series(ma, index=np.arange(start=mid,
-            stop=(len(ma) + mid)))
+        values = np.empty(N, dtype=np.float32)
+        values[:] = np.nan
+        values[mid:len(ma) + mid] = ma
 
         if circular:
             # FIXME: shift of +-1 as compared to non circular case...
             # shift the data and compute the moving average
-            self.data = list(self.df['cov'].values[N-n:]) +\
-                list(self.df['cov'].values) + \
-                list(self.df['cov'].values[0:n])
-            ma = moving_average(self.data, n)
+            data = np.concatenate([cov[N-n:], cov, cov[0:n]])
+            ma = moving_average(data, n)
             self.ma = ma[n//2+1:-n//2]
-            self.df["ma"] = pd.Series(self.ma, index=self.df['cov'].index)
+            values = self.ma
+        self._set_column("ma", values)
 
-    def running_median(self, n, circular=False):
+    def running_median(self, n, circular=False, method="wavelet"):
         """Compute running median of genome coverage
 
         :param int n: window's size.
         :param bool circular: if a mapping is circular (e.g. bacteria
             whole genome sequencing), set to True
+        :param str method: *wavelet* uses the rank-based engine of
+            :mod:`sequana.running_median`, which handles circular genomes
+            natively and whose cost does not depend on the window size.
+            *pandas* uses the Pandas rolling function. Both give the same
+            results.
 
         Store the results in the :attr:`df` attribute (dataframe) with a
         column named *rm*.
@@ -610,33 +1145,27 @@ class ChromosomeCov(object):
         # in py2/py3 the division (integer or not) has no impact
         mid = int(n / 2)
         self.range = [None, None]
+        cov = self.data['cov']
         try:
-            if circular:
-                # BASED on running_median pure implementation, could be much
-                # slower than pure pandas rolling function. Keep those 4 lines
-                # for book keeping though.
-                #cover = list(self.df["cov"])
-                #cover = cover[-mid:] + cover + cover[:mid]
-                #rm = running_median.RunningMedian(cover, n).run()
-                #self.df["rm"] = rm[mid:-mid]
-                rm = pd.concat([self.df['cov'][-mid:],
-                                self.df['cov'],
-                                self.df['cov'][:mid]]).rolling(
-                                n, center=True).median()
-                self.df["rm"] = rm[mid:-mid]
+            if method == "wavelet":
+                rm = _rolling_median(cov, n, circular=circular)
+            elif circular:
+                rm = pd.Series(np.concatenate([cov[-mid:], cov, cov[:mid]])
+                        ).rolling(n, center=True).median().values[mid:-mid]
+            else:
+                rm = pd.Series(cov).rolling(n, center=True).median().values
 
+            if circular:
+                self._set_column("rm", rm)
             else:
-                rm = self.df['cov'].rolling(n, center=True).median()
                 # Like in RunningMedian, we copy the NAN with real data
-                rm[0:mid] = self.df['cov'][0:mid]
-                rm[-mid:] = self.df['cov'][-mid:]
-                #rm = running_median.RunningMedian(cover, n).run()
-
-                self.df["rm"] = rm
+                rm[0:mid] = cov[0:mid]
+                rm[-mid:] = cov[-mid:]
+                self._set_column("rm", rm)
                 # set up slice for gaussian prediction
                 self.range = [mid, -mid]
         except:
-            self.df["rm"] = self.df["cov"]
+            self._set_column("rm", cov)
 
     def get_evenness(self):
         """Return Evenness of the coverage
@@ -648,7 +1177,7 @@ class ChromosomeCov(object):
 
         """
         from sequana.stats import evenness
-        return evenness(self.df['cov'])
+        return evenness(self.data['cov'])
 
     def get_cv(self):
         """Return the coefficient variation
@@ -658,8 +1187,8 @@ class ChromosomeCov(object):
         To get percentage, you must multiply by 100.
 
         """
-        sigma = self.df['cov'].std()
-        mu = self.df['cov'].mean()
+        sigma = self.data['cov'].std(ddof=1)
+        mu = self.data['cov'].mean()
         return sigma/mu
 
     def _coverage_scaling(self):
@@ -672,14 +1201,15 @@ class ChromosomeCov(object):
 
 
         """
-        if "rm" not in self.df.columns:
+        if "rm" not in self.data:
             txt = "Column rm (running median) is missing.\n" +  self.__doc__
             print(txt)
             raise KeyError
         else:
-            self.df["scale"] =  self.df["cov"] / self.df["rm"]
-        self.df = self.df.replace(np.inf, np.nan)
-        self.df = self.df.replace(-np.inf, np.nan)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scale = self.data["cov"] / self.data["rm"]
+            scale[np.isinf(scale)] = np.nan
+            self._set_column("scale", scale)
 
     def _get_best_gaussian(self):
         results_pis = [model["pi"] for model in self.gaussians_params]
@@ -700,31 +1230,41 @@ class ChromosomeCov(object):
         .. note:: needs to call :meth:`running_median` before hand.
 
         """
-        # here for lazy import
-        from biokit.stats import mixture
+        self._block_params = None
         # normalize coverage
         self._coverage_scaling()
 
-        data = self.df['scale'][self.range[0]:self.range[1]]
+        data = self.data['scale'][self.range[0]:self.range[1]]
 
         if len(data) < 100000:
             step = 1
 
         # remove nan and inf values
-        data = data.replace(0, np.nan)
-        data = data.dropna()
+        data = data[(data != 0) & ~np.isnan(data)]
 
-        if data.empty:
-            data = np.full(len(self.df), 1, dtype=int)
-            self.df['scale'] = data
+        if len(data) == 0:
+            data = np.full(len(self), 1, dtype=int)
+            self._set_column('scale', data)
 
+        self._fit_mixture(data[::step], k, use_em)
+
+        # warning when sigma is equal to 0
+        if self.best_gaussian["sigma"] == 0:
+            logger.warning("A problem related to gaussian prediction is "
+                  "detected. Be careful, Sigma is equal to 0.")
+            self._set_column("zscore", np.zeros(len(self), dtype=int))
+        else:
+            self._set_column("zscore", (self.data["scale"] -
+                self.best_gaussian["mu"]) / self.best_gaussian["sigma"])
+
+    def _fit_mixture(self, data, k, use_em):
+        # here for lazy import
+        from biokit.stats import mixture
         if use_em:
-            self.mixture_fitting = mixture.EM(
-                data[::step])
+            self.mixture_fitting = mixture.EM(data)
             self.mixture_fitting.estimate(k=k)
         else:
-            self.mixture_fitting = mixture.GaussianMixtureFitting(
-                data[::step],k=k)
+            self.mixture_fitting = mixture.GaussianMixtureFitting(data, k=k)
             self.mixture_fitting.estimate()
 
         # keep gaussians informations
@@ -734,15 +1274,6 @@ class ChromosomeCov(object):
                                  params_key} for i in range(k)]
         self.best_gaussian = self._get_best_gaussian()
 
-        # warning when sigma is equal to 0
-        if self.best_gaussian["sigma"] == 0:
-            logger.warning("A problem related to gaussian prediction is "
-                  "detected. Be careful, Sigma is equal to 0.")
-            self.df["zscore"] = np.zeros(len(self.df), dtype=int)
-        else:
-            self.df["zscore"] = (self.df["scale"] - self.best_gaussian["mu"]) / \
-                self.best_gaussian["sigma"]
-
         # Naive checking that the
         if k == 2:
             mus = self.gaussians['mus']
@@ -761,6 +1292,139 @@ class ChromosomeCov(object):
                 logger.warning(("Warning: k=2 but note that |mu0-mu1| < sigma0. "
                         "k=1 could be a better choice"))
 
+    def compute_zscore_by_block(self, n, circular=False, k=2, step=10,
+                                use_em=True, block_size=1000000, limits=None):
+        """Compute running median and zscore by blocks for long chromosomes
+
+        :param int n: running median window's size.
+        :param bool circular: if a mapping is circular (e.g. bacteria
+            whole genome sequencing), set to True
+        :param int k: Number gaussian predicted in mixture (default = 2)
+        :param int step: (default = 10). Only one normalised coverage value
+            every *step* is used to fit the mixture model. Ignored if the
+            length of the coverage/sequence is below 100,000
+        :param int block_size: number of positions per block
+        :param limits: a tuple (low, high) of zscores. Positions with a
+            zscore outside of these limits are kept as well as those outside
+            of the double thresholds. See below.
+
+        This is equivalent to :meth:`running_median` followed by
+        :meth:`compute_zscore` except that the running median, normalised
+        coverage and zscore are not stored. Each block is extended by n/2
+        positions on both sides so that the running median is exactly the
+        same as on the full chromosome. A first pass over the blocks
+        collects the sample used to fit the mixture model. The zscore is
+        then computed again block by block the first time it is needed, e.g.
+        to get the region of interests (:meth:`get_roi`), and only positions
+        outside of the double thresholds (or of *limits* if wider) are
+        kept. Later calls with thresholds within these limits (e.g.
+        :meth:`get_centralness` with other thresholds) use the positions
+        kept; otherwise the blocks are computed again. Besides the coverage
+        itself, memory is therefore proportional to the block size and to
+        the number of positions kept.
+        """
+        self.bed.window_size = n
+        self.bed.circular = circular
+        for name in ("rm", "scale", "zscore"):
+            self.data.pop(name, None)
+        self._block_params = {"n": n, "circular": circular,
+                              "block_size": block_size, "scale": True,
+                              "limits": limits}
+        self._block_cache = None
+
+        # positions used to fit the mixture model as in compute_zscore
+        mid = n // 2
+        first, last = (0, len(self)) if circular else (mid, len(self) - mid)
+        if last - first < 100000:
+            step = 1
+        samples = []
+        count = 0
+        for start, stop, rm, scale in self._iter_scale_blocks():
+            scale = scale[max(first - start, 0):max(last - start, 0)]
+            scale = scale[(scale != 0) & ~np.isnan(scale)]
+            samples.append(scale[(step - count) % step::step])
+            count += len(scale)
+        data = np.concatenate(samples)
+        if len(data) == 0:
+            data = np.full(len(self), 1, dtype=int)[::step]
+            self._block_params["scale"] = False
+
+        self._fit_mixture(data, k, use_em)
+        if self.best_gaussian["sigma"] == 0:
+            logger.warning("A problem related to gaussian prediction is "
+                  "detected. Be careful, Sigma is equal to 0.")
+
+    def _iter_scale_blocks(self):
+        # running median and normalised coverage by block (block mode)
+        n = self._block_params["n"]
+        block_size = self._block_params["block_size"]
+        cov = self.data["cov"]
+        N = len(cov)
+        mid = n // 2
+        for start in range(0, N, block_size):
+            stop = min(start + block_size, N)
+            if self._block_params["circular"]:
+                block = np.take(cov, np.arange(start - mid, stop + mid),
+                                mode="wrap")
+                rm = _rolling_median(block, n)[mid:mid + stop - start]
+            else:
+                low, high = max(0, start - mid), min(N, stop + mid)
+                rm = _rolling_median(cov[low:high], n)
+                rm = rm[start - low:stop - low]
+                # as in running_median, edges are the coverage itself
+                pos = np.arange(start, stop)
+                edges = (pos < mid) | (pos >= N - mid) if mid else True
+                rm = np.where(edges, cov[start:stop], rm)
+            rm = rm.astype(np.float32)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scale = cov[start:stop] / rm
+            scale[np.isinf(scale)] = np.nan
+            if not self._block_params["scale"]:
+                scale = np.ones(stop - start, dtype=np.float32)
+            yield start, stop, rm, scale
+
+    def _get_filtered_df_by_block(self):
+        # positions with a zscore outside of the double thresholds. They are
+        # taken from the positions kept by a previous call if its limits
+        # include the current thresholds
+        low, high = self.thresholds.low2, self.thresholds.high2
+        cache = self._block_cache
+        if cache is None or low > cache["low"] or high < cache["high"]:
+            if cache is None:
+                limits = self._block_params["limits"] or (low, high)
+                low, high = max(low, limits[0]), min(high, limits[1])
+            else:
+                low, high = max(low, cache["low"]), min(high, cache["high"])
+            self._block_cache = cache = self._collect_blocks(low, high)
+
+        zscore = cache["zscore"]
+        mask = (zscore > self.thresholds.high2) | \
+               (zscore < self.thresholds.low2)
+        df = self._get_df(cache["index"][mask])
+        for name in ("rm", "scale", "zscore"):
+            df[name] = cache[name][mask]
+        return df
+
+    def _collect_blocks(self, low, high):
+        # running median, normalised coverage and zscore of the positions
+        # with a zscore outside of [low, high], computed block by block
+        mu = self.best_gaussian["mu"]
+        sigma = self.best_gaussian["sigma"]
+        kept = collections.defaultdict(list)
+        for start, stop, rm, scale in self._iter_scale_blocks():
+            if sigma == 0:
+                zscore = np.zeros(stop - start, dtype=np.float32)
+            else:
+                zscore = ((scale - mu) / sigma).astype(np.float32)
+            mask = (zscore > high) | (zscore < low)
+            kept["index"].append(np.flatnonzero(mask) + start)
+            kept["rm"].append(rm[mask])
+            kept["scale"].append(np.asarray(scale[mask], dtype=np.float32))
+            kept["zscore"].append(zscore[mask])
+        cache = {name: np.concatenate(values) for name, values in kept.items()}
+        cache.update({"low": low, "high": high})
+        return cache
+
     def get_centralness(self):
         """Proportion of central (normal) genome coverage
 
@@ -774,6 +1438,14 @@ class ChromosomeCov(object):
         Cminus = sum(filtered.get_low_roi()['size'])
         return 1 - (Cplus+Cminus) / float(len(self))
 
+    def _get_filtered_df(self):
+        # positions with a zscore outside of the double thresholds
+        if self._block_params and "zscore" not in self.data:
+            return self._get_filtered_df_by_block()
+        zscore = self.data["zscore"]
+        mask = (zscore > self.thresholds.high2) | (zscore < self.thresholds.low2)
+        return self._get_df(mask)
+
     def get_roi(self):
         """Keep positions with zscore outside of the thresholds range.
 
@@ -781,45 +1453,10 @@ class ChromosomeCov(object):
 
         .. note:: depends on the :attr:`thresholds` low and high values.
         """
-        features = self.bed.feature_dict
         try:
-            second_high = self.thresholds.high2
-            second_low = self.thresholds.low2
-            query = "zscore > @second_high or zscore < @second_low"
-
-            # in the genbank, the names appears as e.g. JB12345
-            # but in the fasta or BED files, it may be something like
-            # gi|269939526|emb|FN433596.1|
-            # so they do not match. We can try to guess it
-            alternative = None
-
-            if features:
-                if self.chrom_name not in features.keys():
-                    msg = """Chromosome name (%s) not found
-                        in the genbank. Make sure the chromosome names in
-                        the BAM/BED files are compatible with the genbank
-                        content. Genbank files contains the following keys """
-                    for this in features.keys():
-                        msg += "\n                        - %s" % this
-
-                    alternative = [x for x in self.chrom_name.split("|") if x]
-                    alternative = alternative[-1] # assume the accession is last
-                    alternative = alternative.split('.')[0] # remove version
-                    if alternative in features.keys():
-                        msg += "\n Guessed the chromosome name to be: %s" % alternative
-                    else:
-                        features = None
-                    logger.warning(msg % self.chrom_name)
-
-            if features:
-                if alternative:
-                    return FilteredGenomeCov(self.df.query(query), self.thresholds,
-                        features[alternative])
-                else:
-                    return FilteredGenomeCov(self.df.query(query), self.thresholds,
-                        features[self.chrom_name])
-            else:
-                return FilteredGenomeCov(self.df.query(query), self.thresholds)
+            df = self._get_filtered_df()
+            return FilteredGenomeCov(df, self.thresholds,
+                self.bed._get_feature_index(self.chrom_name))
         except KeyError:
             logger.error("Column zscore is missing in data frame.\n"
                          "You must run compute_zscore before get low coverage."
@@ -861,33 +1498,34 @@ class ChromosomeCov(object):
         """
         # z = (X/rm - \mu ) / sigma
         high_zcov = (self.thresholds.high * self.best_gaussian["sigma"] +
-                self.best_gaussian["mu"]) * self.df["rm"]
+                self.best_gaussian["mu"]) * self.data["rm"]
         low_zcov = (self.thresholds.low * self.best_gaussian["sigma"] +
-                self.best_gaussian["mu"]) * self.df["rm"]
+                self.best_gaussian["mu"]) * self.data["rm"]
+        pos = self.pos
 
         pylab.clf()
         ax = pylab.gca()
         ax.set_facecolor('#eeeeee')
-        pylab.xlim(0,self.df["pos"].iloc[-1])
+        pylab.xlim(0, pos[-1])
         axes = []
         labels = []
 
         # 1,000,000 points is a lot for matplotlib. Let us restrict ourself to 1
         # million points for now.
-        if len(self.df) > 1000000 and sample is True:
-            NN = int(len(self.df)/1000000)
+        if len(self) > 1000000 and sample is True:
+            NN = int(len(self)/1000000)
         else:
             NN = 1
 
         # the main coverage plot
-        p1, = pylab.plot(self.df["cov"][::NN], color=main_color, label="Coverage",
-                linewidth=main_lw, **main_kwargs)
+        p1, = pylab.plot(pos[::NN], self.data["cov"][::NN], color=main_color,
+                label="Coverage", linewidth=main_lw, **main_kwargs)
         axes.append(p1)
         labels.append("Coverage")
 
         # The running median plot
         if rm_lw > 0:
-            p2, = pylab.plot(self.df["rm"][::NN],
+            p2, = pylab.plot(pos[::NN], self.data["rm"][::NN],
                     color=rm_color,
                     linewidth=rm_lw,
                     label=rm_label)
@@ -896,10 +1534,10 @@ class ChromosomeCov(object):
 
         # The threshold curves
         if th_lw > 0:
-            p3, = pylab.plot(high_zcov[::NN], linewidth=th_lw, color=th_color, ls=th_ls,
-                label="Thresholds")
-            p4, = pylab.plot(low_zcov[::NN], linewidth=th_lw, color=th_color, ls=th_ls,
-                label="_nolegend_")
+            p3, = pylab.plot(pos[::NN], high_zcov[::NN], linewidth=th_lw,
+                color=th_color, ls=th_ls, label="Thresholds")
+            p4, = pylab.plot(pos[::NN], low_zcov[::NN], linewidth=th_lw,
+                color=th_color, ls=th_ls, label="_nolegend_")
             axes.append(p3)
             labels.append("Thresholds")
 
@@ -912,8 +1550,8 @@ class ChromosomeCov(object):
         # Let us restrict it
         if set_ylimits is True:
             pylab.ylim([0, min([
-                high_zcov.max() * 1.5,
-                self.df["cov"].mean()*6])])
+                np.nanmax(high_zcov) * 1.5,
+                self.data["cov"].mean()*6])])
         else:
             pylab.ylim([0, pylab.ylim()[1]])
 
@@ -927,7 +1565,7 @@ class ChromosomeCov(object):
 
     def _set_bins(self, df, binwidth):
         try:
-            bins = np.arange(min(df), max(df) + binwidth, binwidth)
+            bins = np.arange(np.min(df), np.max(df) + binwidth, binwidth)
         except ValueError:
             return 100
         if bins.any():
@@ -940,10 +1578,10 @@ class ChromosomeCov(object):
 
         """
         pylab.clf()
-        bins = self._set_bins(self.df["zscore"][self.range[0]:self.range[1]],
-                              binwidth)
-        self.df["zscore"][self.range[0]:self.range[1]].hist(
-            grid=True, bins=bins, **hist_kargs)
+        zscore = self.data["zscore"][self.range[0]:self.range[1]]
+        zscore = zscore[~np.isnan(zscore)]
+        bins = self._set_bins(zscore, binwidth)
+        pd.Series(zscore).hist(grid=True, bins=bins, **hist_kargs)
         pylab.xlabel("Z-Score", fontsize=fontsize)
         try:
             pylab.tight_layout()
@@ -959,9 +1597,10 @@ class ChromosomeCov(object):
         """
         pylab.clf()
         # if there are a NaN -> can't set up binning
-        d = self.df["scale"][self.range[0]:self.range[1]].dropna()
+        d = self.data["scale"][self.range[0]:self.range[1]]
+        d = d[~np.isnan(d)]
         # remove outlier -> plot crash if range between min and max is too high
-        d = d[np.abs(d - d.mean()) <= (4 * d.std())]
+        d = d[np.abs(d - d.mean()) <= (4 * d.std(ddof=1))]
         bins = self._set_bins(d, binwidth)
         self.mixture_fitting.data = d
         try:
@@ -991,7 +1630,7 @@ class ChromosomeCov(object):
         ax = pylab.gca()
         ax.set_facecolor('#eeeeee')
 
-        data = self.df['cov'].dropna().values
+        data = _dropna(self.data['cov'])
 
         maxcov = data.max()
         if logx is True and logy is True:
@@ -1049,7 +1688,7 @@ class ChromosomeCov(object):
                         directory)
                     logger.error(msg)
                     raise FileExistsError
-        return self.df[start:stop].to_csv(filename, **kwargs)
+        return self._get_df(slice(start, stop)).to_csv(filename, **kwargs)
 
     def plot_gc_vs_coverage(self, filename=None, bins=None, Nlevels=6,
                             fontsize=20, norm="log", ymin=0, ymax=100,
@@ -1058,13 +1697,12 @@ class ChromosomeCov(object):
         if Nlevels is None or Nlevels==0:
             contour = False
 
-        data = self.df[['cov','gc']].copy()
-        data['gc'] *= 100
-        data = data.dropna()
+        data = pd.DataFrame({"cov": self.data["cov"],
+                             "gc": self.data["gc"] * 100}).dropna()
         if bins is None:
             bins = [100, min(int(data['gc'].max()-data['gc'].min()+1),
                     max(5,self.bed.gc_window_size - 4))]
-            bins[0] = max(10, min(bins[0], self.df['cov'].max()))
+            bins[0] = max(10, min(bins[0], self.data['cov'].max()))
 
         from biokit import Hist2D
         h2 = Hist2D(data)
@@ -1094,7 +1732,8 @@ class ChromosomeCov(object):
         (default window size is 101)
 
         """
-        return self.df[['cov', 'gc']].corr().iloc[0, 1]
+        data = pd.DataFrame({"cov": self.data["cov"], "gc": self.data["gc"]})
+        return data.corr().iloc[0, 1]
 
     def get_max_gc_correlation(self, reference, guess=100):
         """Plot correlation between coverage and GC content by varying the GC window
@@ -1128,19 +1767,18 @@ class ChromosomeCov(object):
 
     def get_stats(self, output="json"):
         """Return basic stats about the coverage data"""
-        data = self.df
+        cov = _dropna(self.data['cov'])
 
         stats = {
-            'DOC': self.df['cov'].mean(),
-            'STD': self.df['cov'].std(),
-            'Median': self.df['cov'].median(),
-            'BOC': 100 * sum(self.df['cov'] > 0) / float(len(self.df))}
+            'DOC': cov.mean(),
+            'STD': cov.std(ddof=1),
+            'Median': np.median(cov),
+            'BOC': 100 * np.count_nonzero(cov > 0) / float(len(cov))}
         try:
             stats['CV'] = stats['STD'] / stats['DOC']
         except:
             stats['CV'] = np.nan
-        stats['MAD'] = np.median(abs(data['cov'].median() -
-                                 data['cov']).dropna())
+        stats['MAD'] = np.median(abs(stats['Median'] - cov))
 
         names = ['BOC', 'CV', 'DOC', 'MAD', 'Median', 'STD']
         descriptions = [
@@ -1154,8 +1792,8 @@ class ChromosomeCov(object):
             "standard deviation."
         ]
 
-        if 'gc' in self.df.columns:
-            stats['GC'] = self.df['gc'].mean() * 100
+        if 'gc' in self.data:
+            stats['GC'] = np.nanmean(self.data['gc'], dtype=np.float64) * 100
             names.append('GC')
             descriptions.append("GC content in %")
 
@@ -1170,6 +1808,78 @@ class ChromosomeCov(object):
             return df
 
 
+class _FeatureIndex(object):
+    """Interval index of the features of a chromosome
+
+    Features are sorted by start position. Their end positions may not be
+    sorted (overlapping or nested features) so the running maximum of the
+    ends is kept as well: with two binary searches, all features that
+    may overlap an interval are found, then the candidates are checked.
+    All intervals are queried at once.
+
+    :target: developers only
+    """
+    #: annotation columns and the dictionary keys used to fill them
+    _columns = {"gene_start": ("gene_start",), "gene_end": ("gene_end",),
+                "type": ("type",), "gene": ("gene", "locus_tag"),
+                "strand": ("strand",), "product": ("product", "note")}
+
+    def __init__(self, feature_list, exclude=()):
+        """.. rubric:: constructor
+
+        :param list feature_list: features of a chromosome as returned by
+            :func:`~sequana.tools.genbank_features_parser`.
+        :param exclude: feature types to ignore.
+        """
+        features = [x for x in feature_list if x["type"] not in exclude]
+        starts = np.array([x["gene_start"] for x in features], dtype=np.int64)
+        order = np.argsort(starts, kind="mergesort")
+        features = [features[i] for i in order]
+
+        self.starts = starts[order]
+        self.ends = np.array([x["gene_end"] for x in features], dtype=np.int64)
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) \
+            else self.ends
+        self.columns = {}
+        for column, keys in self._columns.items():
+            values = np.empty(len(features), dtype=object)
+            for i, feature in enumerate(features):
+                value = "None"
+                for key in keys:
+                    if key in feature:
+                        value = feature[key]
+                        break
+                values[i] = value
+            self.columns[column] = values
+        for column in ("gene_start", "gene_end"):
+            self.columns[column] = getattr(self, column[5:] + "s")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, starts, ends):
+        """Return all pairs of overlapping intervals and features
+
+        :param starts: first positions of the intervals.
+        :param ends: last positions of the intervals (included).
+        :return: indices of the intervals and of the features, sorted by
+            interval then by feature start.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        # features before lo end before the interval; features from hi
+        # start after the interval
+        lo = np.searchsorted(self.max_ends, starts, "left")
+        hi = np.searchsorted(self.starts, ends, "right")
+        counts = np.maximum(hi - lo, 0)
+        total = counts.sum()
+        intervals = np.repeat(np.arange(len(starts)), counts)
+        features = np.repeat(lo - np.cumsum(counts) + counts, counts) + \
+            np.arange(total)
+        keep = self.ends[features] >= starts[intervals]
+        return intervals[keep], features[keep]
+
+
 class FilteredGenomeCov(object):
     """Class used within :class:`ChromosomeCov` to select a subset of the
     original GenomeCov
@@ -1186,13 +1896,19 @@ class FilteredGenomeCov(object):
             ["pos", "cov", "rm", "zscore"]
         :param int threshold: a :class:`~sequana.bedtools.DoubleThresholds`
             instance.
+        :param feature_list: features of the chromosome used to annotate the
+            regions, either a list from
+            :func:`~sequana.tools.genbank_features_parser` or a
+            :class:`_FeatureIndex`.
 
         """
-        if isinstance(feature_list, list) and len(feature_list) == 0:
-            feature_list = None
+        if isinstance(feature_list, list):
+            if len(feature_list) == 0:
+                feature_list = None
+            else:
+                feature_list = _FeatureIndex(feature_list,
+                                             self._feature_not_wanted)
         region_list = self._merge_region(df, threshold=threshold)
-        if feature_list:
-            region_list = self._add_annotation(region_list, feature_list)
         self.df = self._dict_to_df(region_list, feature_list)
 
         def func(x):
@@ -1211,21 +1927,6 @@ class FilteredGenomeCov(object):
     def __len__(self):
         return self.df.__len__()
 
-    def _merge_row(self, df, start, stop):
-        chrom = df["chr"][start]
-        cov = np.mean(df["cov"].loc[start:stop])
-        max_cov = np.max(df["cov"].loc[start:stop])
-        rm = np.mean(df["rm"].loc[start:stop])
-        zscore = np.mean(df["zscore"].loc[start:stop])
-        if zscore >= 0:
-            max_zscore = df["zscore"].loc[start:stop].max()
-        else:
-            max_zscore = df["zscore"].loc[start:stop].min()
-        size = stop - start + 1
-        return {"chr": chrom, "start": start, "end": stop + 1, "size": size,
-                "mean_cov": cov, "mean_rm": rm, "mean_zscore": zscore,
-                "max_zscore": max_zscore, "max_cov": max_cov}
-
     def _merge_region(self, df, threshold, zscore_label="zscore"):
         """Merge position side by side of a data frame.
 
@@ -1233,126 +1934,117 @@ class FilteredGenomeCov(object):
 
         :param threshold: the high threshold (standard one), not the low one.
 
-        .. todo:: to be documented
+        Consecutive positions form a run as long as their zscore has the
+        same sign as the first zscore of the run. A region goes from the
+        first to the last position of a run that is beyond the thresholds.
+        Runs and regions are found with boolean masks and the statistics of
+        all regions are computed at once.
         """
-        region_start = None
-        region_stop = None
-        start = 1
-        stop = 1
-        prev = 1
-        # handle case where for example position n-1 have a zscore of -5 and n
-        # have a zscore of 5. It is two different regions.
-        region_zscore = 0
-
-        merge_df = []
-        for pos, zscore in zip(df["pos"], df[zscore_label]):
-            stop = pos
-            if stop - 1 == prev and zscore * region_zscore >= 0:
-                prev = stop
+        pos = np.asarray(df["pos"])
+        zscore = np.asarray(df[zscore_label])
+        N = len(pos)
+        if N == 0:
+            return []
+
+        # positions are compared to the previous one. Before the first
+        # position, there is a run at position 1 with a zscore of zero
+        nan = np.isnan(zscore)
+        breaks = np.empty(N, dtype=bool)
+        breaks[0] = pos[0] != 2
+        breaks[1:] = np.diff(pos) != 1
+        # a product with NaN is never positive
+        breaks |= nan
+        breaks[1:] |= nan[:-1]
+        sign = np.where(nan, 0, np.sign(zscore))
+
+        # within consecutive positions, a new run starts when the sign
+        # changes unless the first zscore is zero, in which case any sign
+        # is accepted
+        first_sign = sign[breaks]
+        stretch = np.cumsum(breaks)
+        if breaks[0]:
+            stretch -= 1
+        else:
+            first_sign = np.concatenate([[0], first_sign])
+        last = np.maximum.accumulate(np.where(sign != 0, np.arange(N), 0))
+        run_start = breaks.copy()
+        run_start[1:] |= (first_sign[stretch[1:]] != 0) & (sign[1:] != 0) & \
+            (sign[1:] != sign[last[:-1]])
+        run = np.cumsum(run_start)
+
+        # first and last positions of each run beyond the thresholds
+        beyond = np.flatnonzero(((zscore > 0) & (zscore > threshold.high)) |
+                                ((zscore < 0) & (zscore < threshold.low)))
+        if len(beyond) == 0:
+            return []
+        new = np.diff(run[beyond]) != 0
+        starts = beyond[np.concatenate([[True], new])]
+        stops = beyond[np.concatenate([new, [True]])] + 1
+
+        # a region in the last run is kept only if the run starts before
+        # the last position
+        last_run = np.flatnonzero(run_start)
+        first_pos = pos[last_run[-1]] if len(last_run) else 1
+        if run[starts[-1]] == run[-1] and first_pos >= pos[-1]:
+            starts = starts[:-1]
+            stops = stops[:-1]
+        if len(starts) == 0:
+            return []
+
+        cov = np.asarray(df["cov"])
+        zscore_mean = _segment_mean(zscore, starts, stops)
+        max_zscore = np.where(zscore_mean >= 0,
+                              _segment_reduce(np.maximum, zscore, starts, stops),
+                              _segment_reduce(np.minimum, zscore, starts, stops))
+        return [{"chr": chrom, "start": start, "end": stop + 1,
+                 "size": stop - start + 1, "mean_cov": mean_cov,
+                 "mean_rm": mean_rm, "mean_zscore": mean_zscore,
+                 "max_zscore": this_max, "max_cov": max_cov}
+                for chrom, start, stop, mean_cov, mean_rm, mean_zscore,
+                    this_max, max_cov in zip(
+                    np.asarray(df["chr"])[starts], pos[starts].tolist(),
+                    pos[stops - 1].tolist(),
+                    _segment_mean(cov, starts, stops),
+                    _segment_mean(np.asarray(df["rm"]), starts, stops),
+                    zscore_mean, max_zscore,
+                    _segment_reduce(np.maximum, cov, starts, stops))]
+
+    def _add_annotation(self, merge_df, feature_index):
+        """ Add annotation of a :class:`_FeatureIndex` to the regions.
+
+        A region has one row per overlapping feature or a single row with
+        empty annotation if no feature overlaps it.
+        """
+        regions, features = feature_index.overlaps(merge_df["start"].values,
+                                                   merge_df["end"].values - 1)
+        counts = np.bincount(regions, minlength=len(merge_df))
+        rows = np.repeat(np.arange(len(merge_df)), np.maximum(counts, 1))
+        annotated = counts[rows] > 0
+        indices = np.zeros(len(rows), dtype=np.int64)
+        indices[annotated] = features
+
+        merge_df = merge_df.iloc[rows].reset_index(drop=True)
+        for column, values in feature_index.columns.items():
+            values = values[indices]
+            if annotated.all():
+                merge_df[column] = values
+            elif values.dtype == object:
+                merge_df[column] = np.where(annotated, values, None)
             else:
-                if region_start:
-                    merge_df.append(self._merge_row(df, region_start,
-                                    region_stop))
-                    region_start = None
-                start = stop
-                prev = stop
-                region_zscore = zscore
-
-            if zscore > 0 and zscore > threshold.high:
-                if not region_start:
-                    region_start = pos
-                    region_stop = pos
-                else:
-                    region_stop = pos
-            elif zscore < 0 and zscore < threshold.low:
-                if not region_start:
-                    region_start = pos
-                    region_stop = pos
-                else:
-                    region_stop = pos
-
-        if start < stop and region_start:
-            merge_df.append(self._merge_row(df, region_start, region_stop))
+                merge_df[column] = np.where(annotated, values, np.nan)
         return merge_df
 
-    def _add_annotation(self, region_list, feature_list):
-        """ Add annotation from a dictionary generated by parsers in
-        sequana.tools.
-        """
-        region_ann = []
-        # an iterator of features
-        iter_feature = iter(feature_list)
-        feature = next(iter_feature)
-        # pass "source" feature
-        while feature["type"] in FilteredGenomeCov._feature_not_wanted:
-            try:
-                feature = next(iter_feature)
-            except StopIteration:
-                print("Features types ({0}) are not present in the annotation"
-                      " file. Please change what types you want".format(
-                      feature['type']))
-                return region_ann
-        # merge regions and annotations
-        for region in region_list:
-            feature_exist = False
-            while feature["gene_end"] <= region["start"]:
-                try:
-                    feature = next(iter_feature)
-                except:
-                    break
-            while feature["gene_start"] < region["end"]:
-                # A feature exist for detected ROI
-                feature_exist = True
-                # put locus_tag in gene field if gene doesn't exist
-                try:
-                    feature["gene"]
-                except KeyError:
-                    try:
-                        feature["gene"] = feature["locus_tag"]
-                    except:
-                        feature["gene"] = "None"
-                # put note field in product if product doesn't exist
-                try:
-                    feature["product"]
-                except KeyError:
-                    try:
-                        feature["product"] = feature["note"]
-                    except:
-                        feature["product"] = "None"
-                # FIXME what that ?
-                #if region["start"] == 237433:
-                #    print(dict(region, **feature))
-                region_ann.append(dict(region, **feature))
-                try:
-                    feature = next(iter_feature)
-                except StopIteration:
-                    break
-            if feature_exist is False:
-                region_ann.append(dict(region, **{"gene_start": None,
-                                                  "gene_end": None,
-                                                  "type": None,
-                                                  "gene": None,
-                                                  "strand": None,
-                                                  "product": None}))
-        return region_ann
-
     def _dict_to_df(self, region_list, annotation):
         """ Convert dictionary as dataframe.
         """
-        merge_df = pd.DataFrame(region_list)
         colnames = ["chr", "start", "end", "size", "mean_cov", "max_cov",
-                    "mean_rm", "mean_zscore", "max_zscore", "gene_start",
-                    "gene_end", "type", "gene", "strand", "product"]
-        if not annotation:
-            colnames = colnames[:9]
+                    "mean_rm", "mean_zscore", "max_zscore"]
         merge_df = pd.DataFrame(region_list, columns=colnames)
         int_column = ["start", "end", "size"]
         merge_df[int_column] = merge_df[int_column].astype(int)
-        if annotation:
+        if annotation is not None:
+            merge_df = self._add_annotation(merge_df, annotation)
             merge_df.rename(columns={"gene": "gene_name"}, inplace=True)
-            # maybe let the user set what he wants
-            return merge_df.loc[~merge_df["type"].isin(
-                FilteredGenomeCov._feature_not_wanted)]
         return merge_df
 
     def _get_sub_range(self, seq_range):
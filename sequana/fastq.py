@@ -1,8 +1,10 @@
 """Utilities to manipulate FASTQ and Reads"""
 import io
+import os
+import json
 import time
 import zlib
-from itertools import islice
+from itertools import islice, chain, repeat
 import gzip
 import subprocess
 from functools import wraps
@@ -12,27 +14,242 @@ from collections import Counter, defaultdict
 from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab
+from sequana import logger
 from sequana.tools import GZLineCounter
 from easydev import Progress, do_profile
 
-from atropos.io.seqio import FastqReader
-
 import pysam
 from pysam import qualitystring_to_array
 
-try:
-    from itertools import izip_longest
-except:
-    from itertools import zip_longest as izip_longest
+__all__ = ["Identifier", "FastQ", "FastQC", "FastQBatch", "FastQIndex",
+    "FastQCCache", "FastQProfile", "DuplicationEstimator"]
+
+
+def _concat_ranges(starts, ends):
+    """Return indices of all positions in the [start, end) ranges
+
+    Used to gather the sequence (or quality) lines of a batch of reads into a
+    single array without a Python loop over the reads.
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    # for a range k, position j of the output maps onto
+    # starts[k] + j - (number of positions in ranges before k)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(total)
+
+
+def _open_output(filename, level=6):
+    # binary output file handler, gzipped if extension is .gz
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wb", compresslevel=level)
+    else:
+        return open(filename, "wb")
+
 
-# for filter fastq files. see below in FastQ for the usage
-# we want to take 4 lines at a time (assuming there is no empty lines)
-def grouper(iterable):
-    args = [iter(iterable)] * 4
-    return izip_longest(*args)
+def _open_raw(filename):
+    # binary and decompressed file handler
+    if filename.endswith('.gz'):
+        return gzip.open(filename, "rb")
+    else:
+        return open(filename, "rb")
 
 
-__all__ = ["Identifier", "FastQ", "FastQC"]
+def _write_data(data, filename, level=6):
+    with _open_output(filename, level) as fout:
+        fout.write(data)
+
+
+def _iter_line_blocks(chunks, N):
+    """Regroup blocks of bytes into blocks of exactly N lines
+
+    :param chunks: iterator over blocks of bytes
+    :param N: number of lines of each block or a list with the number of
+        lines of each block
+    :return: iterator over tuples made of a block and its number of lines.
+        The last block may have less than N lines.
+    """
+    sizes = iter(N) if isinstance(N, (list, tuple)) else repeat(N)
+    N = next(sizes)
+    pending = []
+    pending_lines = 0
+    for chunk in chunks:
+        n = chunk.count(b"\n")
+        start = 0
+        consumed = 0
+        newlines = None
+        while pending_lines + n - consumed >= N:
+            if newlines is None:
+                newlines = np.flatnonzero(np.frombuffer(chunk, np.uint8) == 10)
+            k = N - pending_lines
+            pos = int(newlines[consumed + k - 1]) + 1
+            pending.append(chunk[start:pos])
+            yield b"".join(pending), N
+            N = next(sizes, None)
+            if N is None:
+                return
+            pending = []
+            pending_lines = 0
+            start = pos
+            consumed += k
+        if start < len(chunk):
+            pending.append(chunk[start:])
+        pending_lines += n - consumed
+    data = b"".join(pending)
+    if data:
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        yield data, data.count(b"\n")
+
+
+def _read_range(filename, start, stop, chunksize=4*1024*1024):
+    # iterator over the blocks of a byte range of a (plain) file
+    with open(filename, "rb") as fin:
+        fin.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = fin.read(min(chunksize, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _find_record_start(fin, pos, size, chunksize=1024*1024):
+    """Return offset of the first record starting at or after pos
+
+    A record starts on a line starting with @ if the second next line starts
+    with +. Quality lines may start with @ but are then followed by a
+    sequence, which cannot start with +.
+    """
+    if pos == 0:
+        return 0
+    # we start one character before to know whether pos is a line start
+    start = pos - 1
+    fin.seek(start)
+    buf = b""
+    current = None
+    while True:
+        chunk = fin.read(chunksize)
+        buf += chunk
+        eof = not chunk or start + len(buf) >= size
+        if current is None:
+            current = buf.find(b"\n")
+            if current == -1:
+                if eof:
+                    return size
+                continue
+            current += 1
+        while True:
+            l1 = buf.find(b"\n", current)
+            l2 = buf.find(b"\n", l1 + 1) if l1 != -1 else -1
+            if l2 == -1 or l2 + 1 >= len(buf):
+                break
+            if buf[current:current+1] == b"@" and buf[l2+1:l2+2] == b"+":
+                return start + current
+            current = l1 + 1
+        if eof:
+            return size
+
+
+def _get_key(identifier):
+    """Return the part of an identifier shared by the two reads of a pair
+
+    That is the first word, without the @ character and /1 or /2 suffixes.
+    """
+    if isinstance(identifier, str):
+        identifier = identifier.encode()
+    words = identifier.split(None, 1)
+    key = words[0] if words else b""
+    if key.startswith(b"@"):
+        key = key[1:]
+    if key[-2:] in (b"/1", b"/2"):
+        key = key[:-2]
+    return key
+
+
+def _get_keys(batch):
+    # keys (see _get_key) of all identifiers of a batch
+    return [_get_key(x) for x in batch.get_identifiers()]
+
+
+def _load_identifiers(filename):
+    """Read a file with one identifier per line (possibly gzipped)"""
+    with _open_raw(filename) as fin:
+        return set(_get_key(line) for line in fin if line.strip())
+
+
+def _records_to_fasta(block):
+    """Convert a block of complete FastQ records into FastA (bytes)"""
+    batch, remainder = FastQBatch.from_buffer(block)
+    # identifier and sequence lines, each followed by an end of line
+    starts = np.empty(2 * len(batch), dtype=np.int64)
+    ends = np.empty(2 * len(batch), dtype=np.int64)
+    starts[0::2], starts[1::2] = batch.identifier_start, batch.sequence_start
+    ends[0::2], ends[1::2] = batch.identifier_end, batch.sequence_end
+    lengths = ends - starts + 1
+    positions = np.cumsum(lengths) - lengths
+
+    output = np.full(int(lengths.sum()), 10, dtype=np.uint8)
+    output[_concat_ranges(positions, positions + lengths - 1)] = \
+        batch._get_array()[_concat_ranges(starts, ends)]
+    output[positions[0::2]] = ord(">")
+    return output.tobytes()
+
+
+def _iter_batches(chunks, batch_size=10000, skip=0):
+    """Iterate over the :class:`FastQBatch` built from blocks of bytes
+
+    :param chunks: iterator over blocks of decompressed FastQ content
+    :param int batch_size: number of reads in each batch
+    :param int skip: number of reads to ignore at the beginning
+    """
+    pending = b""
+    eof = False
+    while skip and not eof:
+        blocks = [pending]
+        nlines = pending.count(b"\n")
+        while nlines < 4 * skip:
+            chunk = next(chunks, b"")
+            if not chunk:
+                eof = True
+                break
+            blocks.append(chunk)
+            nlines += chunk.count(b"\n")
+        buf = b"".join(blocks)
+        if eof and buf and not buf.endswith(b"\n"):
+            buf += b"\n"
+        batch, pending = FastQBatch.from_buffer(buf, skip)
+        skip -= len(batch)
+    if skip:
+        # skip beyond the end of the file
+        return
+    # the remaining reads may all be in the pending buffer
+    eof = False
+    while not eof:
+        # read blocks until we have enough lines for a batch
+        blocks = [pending]
+        nlines = pending.count(b"\n")
+        while nlines < 4 * batch_size:
+            chunk = next(chunks, b"")
+            if not chunk:
+                eof = True
+                break
+            blocks.append(chunk)
+            nlines += chunk.count(b"\n")
+        buf = b"".join(blocks)
+        if eof and buf and not buf.endswith(b"\n"):
+            buf += b"\n"
+        batch, pending = FastQBatch.from_buffer(buf, batch_size)
+        if len(batch):
+            yield batch
+        # the last buffer may contain several batches
+        while eof and len(batch):
+            batch, pending = FastQBatch.from_buffer(pending, batch_size)
+            if len(batch):
+                yield batch
+    if pending.strip():
+        logger.warning("Incomplete record found at the end of the file.")
 
 
 class Identifier(object):
@@ -148,6 +365,319 @@ class Identifier(object):
         return "Identifier (%s)" % self.version
 
 
+class FastQBatch(object):
+    """A batch of FastQ records stored in a single buffer
+
+    Instead of one dictionary per read, a batch stores the raw bytes of many
+    records in :attr:`data` and, for each read, the offsets of the
+    identifier, sequence and quality lines in that buffer (columnar arrays).
+    Batches are created by :meth:`FastQ.iter_batches`::
+
+        f = FastQ("input_file.fastq.gz")
+        for batch in f.iter_batches(batch_size=10000):
+            batch.lengths            # length of each read
+            batch.get_sequences()    # all bases as a single uint8 array
+            batch.get_identifier(0)  # first identifier (bytes)
+
+    Start offsets are inclusive, end offsets exclusive; end-of-line characters
+    are excluded. The record offsets include the final end-of-line character
+    so that ``data[record_start[i]:record_end[i]]`` is the raw FastQ record.
+    """
+    def __init__(self, data, starts, ends, stop):
+        """.. rubric:: constructor
+
+        :param data: a bytes buffer with complete records
+        :param starts: array with the start of each line (4 lines per read)
+        :param ends: array with the end of each line (end of line excluded)
+        :param int stop: offset right after the last record
+        """
+        self.data = data
+        self.identifier_start = starts[0::4]
+        self.identifier_end = ends[0::4]
+        self.sequence_start = starts[1::4]
+        self.sequence_end = ends[1::4]
+        self.quality_start = starts[3::4]
+        self.quality_end = ends[3::4]
+        self.record_start = self.identifier_start
+        self.record_end = np.append(starts[4::4], stop)[0:len(self)]
+
+    @classmethod
+    def from_buffer(cls, buf, batch_size=None):
+        """Parse the complete records found at the beginning of a buffer
+
+        :param bytes buf: decompressed FastQ content
+        :param int batch_size: maximum number of records to parse
+        :return: a tuple made of the batch and the remaining bytes (that is
+            the incomplete record found at the end of the buffer, if any, and
+            records beyond the batch size)
+        """
+        array = np.frombuffer(buf, dtype=np.uint8)
+        newlines = np.flatnonzero(array == 10)
+        N = len(newlines) // 4
+        if batch_size is not None:
+            N = min(N, batch_size)
+        newlines = newlines[0:4 * N]
+        cut = int(newlines[-1]) + 1 if N else 0
+
+        starts = np.empty(4 * N, dtype=np.int64)
+        starts[0:1] = 0
+        starts[1:] = newlines[:-1] + 1
+        ends = newlines.astype(np.int64)
+        # windows end of lines
+        ends[(ends > starts) & (array[ends - 1] == 13)] -= 1
+
+        if N and (array[starts[0::4]] != 64).any():
+            raise ValueError("Invalid FastQ: identifiers must start with @. "
+                "Empty lines or multi-line records are not supported")
+
+        return cls(buf, starts, ends, cut), buf[cut:]
+
+    def __len__(self):
+        return len(self.identifier_start)
+
+    def _get_lengths(self):
+        return self.sequence_end - self.sequence_start
+    lengths = property(_get_lengths, doc="length of each read")
+
+    def get_identifier(self, i):
+        """Return identifier of the i-th read (bytes, with the @ character)"""
+        return self.data[self.identifier_start[i]:self.identifier_end[i]]
+
+    def get_sequence(self, i):
+        """Return sequence of the i-th read (bytes)"""
+        return self.data[self.sequence_start[i]:self.sequence_end[i]]
+
+    def get_quality(self, i):
+        """Return quality string of the i-th read (bytes)"""
+        return self.data[self.quality_start[i]:self.quality_end[i]]
+
+    def get_record(self, i):
+        """Return the raw record of the i-th read including end of lines"""
+        return self.data[self.record_start[i]:self.record_end[i]]
+
+    def get_identifiers(self):
+        """Return list of identifiers (bytes)"""
+        return [self.data[a:b] for a, b in
+            zip(self.identifier_start, self.identifier_end)]
+
+    def _get_array(self):
+        return np.frombuffer(self.data, dtype=np.uint8)
+
+    def get_sequences(self):
+        """Return all bases of the batch concatenated in a uint8 array"""
+        index = _concat_ranges(self.sequence_start, self.sequence_end)
+        return self._get_array()[index]
+
+    def get_qualities(self):
+        """Return all ASCII qualities of the batch in a uint8 array
+
+        Qualities are not converted into phred scores (no offset removed).
+        """
+        index = _concat_ranges(self.quality_start, self.quality_end)
+        return self._get_array()[index]
+
+    def get_read_index(self):
+        """Return the read index of each base of :meth:`get_sequences`"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+
+class FastQIndex(object):
+    """Random access index of a FastQ file (.fqi file)
+
+    The index stores the location of every K-th record so that a read can be
+    accessed by jumping to the closest checkpoint and parsing at most K-1
+    records. Locations depend on the compression:
+
+    - plain files: offset of the record in the file
+    - BGZF files (e.g. compressed with bgzip): virtual offset of the record,
+      that is the offset of the compressed block shifted by 16 bits plus the
+      offset within the decompressed block (as in BAM indices)
+    - other gzip files: offset of the record in the decompressed stream. The
+      data must be decompressed from the beginning (without parsing) to reach
+      a checkpoint. Use bgzip to get a real random access.
+
+    ::
+
+        index = FastQIndex("test.fastq.gz")
+        index.build()
+        index.save()
+        index.locate(12345)
+
+    The index is saved in the input filename with the extension .fqi. The
+    size and modification time of the FastQ file are stored as well so that
+    an index that does not match the current file is ignored.
+    """
+    def __init__(self, filename, K=10000):
+        """.. rubric:: constructor
+
+        :param str filename: a FastQ file (plain, gzip or BGZF)
+        :param int K: one checkpoint every K reads
+        """
+        from sequana.tools import is_bgzf
+        self.filename = filename
+        self.K = K
+        self.index_filename = filename + ".fqi"
+        if not filename.endswith(".gz"):
+            self.mode = "plain"
+        elif is_bgzf(filename):
+            self.mode = "bgzf"
+        else:
+            self.mode = "gzip"
+        self.offsets = None
+        self.N = None
+
+    def __len__(self):
+        return self.N
+
+    def _get_fingerprint(self):
+        stat = os.stat(self.filename)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def _iter_located_chunks(self, chunksize=4*1024*1024):
+        # decompressed blocks together with a function that converts an
+        # offset in the block into a location stored in the index
+        from sequana.tools import iter_bgzf_blocks, inflate_bgzf_block
+        if self.mode == "bgzf":
+            for offset, block in iter_bgzf_blocks(self.filename):
+                yield inflate_bgzf_block(block), lambda p, o=offset: (o << 16) + p
+        else:
+            base = 0
+            with _open_raw(self.filename) as fin:
+                for chunk in iter(lambda: fin.read(chunksize), b""):
+                    yield chunk, lambda p, o=base: o + p
+                    base += len(chunk)
+
+    def build(self):
+        """Build the index (single pass over the file)"""
+        offsets = [0]
+        # the first record of the next checkpoint starts after this line
+        target = 4 * self.K
+        lines = 0
+        last = b"\n"
+        deferred = False
+        for chunk, locate in self._iter_located_chunks():
+            if deferred and chunk:
+                # checkpoint at the end of the previous block
+                offsets.append(locate(0))
+                deferred = False
+            n = chunk.count(b"\n")
+            if lines + n >= target:
+                newlines = np.flatnonzero(
+                    np.frombuffer(chunk, dtype=np.uint8) == 10)
+                while lines + n >= target:
+                    pos = int(newlines[target - lines - 1]) + 1
+                    if pos < len(chunk):
+                        offsets.append(locate(pos))
+                    else:
+                        deferred = True
+                    target += 4 * self.K
+            lines += n
+            if chunk:
+                last = chunk[-1:]
+        # last record without end of line
+        if last != b"\n":
+            lines += 1
+        self.N = lines // 4
+        # a checkpoint located at the end of the file is useless
+        self.offsets = offsets[0:max(1, (self.N + self.K - 1) // self.K)]
+        return self
+
+    def save(self):
+        """Save the index in the .fqi file
+
+        :return: True if the index could be saved
+        """
+        data = self._get_fingerprint()
+        data.update({"mode": self.mode, "K": self.K, "reads": self.N,
+            "offsets": self.offsets})
+        try:
+            with open(self.index_filename, "w") as fh:
+                json.dump(data, fh)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def load(self):
+        """Load the .fqi file if it exists and matches the FastQ file
+
+        :return: True if the index was loaded
+        """
+        try:
+            with open(self.index_filename, "r") as fh:
+                data = json.load(fh)
+            fingerprint = self._get_fingerprint()
+            if data["size"] != fingerprint["size"] or \
+                    data["mtime"] != fingerprint["mtime"] or \
+                    data["mode"] != self.mode:
+                return False
+            self.K = data["K"]
+            self.N = data["reads"]
+            self.offsets = data["offsets"]
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def locate(self, index):
+        """Return closest checkpoint of a read
+
+        :param int index: a read index
+        :return: tuple made of the location of the checkpoint and the number
+            of reads to skip from there
+        """
+        k, skip = divmod(index, self.K)
+        return self.offsets[k], skip
+
+    def iter_chunks(self, location, chunksize=4*1024*1024):
+        """Iterate over the decompressed content starting at a location"""
+        from sequana.tools import iter_bgzf_blocks, inflate_bgzf_block
+        if self.mode == "bgzf":
+            start, skip = location >> 16, location & 0xFFFF
+            for offset, block in iter_bgzf_blocks(self.filename, start=start):
+                data = inflate_bgzf_block(block)
+                if skip:
+                    data, skip = data[skip:], 0
+                if data:
+                    yield data
+        else:
+            with _open_raw(self.filename) as fin:
+                if self.mode == "plain":
+                    fin.seek(location)
+                else:
+                    # decompress and discard data up to the checkpoint
+                    while location:
+                        skipped = len(fin.read(min(chunksize, location)))
+                        if not skipped:
+                            break
+                        location -= skipped
+                for chunk in iter(lambda: fin.read(chunksize), b""):
+                    yield chunk
+
+    def get_batch(self, start, stop):
+        """Return the reads from start (included) to stop (excluded)
+
+        :return: a :class:`FastQBatch` (shorter than requested if the end
+            of the file is reached)
+        """
+        batches = self.iter_batches(start, batch_size=max(1, stop - start))
+        try:
+            batch = next(batches, None)
+        finally:
+            batches.close()
+        if batch is None:
+            return FastQBatch.from_buffer(b"")[0]
+        return batch
+
+    def iter_batches(self, start, batch_size=10000):
+        """Iterate over the batches of reads starting at a read index
+
+        :param int start: index of the first read
+        :param int batch_size: number of reads in each batch
+        :return: iterator over :class:`FastQBatch` instances
+        """
+        location, skip = self.locate(start)
+        return _iter_batches(self.iter_chunks(location), batch_size, skip)
+
+
 class FastQ(object):
     """Class to handle FastQ files
 
@@ -173,6 +703,12 @@ class FastQ(object):
 
         f.count_reads()
 
+    For gzipped files, the number of lines can be cached on disk (see
+    :class:`~sequana.tools.GZLineCounter`) so that other tools do not
+    decompress the file again::
+
+        f = FastQ("input_file.fastq.gz", cache=True)
+
     Operators available:
 
         - equality ==
@@ -192,12 +728,14 @@ class FastQ(object):
 
     """
     _N = 4
-    def __init__(self, filename, verbose=False):
+    def __init__(self, filename, verbose=False, cache=False):
 
         self.filename = filename
         self.verbose = verbose
+        self.cache = cache
         self._count_reads = None
         self._count_lines = None
+        self._index = None
 
         # opens the file in read mode
         self.__enter__()
@@ -236,7 +774,7 @@ class FastQ(object):
         self._count_reads = nreads
 
     def _count_lines_gz(self, CHUNKSIZE=65536):
-        ff = GZLineCounter(self.filename)
+        ff = GZLineCounter(self.filename, cache=self.cache)
         return len(ff)
 
     def count_lines(self):
@@ -373,198 +911,243 @@ class FastQ(object):
             tozip = False
         return filename, tozip
 
-    def select_random_reads(self, N=None, output_filename="random.fastq"):
+    def select_random_reads(self, N, output_filename="random.fastq",
+            paired_filename=None, paired_output_filename=None, seed=None):
         """Select random reads and save in a file
 
         :param int N: number of random unique reads to select
-            should provide a number but a list can be used as well. 
-            You can select random reads for R1, and re-use the returned list as
-            input for the R2 (since pairs must be kept)
-        :param str output_filename:
+            should provide a number but a list (or set) of read indices can be
+            used as well. You can select random reads for R1, and re-use the
+            returned set as input for the R2 (since pairs must be kept)
+        :param str output_filename: output file (gzipped if the extension is
+            .gz)
+        :param str paired_filename: the mate file (e.g. R2 if this instance
+            is a R1 file). Reads are selected in both files at the same time.
+        :param str paired_output_filename: output file for the mates
+        :param int seed: seed of the random generator (for reproducibility)
+        :return: set of the indices of the selected reads
 
         If you have a pair of files, the same reads must be selected in R1 and
         R2.::
 
+            f1 = FastQ(file1)
+            f1.select_random_reads(N=1000, output_filename="R1.fastq.gz",
+                paired_filename=file2, paired_output_filename="R2.fastq.gz")
+
+        or in two steps::
+
             f1 = FastQ(file1)
             selection = f1.select_random_reads(N=1000)
             f2 = FastQ(file2)
             f2.select_random_reads(selection)
 
+        Random reads are selected in a single pass using a reservoir sampling
+        with random skips (algorithm L) so the number of reads does not need
+        to be known. Only the N selected records are kept in memory.
 
+        If a list of reads is provided and the file has a random access index
+        (see :meth:`get_index`), only the parts of the file that contain the
+        selected reads are read (except for gzip files that are not BGZF).
         """
-        thisN = len(self)
-        if isinstance(N, int):
-            if N > thisN:
-                N = thisN
-            # create random set of reads to pick up
-            cherries = list(range(thisN))
-            np.random.shuffle(cherries)
-            # cast to set for efficient iteration
-            cherries = set(cherries[0:N])
-        elif isinstance(N, set):
-            cherries = N
-        elif isinstance(N, list):
-            cherries = set(N)
-
-        fastq = pysam.FastxFile(self.filename)
-
-
-        pb = Progress(thisN) # since we scan the entire file
-        with open(output_filename, "w") as fh:
-            for i, read in enumerate(fastq):
-                if i in cherries:
-                    fh.write(read.__str__() + "\n")
-                else:
-                    pass
-                pb.animate(i+1)
-        return cherries
+        import random
+        rng = random.Random(seed)
 
-    def split_lines(self, N=100000, gzip=True):
-        """Not implemented"""
-        if self.filename.endswith(".gz"):
-            outputs = self._split_lines_gz(N, gzip=gzip)
+        if paired_filename is not None:
+            assert paired_output_filename is not None, \
+                "paired_output_filename must be provided with paired_filename"
+            mates = FastQ(paired_filename).iter_batches()
         else:
-            outputs = self._split_lines(N, gzip=gzip)
-        return outputs
-
-    def _split_lines_gz(self, N, gzip=True, CHUNKSIZE=65536):
-        # split input in N files
-        # There is a split function under Unix but (1) not under windows
-        # and (2) split a gzip into N chunks or n lines will split the
-        # reads in the middle. So, we want to unzip, select N lines (or chunks)
-        # and zip each chunk.
-        self._check_multiple(N)
-        N_chunk, remainder = divmod(self.n_lines, N)
-        if remainder > 0:
-            N_chunk += 1
-
-        # let prepare some data first. Let us build the filenames once for all
-        outputs = []
-        for i in range(0, N_chunk):
-            lb = (i ) * N + 1
-            ub = (i + 1) * N
-            if ub > self.n_lines:
-                ub = self.n_lines
-
-            if self.filename.endswith(".gz"):
-                input_filename = self.filename.split(".gz")[0]
-                output_filename = input_filename
-            else:
-                input_filename = self.filename
-                output_filename = self.filename
-            output_filename.split(".", -1)
-            left, right = input_filename.rsplit(".", 1)
-            output_filename = left + "_%s_%s." % (lb, ub) + right
-            outputs.append(output_filename)
+            mates = None
 
-        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
-        with open(self.filename, 'rb') as fin:
-            # init buffer
-            buf = fin.read(CHUNKSIZE)
-            count = 0
-
-            # open an output file handler
-            current_file_counter = 0
-            fout = open(outputs[0], "wb")
+        index = self._get_existing_index() if mates is None else None
+        if isinstance(N, int):
+            reservoir = self._reservoir_sampling(N, rng, mates)
+        elif index is not None and index.mode != "gzip":
+            reservoir = self._select_indexed_reads(index, set(N))
+        else:
+            reservoir = self._select_reads(set(N), mates)
+        indices = sorted(reservoir.keys())
+
+        with _open_output(output_filename) as fout:
+            fout.writelines(reservoir[i][0] for i in indices)
+        if mates is not None:
+            with _open_output(paired_output_filename) as fout:
+                fout.writelines(reservoir[i][1] for i in indices)
+        return set(indices)
+
+    def _iter_paired_batches(self, mates=None):
+        # batches of this file and of the mate file in lock-step
+        msg = "R1 and R2 have different numbers of reads"
+        for batch in self.iter_batches():
+            mate = None
+            if mates is not None:
+                mate = next(mates, None)
+                if mate is None or len(mate) != len(batch):
+                    raise ValueError(msg)
+            yield batch, mate
+        if mates is not None and next(mates, None) is not None:
+            raise ValueError(msg)
 
-            while buf:
-                outstr = d.decompress(buf)
-                count += outstr.count(b"\n")
-                if count > N:
-                    # if too many lines were read, fill the current file
-                    # and keep remaining data (skip the reading of new
-                    # data for now)
-                    missing = count - N
-                    outstr = outstr.strip().split(b"\n")
-                    NN = len(outstr)
-                    # we need to split the buffer into the part to save
-                    # in this file and the part to save in the next file later
-                    # on (remaining)
-                    # Note that there is no '\n' added here because we do not
-                    # read lines that we may end up in the middle of a line
-                    remaining  = b"\n".join(outstr[NN-missing-1:])
-                    # whereas here, we are at the end of a line
-                    outstr = b"\n".join(outstr[0:NN-missing-1]) + b"\n"
-                    # write and close that file
-                    fout.write(outstr)
-                    fout.close()
-                    # and open the next one where we can already save the end of
-                    # the buffer
-                    current_file_counter += 1
-                    fout = open(outputs[current_file_counter], "wb")
-                    fout.write(remaining)
-                    # we need to keep track of what has be written
-                    count = remaining.count(b'\n')
-                    # and finally we can now read a new chunk of data
-                    buf = fin.read(CHUNKSIZE)
+    def _get_records(self, batch, mate, i):
+        return (batch.get_record(i), mate.get_record(i) if mate else None)
+
+    def _reservoir_sampling(self, N, rng, mates=None):
+        # Algorithm L (Li 1994): after the reservoir is filled, the number of
+        # reads to skip before the next replacement is drawn directly so that
+        # only selected reads are touched.
+        import math
+        reservoir = []
+        if N <= 0:
+            return {}
+
+        def skip(W):
+            return int(math.log(rng.random()) / math.log(1 - W))
+
+        W = math.exp(math.log(rng.random()) / N)
+        # index of the next read to add to the reservoir
+        following = 0
+        offset = 0
+        for batch, mate in self._iter_paired_batches(mates):
+            n = len(batch)
+            while following < offset + n:
+                i = following - offset
+                if len(reservoir) < N:
+                    reservoir.append((following, self._get_records(batch, mate, i)))
+                    following += 1
+                    if len(reservoir) == N:
+                        following += skip(W)
                 else:
-                    fout.write(outstr)
-                    buf = fin.read(CHUNKSIZE)
-
-        if gzip is True:
-            for output in outputs:
-                self._gzip(output)
-            outputs = [x + ".gz" for x in outputs]
+                    # replace a random read of the reservoir
+                    reservoir[rng.randrange(N)] = (following,
+                        self._get_records(batch, mate, i))
+                    W *= math.exp(math.log(rng.random()) / N)
+                    following += skip(W) + 1
+            offset += n
+        return dict(reservoir)
+
+    def _get_existing_index(self):
+        # the random access index if it is already available
+        if self._index is None:
+            index = FastQIndex(self.filename)
+            if index.load():
+                self._index = index
+        return self._index
+
+    def _select_indexed_reads(self, index, cherries):
+        # group the selected reads by checkpoint and read each group at once
+        groups = defaultdict(list)
+        for i in cherries:
+            if 0 <= i < len(index):
+                groups[i // index.K].append(i)
+        selection = {}
+        for k, group in groups.items():
+            start = k * index.K
+            batch = index.get_batch(start, max(group) + 1)
+            for i in group:
+                selection[i] = (batch.get_record(i - start), None)
+        return selection
+
+    def _select_reads(self, cherries, mates=None):
+        selection = {}
+        offset = 0
+        for batch, mate in self._iter_paired_batches(mates):
+            for index in range(offset, offset + len(batch)):
+                if index in cherries:
+                    selection[index] = self._get_records(batch, mate, index - offset)
+            offset += len(batch)
+        return selection
+
+    def split_lines(self, N=100000, gzip=True, threads=4):
+        """Split the file into files of N lines
+
+        :param int N: number of lines per output file (multiple of 4)
+        :param bool gzip: compress the output files
+        :param int threads: number of threads used to compress the output
+            files
+        :return: list of output filenames or None if N is larger than the
+            number of lines
+
+        The output files are named after the input file with the range of
+        lines they contain. For example, test.fastq.gz split in 2 files of 500
+        lines gives test_1_500.fastq.gz and test_501_1000.fastq.gz.
+
+        Input (gzipped or not) is read once. Chunks are compressed in a
+        pool of threads (zlib releases the GIL) while the input is still being
+        read and decompressed.
+        """
+        self._check_multiple(N)
+        assert type(N) == int
+        return self._split(N, gzip=gzip, threads=threads)
+
+    def _split(self, N, gzip=True, threads=4, single=False):
+        # write blocks of N lines (or of the number of lines in the list N)
+        # into separate files. If single is False and the file fits in one
+        # block, nothing is written and None is returned
+
+        # output filenames are built from the input filename
+        left, right = self.filename.split(".gz")[0].rsplit(".", 1)
+
+        with self._open_raw() as fin:
+            chunks = iter(lambda: fin.read(4 * 1024 * 1024), b"")
+            blocks = _iter_line_blocks(chunks, N)
+
+            # if there is only one block, nothing to split
+            first = next(blocks, None)
+            second = next(blocks, None)
+            if second is None and not single:
+                print("Nothing to do. Choose a lower N value")
+                return
+            blocks = chain([x for x in (first, second) if x], blocks)
+
+            from collections import deque
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(threads)
+            jobs = deque()
+            outputs = []
+            lb = 1
+            try:
+                for data, nlines in blocks:
+                    ub = lb + nlines - 1
+                    output_filename = left + "_%s_%s." % (lb, ub) + right
+                    if gzip is True:
+                        output_filename += ".gz"
+                    outputs.append(output_filename)
+                    jobs.append(pool.apply_async(_write_data,
+                        (data, output_filename)))
+                    # bounded number of chunks waiting for compression
+                    while len(jobs) > 2 * threads:
+                        jobs.popleft().get()
+                    lb = ub + 1
+                while jobs:
+                    jobs.popleft().get()
+            finally:
+                pool.close()
+                pool.join()
         return outputs
 
-    def _split_chunks(self, N=10):
-        # split per chunks of size N
-        pass
-
     def _check_multiple(self, N, multiple=4):
         if divmod(N, multiple)[1] != 0:
             msg = "split_lines method expects a multiple of %s." %multiple
             raise ValueError(msg)
 
-    # This could be part of easydev or other software
-    # we could also use a unix command but won't work on other platforms
-    def _split_lines(self, N, gzip=True):
-        # split input in N files
-        # We will name them with reads number that is
-        # filename.fastq gives for example:
-        # --> filename_1_100000.fastq
-        # --> filename_100001_151234.fastq
-        self._check_multiple(N)
-
-        assert type(N) == int
-        if N >= self.n_lines:
-            print("Nothing to do. Choose a lower N value")
-            return
-
-        outputs = []
-        N_chunk, remainder = divmod(self.n_lines, N)
-
-        with open(self.filename) as fin:
-            for i in range(0, N_chunk):
-                lb = (i ) * N + 1
-                ub = (i + 1) * N
-                output_filename = self.filename
-                output_filename.split(".", -1)
-                left, right = self.filename.rsplit(".", 1)
-                output_filename = left + "_%s_%s." % (lb, ub) + right
-                outputs.append(output_filename)
-                with open(output_filename, 'w') as fout:
-                    fout.writelines(islice(fin, N))
-            # last chunk is dealt with outside the loop
-            lb = ub + 1
-            ub = self.n_lines
-            output_filename = left + "_%s_%s." % (lb, ub) + right
-            if remainder !=0:
-                outputs.append(output_filename)
-                with open(output_filename, 'w') as fout:
-                    fout.writelines(islice(fin, remainder))
+    def split_chunks(self, N=10, gzip=True, threads=4):
+        """Split the file into N files with the same number of reads
 
-        if gzip is True:
-            for output in outputs:
-                self._gzip(output)
-            outputs = [x + ".gz" for x in outputs]
-        return outputs
+        :param int N: number of output files
+        :return: list of output filenames (see :meth:`split_lines`)
 
-    def split_chunks(self, N=10):
-        """Not implemented"""
+        If the number of reads is not a multiple of N, the first files
+        contain one more read. The number of reads is required, so the input
+        file is read twice (see :meth:`count_reads`).
+        """
         assert N <=100, "you cannot split a file into more than 100 chunks"
-        # split per chunks of size N
-        cmd = "split --number %s %s -d"
+        if N > self.n_reads:
+            raise ValueError("cannot split %s reads into %s files" % (
+                self.n_reads, N))
+        reads_per_chunk, extra = divmod(self.n_reads, N)
+        sizes = [(reads_per_chunk + 1) * self._N] * extra + \
+            [reads_per_chunk * self._N] * (N - extra)
+        return self._split(sizes, gzip=gzip, threads=threads, single=True)
 
     """def random(self, N=10000, output_filename="test.fastq",
                bp=50, quality=40):
@@ -649,123 +1232,350 @@ class FastQ(object):
 
         return d
 
-    def __getitem__(self, index):
-        return 1
+    def _open_raw(self):
+        # binary and decompressed file handler, independent of self._fileobj
+        return _open_raw(self.filename)
 
-    def _to_fasta(self, output_filename="test.fasta", level=6, CHUNKSIZE=65536):
-        """
+    def iter_batches(self, batch_size=10000, chunksize=4*1024*1024):
+        """Iterate through the reads by batches
+
+        :param int batch_size: number of reads in each batch (the last batch
+            may be shorter)
+        :param int chunksize: size of the blocks read from the file
+        :return: iterator over :class:`FastQBatch` instances
+
+        Large blocks are read from the (possibly gzipped) file and parsed
+        with numpy so that no Python object is created per read. This is
+        much faster than iterating through the reads with :meth:`next`::
 
+            f = FastQ("input_file.fastq.gz")
+            N = sum(len(batch) for batch in f.iter_batches())
+
+        Each record must be made of 4 lines.
         """
-        raise NotImplementedError
+        with self._open_raw() as fin:
+            chunks = iter(lambda: fin.read(chunksize), b"")
+            for batch in _iter_batches(chunks, batch_size):
+                yield batch
+
+    def _iter_record_blocks(self, chunksize=16*1024*1024):
+        # yield decompressed blocks made of complete records together with
+        # their number of reads. Only the end-of-line characters are
+        # counted so this is cheap as compared to parsing the records.
+        pending = b""
+        with self._open_raw() as fin:
+            for chunk in iter(lambda: fin.read(chunksize), b""):
+                buf = pending + chunk
+                N = buf.count(b"\n")
+                # cut the buffer after the last complete record
+                pos = len(buf)
+                for i in range(N % self._N + 1):
+                    pos = buf.rfind(b"\n", 0, pos)
+                cut = pos + 1
+                pending = buf[cut:]
+                if cut:
+                    yield buf[0:cut], N // self._N
+        if pending.strip():
+            if not pending.endswith(b"\n"):
+                pending += b"\n"
+            yield pending, pending.count(b"\n") // self._N
+
+    def _get_chunks(self, N):
+        """Return byte ranges that split a plain FastQ into N parts
+
+        Boundaries are moved to the beginning of the next record so that
+        each range contains complete records only.
         """
-        #twice as slow as a tool such as seqtk and final fasta number not correct...
-        # this is to supress the header
-        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert not self.filename.endswith(".gz"), "only for plain files"
+        size = os.path.getsize(self.filename)
+        offsets = [0]
+        with open(self.filename, "rb") as fin:
+            for i in range(1, N):
+                pos = max(size * i // N, offsets[-1])
+                offsets.append(_find_record_start(fin, pos, size))
+        offsets.append(size)
+        return [(a, b) for a, b in zip(offsets[:-1], offsets[1:]) if b > a]
 
-        # will we gzip the output file ?
-        output_filename, tozip = self._istozip(output_filename)
+    def get_duplication(self, prefix=50, mode="exact", max_size=1000000, p=14):
+        """Estimate the duplication rate of the reads
 
-        with open(self.filename, 'rb') as fin:
-            buf = fin.read(CHUNKSIZE)
+        :return: a :class:`DuplicationEstimator` (see for the parameters)
 
-            count = 0
-            with open(output_filename, "wb") as fout:
-                while buf:
-                    outstr = d.decompress(buf)
-                    lines = outstr.strip().split(b"\n")
-                    for line in lines:
-                        if count%4 == 0:
-                            fout.write(b">"+line[1:]+b"\n")
-                        elif count%4==1:
-                            fout.write(line+b"\n")
-                        count += 1
+        ::
 
-                    buf = fin.read(CHUNKSIZE)
+            f = FastQ("test.fastq.gz")
+            dup = f.get_duplication(mode="sketch")
+            dup.get_stats()["duplication_rate"]
 
-        if tozip is True: self._gzip(output_filename)
         """
+        dup = DuplicationEstimator(prefix=prefix, mode=mode, max_size=max_size,
+            p=p)
+        for batch in self.iter_batches():
+            dup.update(batch)
+        return dup
+
+    def get_index(self, K=10000, save=False):
+        """Return the random access index of the file
+
+        :param int K: one checkpoint every K reads (used if the index must
+            be built)
+        :param bool save: save the index in a .fqi file if it is built
+        :return: a :class:`FastQIndex` instance
+
+        The .fqi file is loaded if it matches the file. Otherwise, the index
+        is built (single pass over the file) and kept in memory. Reads can
+        then be accessed directly::
+
+            f = FastQ("test.fastq.gz")
+            f[100]
+            f[100:200]
+
+        Indexing a FastQ instance never writes the .fqi file. Call
+        ``f.get_index(save=True)`` once to reuse the index in other sessions.
+        """
+        if self._index is None:
+            index = FastQIndex(self.filename, K)
+            if not index.load():
+                index.build()
+                if save:
+                    index.save()
+            self._index = index
+        return self._index
+
+    def _get_read(self, batch, i):
+        return {"identifier": batch.get_identifier(i),
+                "sequence": batch.get_sequence(i),
+                "quality": batch.get_quality(i)}
+
+    def __getitem__(self, index):
+        fqi = self.get_index()
+        if isinstance(index, slice):
+            indices = range(*index.indices(len(fqi)))
+            if len(indices) == 0:
+                return []
+            start, stop = min(indices), max(indices) + 1
+            batch = fqi.get_batch(start, stop)
+            return [self._get_read(batch, i - start) for i in indices]
+
+        if index < 0:
+            index += len(fqi)
+        if index < 0 or index >= len(fqi):
+            raise IndexError("read index out of range")
+        return self._get_read(fqi.get_batch(index, index + 1), 0)
+
+    def to_fasta(self, output_filename="test.fasta", level=6, threads=2):
+        """Convert the FastQ file into a FastA file
+
+        :param str output_filename: output file (gzipped if the extension is
+            .gz)
+        :param int level: compression level of gzipped output
+        :param int threads: number of background threads used to compress
+            the output
+        :return: number of sequences written
+
+        Input (gzipped or not) is read by large blocks of records. Each block
+        is converted with numpy (identifier and sequence lines only, the @
+        character being replaced by >) so that no Python object is created
+        per read. Gzipped outputs are made of several gzip members (one per
+        block) compressed by background threads while the input is still
+        being read.
+        """
+        from collections import deque
+        from multiprocessing.pool import ThreadPool
+
+        count = 0
+        tozip = output_filename.endswith(".gz")
+        if tozip:
+            pool = ThreadPool(threads)
+            jobs = deque()
+        with open(output_filename, "wb") as fout:
+            try:
+                for block, nreads in self._iter_record_blocks():
+                    data = _records_to_fasta(block)
+                    count += nreads
+                    if not tozip:
+                        fout.write(data)
+                        continue
+                    jobs.append(pool.apply_async(gzip.compress, (data, level)))
+                    # bounded number of blocks waiting for compression
+                    while len(jobs) > 2 * threads:
+                        fout.write(jobs.popleft().get())
+                while tozip and jobs:
+                    fout.write(jobs.popleft().get())
+            finally:
+                if tozip:
+                    pool.close()
+                    pool.join()
+        return count
+
+    def _to_fasta(self, output_filename="test.fasta", level=6, CHUNKSIZE=65536):
+        # kept for backward compatibility
+        return self.to_fasta(output_filename, level=level)
 
     def filter(self, identifiers_list=[], min_bp=None, max_bp=None,
-        progressbar=True, output_filename='filtered.fastq', remove=True):
+        progressbar=True, output_filename='filtered.fastq', remove=True,
+        paired_filename=None, paired_output_filename=None, level=6):
         """Filter reads
 
+        :param identifiers_list: identifiers of the reads to filter. Either a
+            list/set of identifiers (str or bytes, with or without the @
+            character and the /1 /2 suffixes) or a file with one identifier
+            per line (e.g. a list of contaminants; can be gzipped). Only the
+            first word of the identifiers is used.
         :param int min_bp: ignore reads with length shorter than min_bp
         :param int max_bp: ignore reads with length above max_bp
+        :param str output_filename: output file (gzipped if the extension is
+            .gz)
+        :param bool remove: if True, reads in the identifiers_list are
+            removed. Otherwise, only those reads are kept.
+        :param str paired_filename: the mate file (e.g. R2 if this instance
+            is a R1 file). Mates are filtered at the same time so that the
+            two outputs remain synchronised: a pair is kept only if both
+            reads pass the filters.
+        :param str paired_output_filename: output file for the mates
+        :param int level: compression level of gzipped outputs
+        :return: number of reads (or pairs) written
+
+        Reads are processed by batches and written as raw records, directly
+        compressed if required. Identifiers are stored in a set so that
+        millions of identifiers can be filtered::
+
+            f = FastQ("R1.fastq.gz")
+            f.filter("contaminants.txt", output_filename="clean_R1.fastq.gz",
+                paired_filename="R2.fastq.gz",
+                paired_output_filename="clean_R2.fastq.gz")
 
         """
-        # 7 seconds without identifiers to scan the file
-        # on a 750000 reads
-
         if min_bp is None:
             min_bp = 0
 
         if max_bp is None:
             max_bp = 1e9
 
-        # make sure we are at the beginning
-        self.rewind()
+        if isinstance(identifiers_list, str):
+            identifiers = _load_identifiers(identifiers_list)
+        else:
+            identifiers = set(_get_key(x) for x in identifiers_list)
 
-        output_filename, tozip = self._istozip(output_filename)
+        if paired_filename is not None:
+            assert paired_output_filename is not None, \
+                "paired_output_filename must be provided with paired_filename"
+            mates = FastQ(paired_filename).iter_batches()
+            fout2 = _open_output(paired_output_filename, level)
+        else:
+            mates = None
+            fout2 = None
 
-        with open(output_filename, "w") as fout:
+        if progressbar is True:
             pb = Progress(self.n_reads)
-            buf = ""
-            filtered = 0
+        filtered = 0
+        count = 0
+        written = 0
+        try:
+            with _open_output(output_filename, level) as fout:
+                for batch, mate in self._iter_paired_batches(mates):
+                    # the length criteria is vectorised on the entire batch
+                    tokeep = self._get_length_mask(batch, min_bp, max_bp)
+                    if mate is not None:
+                        tokeep &= self._get_length_mask(mate, min_bp, max_bp)
+
+                    if identifiers:
+                        found = np.array([x in identifiers for x in
+                            _get_keys(batch)], dtype=bool)
+                        if mate is not None:
+                            found |= [x in identifiers for x in _get_keys(mate)]
+                        filtered += int(found.sum())
+                        tokeep &= ~found if remove else found
+
+                    selection = np.flatnonzero(tokeep)
+                    fout.write(b"".join(batch.get_record(i) for i in selection))
+                    if mate is not None:
+                        fout2.write(b"".join(mate.get_record(i) for i in selection))
+                    written += len(selection)
+                    count += len(batch)
+                    if progressbar is True:
+                        pb.animate(count)
+        finally:
+            if fout2 is not None:
+                fout2.close()
 
-            for count, lines in enumerate(grouper(self._fileobj)):
-                identifier = lines[0].split()[0]
-                if lines[0].split()[0] in identifiers_list:
-                    filtered += 1
-                else:
-                    N = len(lines[1])
-                    if N <= max_bp and N >= min_bp:
-                        buf += "{}{}+\n{}".format(
-                            lines[0].decode("utf-8"),
-                            lines[1].decode("utf-8"),
-                            lines[3].decode("utf-8"))
-                    if count % 100000 == 0:
-                        fout.write(buf)
-                        buf = ""
-                if progressbar is True:
-                    pb.animate(count+1)
-            fout.write(buf)
-            if filtered < len(identifiers_list):
-                print("\nWARNING: not all identifiers were found in the fastq file to " +
-                      "be filtered.")
-        if tozip is True: self._gzip(output_filename)
+        if filtered < len(identifiers):
+            print("\nWARNING: not all identifiers were found in the fastq file to " +
+                  "be filtered.")
+        return written
+
+    def _get_length_mask(self, batch, min_bp, max_bp):
+        lengths = batch.lengths
+        return (lengths <= max_bp) & (lengths >= min_bp)
 
-    def to_kmer_content(self, k=7):
+    def to_kmer_content(self, k=7, threads=1):
         """Return a Series with kmer count across all reads
 
         :param int k: (default to 7-mers)
+        :param int threads: number of processes used to count the kmers
         :return: Pandas Series with index as kmer and values as count.
 
-        Takes about 30 seconds on a million reads.
+        For k up to 16, kmers are encoded into integers (2 bits per base) and
+        counted with numpy by batches of reads. The rare kmers that contain
+        other letters than A, C, G, T (e.g. N) are counted separately.
         """
+        if k > 16:
+            return self._to_kmer_content_slow(k)
+
+        pb = Progress(len(self))
+        counts = _KmerCounts(k)
+        if threads > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(threads)
+            try:
+                if self.filename.endswith(".gz"):
+                    jobs = (pool.apply_async(_kmer_worker, (None, block, k))
+                            for block, nreads in self._iter_record_blocks())
+                    # the generator is consumed lazily so that a bounded
+                    # number of blocks is in memory
+                    results = _bounded_results(jobs, 2 * threads)
+                else:
+                    args = [((self.filename, start, stop), None, k)
+                            for start, stop in self._get_chunks(threads)]
+                    results = pool.starmap(_kmer_worker, args)
+                for this in results:
+                    counts += this
+                    pb.animate(counts.N)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for batch in self.iter_batches():
+                counts.update(batch)
+                pb.animate(counts.N)
+
+        ts = counts.to_series()
+        ts.sort_values(inplace=True, ascending=False)
+        return ts
+
+    def _to_kmer_content_slow(self, k):
         # Counter is slow if we apply it on each read.
-        # .count is slow as well
-        import collections
         from sequana.kmer import get_kmer
-        counter = collections.Counter()
+        counter = Counter()
         pb = Progress(len(self))
-        buffer_ = []
-        for i, this in enumerate(self):
-            buffer_.extend(list(get_kmer(this['sequence'], k)))
-            if len(buffer_) > 100000:
-                counter += collections.Counter(buffer_)
-                buffer_ = []
-            pb.animate(i)
-        counter += collections.Counter(buffer_)
+        count = 0
+        for batch in self.iter_batches():
+            buffer_ = []
+            for i in range(len(batch)):
+                buffer_.extend(get_kmer(batch.get_sequence(i), k))
+            counter.update(buffer_)
+            count += len(batch)
+            pb.animate(count)
 
         ts = pd.Series(counter)
         ts.sort_values(inplace=True, ascending=False)
-
         return ts
 
-    def to_krona(self, k=7, output_filename="fastq.krona"):
+    def to_krona(self, k=7, output_filename="fastq.krona", threads=1):
         """Save Krona file with ACGT content within all k-mers
 
         :param int k: (default to 7-mers)
+        :param int threads: see :meth:`to_kmer_content`
 
         Save results in file, which can then be translated into a HTML file
         using::
@@ -774,7 +1584,7 @@ class FastQ(object):
             open text.krona.html
 
         """
-        ts = self.to_kmer_content(k=k)
+        ts = self.to_kmer_content(k=k, threads=threads)
 
         with open(output_filename, "w") as fout:
             for index, count in ts.items():
@@ -782,9 +1592,25 @@ class FastQ(object):
                 fout.write("%s\t" % count + letters + "\n")
 
     def stats(self):
-        self.rewind()
-        data = [len(read['sequence']) for read in self]
-        return {"mean_read_length": pylab.mean(data), "N": len(data)}
+        """Return statistics about the read lengths
+
+        :return: dictionary with the number of reads (N), the total number
+            of bases and the mean, median, min, max, N50 and N90 of the
+            read lengths.
+
+        Lengths are accumulated in a histogram so that the memory does not
+        depend on the number of reads.
+        """
+        from sequana.stats import LengthHistogram
+        hist = LengthHistogram()
+        for batch in self.iter_batches():
+            hist.update(batch.lengths)
+        stats = hist.get_stats()
+        return {"mean_read_length": stats["mean"], "N": stats["N"],
+            "median_read_length": stats["median"],
+            "min_read_length": stats["min"], "max_read_length": stats["max"],
+            "N50": stats["N50"], "N90": stats["N90"],
+            "total_bases": stats["total_bases"]}
 
     def __eq__(self, other):
         if id(other) == id(self):
@@ -811,6 +1637,877 @@ def run_info(f):
     return wrapper
 
 
+# columns of the position x base matrix in FastQC; other letters go to 'other'
+_BASES = "ACGTN"
+
+
+def _get_base_codes():
+    codes = np.full(256, len(_BASES), dtype=np.int64)
+    for i, letter in enumerate(_BASES):
+        codes[ord(letter)] = i
+    return codes
+
+
+def _grow(array, N):
+    # add rows filled with zeros so that array has at least N rows
+    if len(array) >= N:
+        return array
+    extra = np.zeros((N - len(array),) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate([array, extra])
+
+
+def _get_quality_per_position(hist):
+    # statistics of the quality at each position given the histogram of
+    # the phred scores at each position (see FastQC.get_quality_per_position)
+    hist = hist.astype(float)
+    scores = np.arange(hist.shape[1])
+    total = hist.sum(axis=1)
+    mean = hist.dot(scores) / total
+    # unbiased estimator as in pandas; zero if there is a single read
+    var = np.divide(hist.dot(scores ** 2) - total * mean ** 2, total - 1,
+                    out=np.zeros(len(total)), where=total > 1)
+    df = pd.DataFrame({"mean": mean, "std": np.sqrt(np.clip(var, 0, None))})
+    cumsum = hist.cumsum(axis=1)
+    for q in [10, 25, 50, 75, 90]:
+        df["%s%%" % q] = (cumsum < total[:, None] * q / 100.).sum(axis=1)
+    return df
+
+
+def _get_tile_keys(batch):
+    # lane:tile of each read (Illumina identifiers) or None
+    keys = []
+    for identifier in batch.get_identifiers():
+        fields = identifier.split(None, 1)[0].split(b":")
+        if len(fields) >= 7:    # Illumina 1.8+
+            keys.append((fields[3] + b":" + fields[4]).decode())
+        elif len(fields) == 5:  # Illumina 1.4
+            keys.append((fields[1] + b":" + fields[2]).decode())
+        else:
+            keys.append(None)
+    return keys
+
+
+class FastQProfile(object):
+    """Summary statistics of a set of reads that can be added together
+
+    A profile contains histograms only (no information per read) so that it
+    is small and can be combined exactly with other profiles. This is useful
+    to analyse the lanes of a sample on different nodes and merge the
+    results, or to aggregate statistics of several samples::
+
+        profiles = [FastQC(filename, dotile=True).get_profile()
+                    for filename in lanes]
+        profile = sum(profiles)
+        profile.get_stats()
+        profile.save("sample.npz")
+        profile = FastQProfile.load("sample.npz")
+
+    It contains:
+
+    - N: number of reads, counts of A, C, G, T, N and total length
+    - quality_counts: number of bases for each ASCII quality
+    - position_quality: number of bases for each position and phred score
+      (0 to 93)
+    - position_bases: number of A, C, G, T, N and other letters for each
+      position
+    - length_hist: number of reads of each length
+    - gc_hist: number of reads for each GC content (percentage rounded to
+      integer)
+    - gc_bases: number of G and C bases in the reads of each length, from
+      which the mean GC content of the reads is computed exactly
+    - tiles: for each lane:tile of Illumina identifiers, number of reads,
+      number of bases and sum of phred scores (if dotile is True)
+    """
+    n_scores = 94
+
+    def __init__(self, dotile=False):
+        self.dotile = dotile
+        self.N = 0
+        self.counts = {"A": 0, "C": 0, "G": 0, "T": 0, "N": 0}
+        self.total_length = 0
+        # count of all ASCII qualities
+        self.quality_counts = np.zeros(256, dtype=np.int64)
+        self.position_quality = np.zeros((0, self.n_scores), dtype=np.int64)
+        self.position_bases = np.zeros((0, len(_BASES) + 1), dtype=np.int64)
+        self.length_hist = np.zeros(0, dtype=np.int64)
+        self.gc_hist = np.zeros(101, dtype=np.int64)
+        self.gc_bases = np.zeros(0, dtype=np.int64)
+        # sum of the mean quality of each read
+        self.quality_sum = 0.
+        self.tiles = {}
+
+    def update(self, batch):
+        """Add the reads of a :class:`FastQBatch`
+
+        :return: GC content (percentage) and mean quality of each read of the
+            batch
+        """
+        n = len(batch)
+        lengths = batch.lengths
+        bases = batch.get_sequences()
+        quals = batch.get_qualities()
+        index = batch.get_read_index()
+        phred = quals.astype(np.int64) - 33
+
+        self.quality_counts += np.bincount(quals, minlength=256)
+
+        # position of each base within its read
+        if len(bases):
+            positions = np.arange(len(bases)) - np.repeat(
+                np.cumsum(lengths) - lengths, lengths)
+            L = int(lengths.max())
+            self.position_quality = _grow(self.position_quality, L)
+            scores = np.clip(phred, 0, self.n_scores - 1)
+            self.position_quality[0:L] += np.bincount(
+                positions * self.n_scores + scores,
+                minlength=L * self.n_scores).reshape(L, self.n_scores)
+            ncols = self.position_bases.shape[1]
+            self.position_bases = _grow(self.position_bases, L)
+            codes = _get_base_codes()[bases]
+            self.position_bases[0:L] += np.bincount(positions * ncols + codes,
+                minlength=L * ncols).reshape(L, ncols)
+
+        GG = np.bincount(index[bases == ord("G")], minlength=n)
+        CC = np.bincount(index[bases == ord("C")], minlength=n)
+        if n:
+            hist = np.bincount(lengths)
+            self.length_hist = _grow(self.length_hist, len(hist))
+            self.length_hist[0:len(hist)] += hist
+            hist = np.bincount(lengths, weights=GG + CC).astype(np.int64)
+            self.gc_bases = _grow(self.gc_bases, len(hist))
+            self.gc_bases[0:len(hist)] += hist
+
+        gc = (GG + CC) / lengths.astype(float) * 100
+        self.gc_hist += np.bincount(np.rint(gc[lengths > 0]).astype(int),
+            minlength=101)
+
+        sums = np.bincount(index, weights=phred, minlength=n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_qualities = sums / lengths
+        self.quality_sum += float(np.nansum(mean_qualities))
+
+        if self.dotile:
+            self._update_tiles(batch, sums)
+
+        # not using a counter, or loop speed up the code
+        for letter in "ACGTN":
+            self.counts[letter] += int((bases == ord(letter)).sum())
+
+        self.total_length += int(lengths.sum())
+        self.N += n
+        return gc, mean_qualities
+
+    def _update_tiles(self, batch, sums):
+        keys = _get_tile_keys(batch)
+        names = sorted(set(x for x in keys if x is not None))
+        if not names:
+            return
+        codes = {name: i for i, name in enumerate(names)}
+        tile = np.array([codes.get(x, -1) for x in keys])
+        found = tile >= 0
+        reads = np.bincount(tile[found], minlength=len(names))
+        nbases = np.bincount(tile[found], weights=batch.lengths[found],
+            minlength=len(names))
+        quality = np.bincount(tile[found], weights=sums[found],
+            minlength=len(names))
+        for i, name in enumerate(names):
+            this = self.tiles.setdefault(name, [0, 0, 0])
+            this[0] += int(reads[i])
+            this[1] += int(nbases[i])
+            this[2] += int(quality[i])
+
+    def __iadd__(self, other):
+        self.N += other.N
+        for letter in self.counts:
+            self.counts[letter] += other.counts[letter]
+        self.total_length += other.total_length
+        self.quality_counts = self.quality_counts + other.quality_counts
+        for name in ("position_quality", "position_bases", "length_hist",
+                     "gc_bases"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            mine = _grow(mine, len(theirs))
+            mine[0:len(theirs)] += theirs
+            setattr(self, name, mine)
+        self.gc_hist = self.gc_hist + other.gc_hist
+        self.quality_sum += other.quality_sum
+        tiles = {}
+        for name in set(self.tiles) | set(other.tiles):
+            tiles[name] = [a + b for a, b in zip(self.tiles.get(name, [0, 0, 0]),
+                other.tiles.get(name, [0, 0, 0]))]
+        self.tiles = tiles
+        self.dotile = self.dotile or other.dotile
+        return self
+
+    def __add__(self, other):
+        import copy
+        result = copy.deepcopy(self)
+        result += other
+        return result
+
+    def __radd__(self, other):
+        # so that sum() can be used
+        if other == 0:
+            import copy
+            return copy.deepcopy(self)
+        return other + self
+
+    def _get_arrays(self):
+        return {"N": self.N,
+                "counts": [self.counts[x] for x in _BASES],
+                "total_length": self.total_length,
+                "quality_counts": self.quality_counts,
+                "position_quality": self.position_quality,
+                "position_bases": self.position_bases,
+                "length_hist": self.length_hist,
+                "gc_hist": self.gc_hist,
+                "gc_bases": self.gc_bases,
+                "quality_sum": self.quality_sum,
+                "tiles": json.dumps(self.tiles) if self.dotile else ""}
+
+    def _set_arrays(self, data):
+        self.N = int(data["N"])
+        self.counts = dict(zip(_BASES, data["counts"].tolist()))
+        self.total_length = int(data["total_length"])
+        self.quality_counts = data["quality_counts"]
+        self.position_quality = data["position_quality"]
+        self.position_bases = data["position_bases"]
+        self.length_hist = data["length_hist"]
+        self.gc_hist = data["gc_hist"]
+        self.gc_bases = data["gc_bases"]
+        self.quality_sum = float(data["quality_sum"])
+        tiles = str(data["tiles"])
+        self.dotile = bool(tiles)
+        self.tiles = json.loads(tiles) if tiles else {}
+
+    def save(self, filename, **metadata):
+        """Save in a compressed numpy file (.npz)
+
+        :param metadata: extra information stored as JSON (e.g. to identify
+            the input file)
+        """
+        with open(filename, "wb") as fh:
+            np.savez_compressed(fh, metadata=json.dumps(metadata),
+                **self._get_arrays())
+
+    @classmethod
+    def load(cls, filename, metadata=False):
+        """Load data saved with :meth:`save`
+
+        :param bool metadata: if True, returns the metadata as well
+        """
+        profile = cls()
+        with np.load(filename) as data:
+            profile._set_arrays(data)
+            info = json.loads(str(data["metadata"]))
+        if metadata:
+            return profile, info
+        return profile
+
+    def get_profile(self):
+        """Return a copy as a :class:`FastQProfile` instance"""
+        import copy
+        profile = FastQProfile(self.dotile)
+        for name in vars(profile):
+            setattr(profile, name, copy.deepcopy(getattr(self, name)))
+        return profile
+
+    def get_length_stats(self):
+        """Return mean, median, min, max, N50 and N90 of the read lengths
+
+        See :func:`sequana.stats.get_length_stats`
+        """
+        from sequana.stats import get_length_stats
+        return get_length_stats(self.length_hist)
+
+    def get_quality_per_position(self):
+        """See :meth:`FastQC.get_quality_per_position`"""
+        return _get_quality_per_position(self.position_quality)
+
+    def _get_gc_sum(self):
+        import math
+        lengths = np.arange(len(self.gc_bases))
+        return 100 * math.fsum(self.gc_bases[1:] / lengths[1:])
+    gc_sum = property(_get_gc_sum, doc="""Sum of the GC content of the reads
+
+        Computed from :attr:`gc_bases` so that it does not depend on the order
+        in which reads are added""")
+
+    def get_tile_stats(self):
+        """Return number of reads, bases and mean quality of each tile"""
+        df = pd.DataFrame(self.tiles, index=["n_reads", "n_bases",
+            "mean quality"]).T.astype(float)
+        df["mean quality"] /= df["n_bases"]
+        return df
+
+    def get_stats(self):
+        """Return the same statistics as :meth:`FastQC.get_stats`
+
+        The mean quality is computed on all reads.
+        """
+        stats = {"n_reads": self.N}
+        stats.update(self.counts)
+        stats["total bases"] = sum(self.counts.values())
+        stats["GC content"] = self.gc_sum / self.N
+        stats["average read length"] = self.total_length / float(self.N)
+        stats["mean quality"] = self.quality_sum / self.N
+        ts = pd.DataFrame([stats])
+        cols = ['n_reads', 'A', 'C', 'G', 'T', 'N', 'total bases']
+        ts[cols] = ts[cols].astype(int)
+        return ts[cols + ['GC content', 'average read length', 'mean quality']]
+
+
+class _FastQCStats(FastQProfile):
+    """Partial statistics computed by :class:`FastQC` on a subset of reads
+
+    In addition to the histograms of :class:`FastQProfile`, the mean
+    quality of the first reads is stored. Mean qualities are stored in the
+    order of the reads so the second operand of an addition must be the part
+    that follows the first one in the file. Once saved, they are stored as a
+    histogram (0.01 resolution) and their mean so that the size of the
+    statistics does not depend on the number of reads. If duplication is True, the
+    duplication rate is estimated as well (:class:`DuplicationEstimator` in
+    sketch mode, whose size is bounded).
+    """
+    def __init__(self, dotile=False, duplication=False):
+        super(_FastQCStats, self).__init__(dotile)
+        self.max_sample = 0
+        self.mean_qualities = []
+        self._mean_quality = None
+        self.duplication = None
+        if duplication:
+            self.duplication = DuplicationEstimator(mode="sketch")
+
+    def update(self, batch, max_sample=0):
+        """Add the reads of a :class:`FastQBatch`
+
+        :param int max_sample: mean qualities are stored for the first
+            max_sample reads only.
+        """
+        gc, mean_qualities = super(_FastQCStats, self).update(batch)
+
+        # we cannot store the mean quality of all reads, so
+        # just max_sample are stored:
+        self.max_sample = max(self.max_sample, max_sample)
+        nsample = max(0, min(len(batch), max_sample - len(self.mean_qualities)))
+        if nsample:
+            self.mean_qualities.extend(mean_qualities[0:nsample].tolist())
+            self._mean_quality = None
+        if self.duplication is not None:
+            self.duplication.update(batch)
+        return gc, mean_qualities
+
+    def __iadd__(self, other):
+        super(_FastQCStats, self).__iadd__(other)
+        # keep the first reads only
+        self.max_sample = max(self.max_sample, other.max_sample)
+        missing = max(0, self.max_sample - len(self.mean_qualities))
+        if missing and other.mean_qualities:
+            self.mean_qualities = self.mean_qualities + \
+                other.mean_qualities[0:missing]
+            self._mean_quality = None
+        if self.duplication is not None and other.duplication is not None:
+            self.duplication += other.duplication
+        else:
+            self.duplication = None
+        return self
+
+    def get_gc_list(self):
+        """Return GC content (percentage) of each read
+
+        Built from the histogram of the GC content (:attr:`gc_hist`) so values
+        are rounded to integers and sorted.
+        """
+        return np.repeat(np.arange(len(self.gc_hist)),
+            self.gc_hist).astype(float)
+
+    def get_mean_quality(self):
+        """Return the mean of :attr:`mean_qualities`
+
+        Exact even if the mean qualities were rebuilt from their histogram.
+        """
+        if self._mean_quality is not None:
+            return self._mean_quality
+        return np.mean(self.mean_qualities)
+
+    def _get_arrays(self):
+        data = super(_FastQCStats, self)._get_arrays()
+        qualities = np.array(self.mean_qualities, dtype=float)
+        finite = np.isfinite(qualities)
+        data.update({
+            "max_sample": self.max_sample,
+            "mean_quality_hist": np.bincount(
+                np.rint(qualities[finite] * 100).astype(int)),
+            "mean_quality_nan": int((~finite).sum()),
+            "mean_quality": self.get_mean_quality() if len(qualities)
+                else np.nan})
+        if self.duplication is not None:
+            for key, value in self.duplication._get_arrays().items():
+                data["duplication_" + key] = value
+        return data
+
+    def _set_arrays(self, data):
+        super(_FastQCStats, self)._set_arrays(data)
+        self.max_sample = int(data["max_sample"])
+        hist = data["mean_quality_hist"]
+        self.mean_qualities = (np.repeat(np.arange(len(hist)), hist) / 100.
+            ).tolist() + [np.nan] * int(data["mean_quality_nan"])
+        self._mean_quality = None
+        if self.mean_qualities:
+            self._mean_quality = float(data["mean_quality"])
+        self.duplication = None
+        if "duplication_params" in data:
+            self.duplication = DuplicationEstimator._from_arrays(
+                {key: data["duplication_" + key] for key in
+                 ("hashes", "counts", "registers", "params")})
+
+
+def _hash_prefixes(batch, prefix=50):
+    """Return a 64-bits hash of the first bases of each read of a batch"""
+    n = len(batch)
+    width = (prefix + 7) // 8 * 8
+    plen = np.minimum(batch.lengths, prefix)
+    # the prefixes are copied in a matrix (one row per read) padded with
+    # zeros and hashed 8 bytes at a time
+    positions = _concat_ranges(batch.sequence_start, batch.sequence_start + plen)
+    rows = np.repeat(np.arange(n), plen)
+    cols = positions - np.repeat(batch.sequence_start, plen)
+    matrix = np.zeros((n, width), dtype=np.uint8)
+    matrix[rows, cols] = batch._get_array()[positions]
+    words = matrix.view(np.uint64)
+
+    h = plen.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    for j in range(words.shape[1]):
+        h ^= words[:, j]
+        h *= np.uint64(0x100000001B3)
+        h ^= h >> np.uint64(29)
+    # final mixing of murmur3
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xC4CEB9FE1A85EC53)
+    h ^= h >> np.uint64(33)
+    return h
+
+
+class DuplicationEstimator(object):
+    """Estimate the duplication rate of reads in bounded memory
+
+    Reads are identified by a 64-bits hash of their first bases (prefix).
+    Two modes are available:
+
+    - exact: the number of occurrences of each hash is stored in a table
+      (12 bytes per distinct read).
+    - sketch: the number of distinct reads is estimated with a HyperLogLog
+      (2**p registers). The duplication histogram is estimated on a sample
+      of the distinct reads: only hashes below a threshold are counted and
+      the threshold is halved whenever the table contains more than
+      **max_size** entries. The memory does not depend on the number of
+      reads.
+
+    ::
+
+        dup = DuplicationEstimator(mode="sketch")
+        for batch in FastQ("test.fastq.gz").iter_batches():
+            dup.update(batch)
+        dup.get_stats()
+        dup.get_histogram()
+
+    Estimators computed on different files (or parts of a file) can be added
+    if they use the same parameters.
+    """
+    def __init__(self, prefix=50, mode="exact", max_size=1000000, p=14):
+        """.. rubric:: constructor
+
+        :param int prefix: number of bases used to identify a read
+        :param str mode: exact or sketch
+        :param int max_size: maximum number of entries of the table (sketch
+            mode)
+        :param int p: the HyperLogLog uses 2**p registers (sketch mode).
+            The relative error on the number of distinct reads is about
+            1.04 / sqrt(2**p)
+        """
+        assert mode in ("exact", "sketch"), "mode must be exact or sketch"
+        self.prefix = prefix
+        self.mode = mode
+        self.max_size = max_size
+        self.p = p
+        self.N = 0
+        # the table: sorted hashes and their counts
+        self.hashes = np.array([], dtype=np.uint64)
+        self.counts = np.array([], dtype=np.uint32)
+        # only hashes lower than 2**64 / 2**shift are in the table
+        self.shift = 0
+        self.registers = np.zeros(2 ** p if mode == "sketch" else 0, dtype=np.uint8)
+        self._pending = []
+        self._npending = 0
+
+    def update(self, batch):
+        """Add the reads of a :class:`FastQBatch`"""
+        hashes = _hash_prefixes(batch, self.prefix)
+        self.N += len(hashes)
+        if self.mode == "sketch":
+            self._update_registers(hashes)
+            hashes = self._sample(hashes)
+        self._pending.append(hashes)
+        self._npending += len(hashes)
+        if self._npending > max(1000000, self.max_size):
+            self._merge()
+
+    def _get_mask(self, hashes):
+        # hashes that belong to the sample, that is lower than 2**(64-shift)
+        if self.shift == 0:
+            return np.ones(len(hashes), dtype=bool)
+        return (hashes >> np.uint64(64 - self.shift)) == 0
+
+    def _sample(self, hashes):
+        return hashes[self._get_mask(hashes)]
+
+    def _update_registers(self, hashes):
+        # the first p bits give the register, the rank is the position of
+        # the lowest set bit of the other bits
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        bits = hashes & np.uint64(2 ** (64 - self.p) - 1)
+        lowest = bits & (~bits + np.uint64(1))
+        rank = np.full(len(hashes), 64 - self.p + 1, dtype=np.uint8)
+        found = bits > 0
+        rank[found] = np.log2(lowest[found].astype(float)).astype(np.uint8) + 1
+        np.maximum.at(self.registers, index, rank)
+
+    def _merge(self, hashes=None, counts=None):
+        # add pending hashes (or sorted distinct hashes and their counts) to
+        # the table. Only the new hashes are sorted; they are then merged
+        # into the sorted table in linear time
+        if hashes is None:
+            if not self._pending:
+                return
+            hashes, counts = np.unique(np.concatenate(self._pending),
+                return_counts=True)
+            counts = counts.astype(np.uint32)
+            self._pending, self._npending = [], 0
+        positions = np.searchsorted(self.hashes, hashes)
+        found = positions < len(self.hashes)
+        found[found] = self.hashes[positions[found]] == hashes[found]
+        self.counts = self.counts.copy()
+        self.counts[positions[found]] += counts[found]
+        new = ~found
+        self.hashes = np.insert(self.hashes, positions[new], hashes[new])
+        self.counts = np.insert(self.counts, positions[new], counts[new])
+        if self.mode == "sketch":
+            keep = self._get_mask(self.hashes)
+            while keep.sum() > self.max_size:
+                self.shift += 1
+                keep = self._get_mask(self.hashes)
+            self.hashes, self.counts = self.hashes[keep], self.counts[keep]
+
+    def __iadd__(self, other):
+        assert (self.prefix, self.mode, self.p) == (other.prefix, other.mode,
+            other.p), "estimators must use the same parameters"
+        self._merge()
+        other._merge()
+        self.shift = max(self.shift, other.shift)
+        keep = self._get_mask(other.hashes)
+        self._merge(other.hashes[keep], other.counts[keep])
+        if self.mode == "sketch":
+            self.registers = np.maximum(self.registers, other.registers)
+        self.N += other.N
+        return self
+
+    def _get_arrays(self):
+        self._merge()
+        return {"hashes": self.hashes, "counts": self.counts,
+                "registers": self.registers,
+                "params": [self.N, self.shift, self.prefix, self.max_size,
+                           self.p]}
+
+    @classmethod
+    def _from_arrays(cls, data, mode="sketch"):
+        N, shift, prefix, max_size, p = data["params"].tolist()
+        dup = cls(prefix=prefix, mode=mode, max_size=max_size, p=p)
+        dup.N, dup.shift = N, shift
+        dup.hashes, dup.counts = data["hashes"], data["counts"]
+        dup.registers = data["registers"]
+        return dup
+
+    def _get_hll_estimate(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            estimate = m * np.log(m / zeros)
+        return estimate
+
+    def get_distinct(self):
+        """Return the (estimated) number of distinct reads"""
+        self._merge()
+        if self.mode == "exact":
+            return len(self.hashes)
+        return min(self.N, int(round(self._get_hll_estimate())))
+
+    def get_histogram(self):
+        """Return number of distinct reads for each duplication level
+
+        :return: a Series indexed by the number of copies. In sketch mode,
+            values are estimated from the sample of distinct reads.
+        """
+        self._merge()
+        levels = np.bincount(self.counts.astype(np.int64))
+        index = np.flatnonzero(levels)
+        ts = pd.Series(levels[index] * 2 ** self.shift, index=index)
+        ts.index.name = "duplication level"
+        return ts
+
+    def get_stats(self):
+        """Return number of reads, distinct reads and unique fraction
+
+        The unique fraction is the number of distinct reads divided by the
+        number of reads and the duplication rate is 1 minus the unique
+        fraction.
+        """
+        distinct = self.get_distinct()
+        unique = distinct / float(self.N) if self.N else np.nan
+        return {"n_reads": self.N, "distinct": distinct,
+                "unique_fraction": unique, "duplication_rate": 1 - unique}
+
+
+class FastQCCache(object):
+    """On-disk cache of the statistics computed by :class:`FastQC`
+
+    Statistics of a FastQ file are stored in a compressed numpy file in the
+    cache directory (by default in the sequana configuration directory). An
+    entry is used only if the path, size, modification time and a hash of a
+    few samples of the file content match, as well as the max_sample
+    parameter of :class:`FastQC`::
+
+        cache = FastQCCache()
+        qc = FastQC("test.fastq.gz", cache=cache)
+        qc.get_stats()                      # computed and saved
+        FastQC("test.fastq.gz", cache=cache).get_stats()  # loaded
+
+        cache.invalidate("test.fastq.gz")   # remove entry of a file
+        cache.invalidate()                  # remove all entries
+
+    When the size of the cache exceeds **max_size**, least recently used
+    entries are removed.
+    """
+    def __init__(self, directory=None, max_size=1024**3):
+        """.. rubric:: constructor
+
+        :param str directory: where to store the entries. Defaults to the
+            fastqc_cache directory in the sequana configuration path.
+        :param int max_size: maximum size of the cache (in bytes)
+        """
+        if directory is None:
+            from sequana import sequana_config_path
+            directory = os.path.join(sequana_config_path, "fastqc_cache")
+        self.directory = directory
+        self.max_size = max_size
+
+    def _get_entry(self, filename):
+        import hashlib
+        path = os.path.realpath(filename).encode()
+        return os.path.join(self.directory,
+            hashlib.md5(path).hexdigest() + ".npz")
+
+    def get_fingerprint(self, filename, sample_size=65536):
+        """Return path, size, modification time and sampled hash of a file
+
+        The hash is computed on the beginning, middle and end of the file
+        so that it does not depend on the size of the file.
+        """
+        import hashlib
+        stat = os.stat(filename)
+        md5 = hashlib.md5()
+        with open(filename, "rb") as fh:
+            for pos in (0, stat.st_size // 2, stat.st_size - sample_size):
+                fh.seek(max(0, pos))
+                md5.update(fh.read(sample_size))
+        return {"path": os.path.realpath(filename), "size": stat.st_size,
+                "mtime": stat.st_mtime, "hash": md5.hexdigest()}
+
+    def load(self, filename, max_sample):
+        """Return cached statistics of a file or None"""
+        entry = self._get_entry(filename)
+        try:
+            stats, metadata = _FastQCStats.load(entry, metadata=True)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        fingerprint = self.get_fingerprint(filename)
+        fingerprint["max_sample"] = max_sample
+        if metadata != fingerprint:
+            return None
+        # least recently used entries are removed first
+        os.utime(entry, None)
+        return stats
+
+    def save(self, filename, max_sample, stats):
+        """Store statistics of a file
+
+        :return: True if the entry could be saved
+        """
+        fingerprint = self.get_fingerprint(filename)
+        fingerprint["max_sample"] = max_sample
+        entry = self._get_entry(filename)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            stats.save(entry + ".tmp", **fingerprint)
+            if os.path.getsize(entry + ".tmp") > self.max_size:
+                os.remove(entry + ".tmp")
+                logger.warning("Statistics of %s are larger than the cache "
+                    "(max_size=%s); not cached" % (filename, self.max_size))
+                return False
+            os.rename(entry + ".tmp", entry)
+        except (IOError, OSError):
+            return False
+        self.evict(keep=entry)
+        return True
+
+    def _get_entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, x) for x in
+            os.listdir(self.directory) if x.endswith(".npz")]
+
+    def invalidate(self, filename=None):
+        """Remove entry of a file or all entries if no filename is provided"""
+        if filename is None:
+            entries = self._get_entries()
+        else:
+            entries = [self._get_entry(filename)]
+        for entry in entries:
+            if os.path.exists(entry):
+                os.remove(entry)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache is small enough
+
+        :param keep: an entry that must not be removed (e.g. the one just
+            saved)
+        """
+        entries = [(os.stat(x).st_mtime, os.path.getsize(x), x)
+                   for x in self._get_entries()]
+        total = sum(x[1] for x in entries)
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry == keep:
+                continue
+            os.remove(entry)
+            total -= size
+
+    def _get_size(self):
+        return sum(os.path.getsize(x) for x in self._get_entries())
+    size = property(_get_size, doc="size of the cache (in bytes)")
+
+
+class _KmerCounts(object):
+    """Counts of the kmers (k <= 16) found in a set of reads
+
+    Kmers are encoded as integers (see :func:`sequana.kmer.get_kmer_codes`).
+    For small k, a dense array of 4**k counts is used. Otherwise, the
+    distinct codes and their counts are stored. Partial counts computed on
+    different parts of a file can be added.
+    """
+    dense_max = 11
+
+    def __init__(self, k=7):
+        self.k = k
+        self.N = 0
+        if k <= self.dense_max:
+            self.counts = np.zeros(4 ** k, dtype=np.int64)
+        else:
+            self.codes = np.array([], dtype=np.uint32)
+            self.counts = np.array([], dtype=np.int64)
+        self.others = Counter()
+
+    def _add(self, codes, counts):
+        if self.k <= self.dense_max:
+            self.counts[codes] += counts
+        else:
+            codes = np.concatenate([self.codes, codes])
+            counts = np.concatenate([self.counts, counts])
+            self.codes, inverse = np.unique(codes, return_inverse=True)
+            self.counts = np.bincount(inverse, weights=counts,
+                minlength=len(self.codes)).astype(np.int64)
+
+    def update(self, batch):
+        from sequana.kmer import get_kmer_codes
+        bases = batch.get_sequences()
+        codes, others = get_kmer_codes(bases, batch.lengths, self.k)
+        if self.k <= self.dense_max:
+            self.counts += np.bincount(codes, minlength=4 ** self.k)
+        else:
+            codes, counts = np.unique(codes, return_counts=True)
+            self._add(codes, counts)
+        if len(others):
+            self.others.update(bases[i:i+self.k].tobytes() for i in others)
+        self.N += len(batch)
+
+    def __iadd__(self, other):
+        if self.k <= self.dense_max:
+            self.counts += other.counts
+        else:
+            self._add(other.codes, other.counts)
+        self.others.update(other.others)
+        self.N += other.N
+        return self
+
+    def to_series(self):
+        """Return counts of the kmers found in the reads (bytes as index)"""
+        from sequana.kmer import decode_kmers
+        if self.k <= self.dense_max:
+            codes = np.flatnonzero(self.counts)
+            counts = self.counts[codes]
+        else:
+            codes, counts = self.codes, self.counts
+        ts = pd.Series(counts, index=decode_kmers(codes, self.k))
+        if self.others:
+            ts = pd.concat([ts, pd.Series(self.others)])
+        return ts
+
+
+def _kmer_worker(filerange, data, k):
+    # count kmers on a byte range (filename, start, stop) of a plain FastQ or
+    # on a decompressed block of complete records
+    if filerange is not None:
+        chunks = _read_range(*filerange)
+    else:
+        chunks = iter([data])
+    counts = _KmerCounts(k)
+    for batch in _iter_batches(chunks):
+        counts.update(batch)
+    return counts
+
+
+def _bounded_results(jobs, size):
+    # results of asynchronous jobs in submission order; at most size jobs
+    # are submitted in advance
+    from collections import deque
+    pending = deque()
+    for job in jobs:
+        pending.append(job)
+        if len(pending) > size:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _fastqc_worker(filerange, data, max_sample, dotile=False,
+        duplication=False):
+    # compute partial statistics on a byte range (filename, start, stop) of
+    # a plain FastQ or on a decompressed block of complete records
+    if filerange is not None:
+        chunks = _read_range(*filerange)
+    else:
+        chunks = iter([data])
+    stats = _FastQCStats(dotile, duplication)
+    for batch in _iter_batches(chunks):
+        stats.update(batch, max_sample)
+    return stats
+
+
 class FastQC(object):
     """Simple QC diagnostic
 
@@ -834,11 +2531,14 @@ class FastQC(object):
 
     .. note:: Although all reads are parsed (e.g. to count the number of
         nucleotides, some information uses a limited number of reads (e.g.
-        qualities), which is set to 500,000 by deafult.
+        mean quality of the reads, qualities per tile), which is set to
+        500,000 by deafult. Qualities and base content per position are
+        accumulated in histograms over all reads.
 
 
     """
-    def __init__(self, filename, max_sample=500000, dotile=False, verbose=True):
+    def __init__(self, filename, max_sample=500000, dotile=False, verbose=True,
+            threads=1, cache=False, duplication=False):
         """.. rubric:: constructor
 
         :param filename:
@@ -848,16 +2548,47 @@ class FastQC(object):
             good feeling of the data quality. The entire input file is
             parsed tough. This is required for instance to get the number of
             nucleotides.
+        :param int threads: number of processes used to scan the file. Plain
+            files are split into chunks of complete records analysed by each
+            process. Gzipped files are decompressed by the main process while
+            the others analyse the decompressed blocks. Results are identical
+            to the sequential scan (threads=1).
+        :param cache: if True, statistics are stored in (and loaded from) the
+            default :class:`FastQCCache`. A :class:`FastQCCache` instance
+            can also be provided.
+        :param bool duplication: estimate the duplication rate while the
+            file is scanned (see :meth:`get_duplication`). The estimate is
+            stored in the cache as well.
         """
         self.verbose = verbose
         self.filename = filename
+        self.threads = threads
+        self.dotile = dotile
+        self.duplication = duplication
+
+        if cache is True:
+            cache = FastQCCache()
+        self.cache = cache or None
 
         # Later we will use pysam to scan the fastq because
         # it iterate quickly while providing the quality already converted
         # However, the FastQ implementation in this module is faster at
         # computing the length by a factor 3
         self.fastq = FastQ(filename)
-        self.N = len(self.fastq)
+        self._partial = None
+        if self.cache:
+            self._partial = self.cache.load(filename, max_sample)
+            # tiles may be missing in the cached statistics
+            if self._partial is not None and dotile and not self._partial.dotile:
+                self._partial = None
+            if self._partial is not None and duplication and \
+                    self._partial.duplication is None:
+                self._partial = None
+        if self._partial is not None:
+            self.N = self._partial.N
+        else:
+            self.N = len(self.fastq)
+        self._max_sample = max_sample
 
         # Use only max_sample in some of the computation
         self.max_sample = min(max_sample, self.N)
@@ -870,77 +2601,141 @@ class FastQC(object):
 
         Will be called on request"""
 
+        if self._partial is not None:
+            partial = self._partial
+        else:
+            partial = self._get_partial_stats()
+            if self.cache:
+                self.cache.save(self.filename, self._max_sample, partial)
+
         stats = {"A":0, "C":0, "G":0, "T":0, "N":0}
+        stats.update(partial.counts)
         stats["qualities"] = []
         stats["mean_qualities"] = []
         stats["mean_length"] = 0
         stats["sequences"] = []
 
-        minimum = 1e6
-        maximum = 0
-        # FIXME this self.N takes time in the cosntructor
-        # do we need it ?
-        self.lengths = np.empty(self.N)
-        self.gc_list = []
-        total_length = 0
-        C = defaultdict(int)
-        if self.verbose:
-            pb = Progress(self.N)
+        # other data
+        self.length_hist = partial.length_hist
+        self.length_stats = partial.get_length_stats()
+        self.gc_hist = partial.gc_hist
+        self.mean_qualities = partial.mean_qualities
+        self.position_quality = partial.position_quality
+        self.position_bases = partial.position_bases
+        self.minimum = self.length_stats["min"]
+        self.maximum = self.length_stats["max"]
+        self.gc_content = partial.gc_sum / self.N if self.N else np.nan
+        self._profile = partial
+        stats['mean_length'] = partial.total_length / float(self.N)
+        stats['total_bp'] = stats['A'] + stats['C'] + stats['G'] + stats["T"] + stats['N']
+        stats['mean_quality'] = int(np.dot(np.arange(256) - 33,
+            partial.quality_counts)) / stats['total_bp']
+
+        self.stats = stats
 
-        sequences = []
-        mean_qualities = []
-        qualities = []
-        # could use multiprocessing
-        # FastxFile has shown some errors while handling gzip files
-        # created with zlib (e.g. from atropos). This is now replaced
-        # by the Atropos FastqReader for now.
-        #fastq = pysam.FastxFile(self.filename)
-
-        with FastqReader(self.filename) as f:
-            for i, record in enumerate(f):
-                N = len(record.sequence)
-                self.lengths[i] = N
-
-                # we can store all qualities and sequences reads, so
-                # just max_sample are stored:
-                if i < self.max_sample:
-                    quality = [ord(x) -33 for x in record.qualities]
-                    mean_qualities.append(sum(quality) / N)
-                    qualities.append(quality)
-                    sequences.append(record.sequence)
+    @run_info
+    def _get_lengths(self):
+        return np.repeat(np.arange(len(self.length_hist)),
+            self.length_hist).astype(float)
+    lengths = property(_get_lengths, doc="""Length of the reads (sorted)
 
-                # store count of all qualities
-                for k in record.qualities:
-                    C[k] += 1
+        Built from the histogram of the lengths (:attr:`length_hist`), which
+        should be used instead for large files""")
 
-                GG = record.sequence.count('G') 
-                CC = record.sequence.count('C')
-                self.gc_list.append((GG+CC)/float(N)*100)
+    @run_info
+    def _get_gc_list(self):
+        return self._profile.get_gc_list()
+    gc_list = property(_get_gc_list, doc="""GC content of the reads (sorted)
 
-                # not using a counter, or loop speed up the code
-                stats["A"] += record.sequence.count("A")
-                stats["C"] += CC
-                stats["G"] += GG
-                stats["T"] += record.sequence.count("T")
-                stats["N"] += record.sequence.count("N")
+        Built from the histogram of the GC content (:attr:`gc_hist`), which
+        should be used instead for large files""")
 
-                total_length += len(record.sequence)
+    @run_info
+    def get_length_stats(self):
+        """Return mean, median, min, max, N50 and N90 of the read lengths
 
-                if self.verbose:
-                    pb.animate(i+1)
+        See :func:`sequana.stats.get_length_stats`
+        """
+        return self.length_stats.copy()
 
-        # other data
-        self.qualities = qualities
-        self.mean_qualities = mean_qualities
-        self.minimum = int(self.lengths.min())
-        self.maximum = int(self.lengths.max())
-        self.sequences = sequences
-        self.gc_content = np.mean(self.gc_list)
-        stats['mean_length'] = total_length / float(self.N)
-        stats['total_bp'] = stats['A'] + stats['C'] + stats['G'] + stats["T"] + stats['N']
-        stats['mean_quality'] = sum([(ord(k) -33)*v for k,v in C.items()]) / stats['total_bp']
+    @run_info
+    def get_profile(self):
+        """Return the statistics as a :class:`FastQProfile`
 
-        self.stats = stats
+        Profiles of different files (e.g. lanes) can be added together.
+        Tiles are included if dotile is True.
+        """
+        return self._profile.get_profile()
+
+    @run_info
+    def get_duplication(self):
+        """Return the :class:`DuplicationEstimator` (sketch mode) of the reads
+
+        Computed during the scan of the file (and cached) if *duplication*
+        was set in the constructor. Otherwise, the file is read again.
+        """
+        if self._profile.duplication is not None:
+            return self._profile.duplication
+        return self.fastq.get_duplication(mode="sketch")
+
+    def _get_partial_stats(self):
+        pb = Progress(self.N) if self.verbose else None
+
+        if self.threads > 1:
+            return self._get_partial_stats_parallel(pb)
+
+        # The reads are parsed by batches (see FastQ.iter_batches) so that
+        # counts are vectorised with numpy on all reads of a batch at once.
+        partial = _FastQCStats(self.dotile, self.duplication)
+        for batch in self.fastq.iter_batches():
+            partial.update(batch, self.max_sample)
+            if self.verbose:
+                pb.animate(partial.N)
+        return partial
+
+    def _get_partial_stats_parallel(self, pb=None):
+        # Plain files are split into byte ranges that each process reads on
+        # its own. Compressed files (gz or BGZF) are decompressed here and
+        # blocks of complete records are sent to the processes. In both
+        # cases the partial results are merged in the order of the file, so
+        # that the mean qualities of the first max_sample reads are kept even
+        # if they span several chunks.
+        import multiprocessing
+        from collections import deque
+
+        pool = multiprocessing.Pool(self.threads)
+        partial = _FastQCStats(self.dotile, self.duplication)
+        try:
+            if self.filename.endswith(".gz"):
+                jobs = deque()
+                dispatched = 0
+                for block, nreads in self.fastq._iter_record_blocks():
+                    # mean qualities are needed for the first reads only
+                    # (max_sample)
+                    nsample = max(0, self.max_sample - dispatched)
+                    dispatched += nreads
+                    jobs.append(pool.apply_async(_fastqc_worker,
+                        (None, block, nsample, self.dotile,
+                         self.duplication)))
+                    # bounded number of blocks in memory
+                    while len(jobs) > 2 * self.threads:
+                        partial += jobs.popleft().get()
+                        if pb: pb.animate(partial.N)
+                while jobs:
+                    partial += jobs.popleft().get()
+                    if pb: pb.animate(partial.N)
+            else:
+                chunks = self.fastq._get_chunks(self.threads)
+                args = [((self.filename, start, stop), None, self.max_sample,
+                         self.dotile, self.duplication)
+                        for start, stop in chunks]
+                for this in pool.starmap(_fastqc_worker, args):
+                    partial += this
+                    if pb: pb.animate(partial.N)
+        finally:
+            pool.close()
+            pool.join()
+        return partial
 
     @run_info
     def imshow_qualities(self):
@@ -970,45 +2765,101 @@ class FastQC(object):
         pylab.ylabel("tile number")
 
     def _get_qualities(self):
-        from sequana import logger
         logger.info("Extracting qualities")
         qualities = []
-        with FastqReader(self.filename) as f:
-            for i, record in enumerate(f):
-                if i < self.max_sample:
-                    quality = [ord(x) -33 for x in record.qualities]
+        for batch in self.fastq.iter_batches():
+            for i in range(len(batch)):
+                if len(qualities) < self.max_sample:
+                    quality = [x - 33 for x in batch.get_quality(i)]
                     qualities.append(quality)
-                else:
-                    break
+            if len(qualities) >= self.max_sample:
+                break
         return qualities
 
+    def _get_sample_qualities(self):
+        if getattr(self, "_qualities", None) is None:
+            self._qualities = self._get_qualities()
+        return self._qualities
+    qualities = property(_get_sample_qualities,
+        doc="qualities of the first max_sample reads (computed on request)")
+
+    def _get_sequences(self):
+        sequences = []
+        for batch in self.fastq.iter_batches():
+            for i in range(len(batch)):
+                if len(sequences) < self.max_sample:
+                    sequences.append(batch.get_sequence(i).decode())
+            if len(sequences) >= self.max_sample:
+                break
+        return sequences
+
+    def _get_sample_sequences(self):
+        if getattr(self, "_sequences", None) is None:
+            self._sequences = self._get_sequences()
+        return self._sequences
+    sequences = property(_get_sample_sequences,
+        doc="sequences of the first max_sample reads (computed on request)")
+
+    @run_info
+    def get_quality_per_position(self):
+        """Return statistics of the quality at each position of the reads
+
+        :return: dataframe with the mean, standard deviation and the
+            10, 25, 50, 75 and 90% percentiles of the quality at each
+            position (rows). All reads are used.
+        """
+        return _get_quality_per_position(self.position_quality)
+
     def boxplot_quality(self, hold=False, ax=None):
         """Boxplot quality
 
-        Same plots as in FastQC that is average quality for all bases.
-        In addition a 1 sigma error enveloppe is shown (yellow).
+        Same plots as in FastQC that is a box plot of the quality at each
+        position together with the average quality (red line). Boxes go from
+        the 25% to the 75% percentiles and whiskers from the 10% to the 90%
+        percentiles.
 
         Background separate zone of good, average and bad quality (arbitrary).
 
+        Statistics are computed on all reads from the histogram of qualities
+        at each position (see :meth:`get_quality_per_position`).
         """
-        qualities = self._get_qualities()
-        df = pd.DataFrame(qualities)
-        from biokit.viz.boxplot import Boxplot
-        bx = Boxplot(df)
-        try:
-            # new version of biokit
-            bx.plot(ax=ax)
-        except:
-            bx.plot()
+        df = self.get_quality_per_position()
+        if ax:
+            pylab.sca(ax)
+        ax = pylab.gca()
+        xmax = len(df) + 1
+        pylab.fill_between([0,xmax], [0,0], [20,20], color='red', alpha=0.3)
+        pylab.fill_between([0,xmax], [20,20], [30,30], color='orange', alpha=0.3)
+        pylab.fill_between([0,xmax], [30,30], [41,41], color='green', alpha=0.3)
+
+        stats = [{"whislo": row["10%"], "q1": row["25%"], "med": row["50%"],
+                  "q3": row["75%"], "whishi": row["90%"], "fliers": []}
+                 for _, row in df.iterrows()]
+        X = range(1, len(df) + 1)
+        ax.bxp(stats, positions=X, widths=0.8, patch_artist=True,
+               showfliers=False, manage_ticks=False,
+               boxprops={"facecolor": "yellow"},
+               medianprops={"color": "k"})
+        pylab.plot(X, df['mean'], color='r', lw=2)
+        pylab.ylim([0, 41])
+        pylab.xlim([0, xmax])
+        pylab.title("Quality scores across all bases")
+        pylab.xlabel("Position in read (bp)")
+        pylab.ylabel("Quality")
+        pylab.grid(axis='x')
 
     def _get_tile_info(self):
         identifiers = []
         tiles = {}
-        with FastqReader(self.filename) as f:
-            for i, record in enumerate(f):
-                if i < self.max_sample:
-                    identifier = Identifier(record.name)
+        for batch in self.fastq.iter_batches():
+            for i in range(len(batch)):
+                if len(identifiers) < self.max_sample:
+                    # same as the name of a record (no @ character)
+                    name = batch.get_identifier(i)[1:].decode()
+                    identifier = Identifier(name)
                     identifiers.append(identifier.info)
+            if len(identifiers) >= self.max_sample:
+                break
         tiles['x'] = [float(this['x_coordinate']) for this in identifiers]
         tiles['y'] = [float(this['y_coordinate']) for this in identifiers]
         tiles['tiles'] = [this['tile_number'] for this in identifiers]
@@ -1048,18 +2899,15 @@ class FastQC(object):
             qc.histogram_sequence_lengths()
 
         """
-        data = [len(x) for x in self.sequences]
-        bary, barx = np.histogram(data, bins=range(max(data)+1))
-
         # get rid of zeros to avoid warnings
-        bx = [x for x,y in zip(barx, bary) if y!=0]
-        by = [y for x,y in zip(barx, bary) if y!=0]
+        bx = np.flatnonzero(self.length_hist)
+        by = self.length_hist[bx]
         if logy:
             pylab.bar(bx, pylab.log10(by))
         else:
             pylab.bar(bx, by)
 
-        pylab.xlim([1,max(data)+1])
+        pylab.xlim([1, self.maximum + 1])
 
         pylab.grid(True)
         pylab.xlabel("position (bp)", fontsize=self.fontsize)
@@ -1079,7 +2927,8 @@ class FastQC(object):
             qc.histogram_gc_content()
 
         """
-        pylab.hist(self.gc_list, bins=range(0, 100))
+        pylab.hist(np.arange(len(self.gc_hist)), bins=range(0, 100),
+            weights=self.gc_hist)
         pylab.grid()
         pylab.title("GC content distribution (per sequence)")
         pylab.xlabel(r"Mean GC content (%)", fontsize=self.fontsize)
@@ -1097,7 +2946,7 @@ class FastQC(object):
         stats["n_reads"] = self.N
 
         stats['total bases'] = self.stats['total_bp']
-        stats['mean quality'] = np.mean(self.mean_qualities)
+        stats['mean quality'] = self._profile.get_mean_quality()
         stats['average read length'] = self.stats['mean_length']
         stats['min read length'] = self.minimum
         stats['max read length'] = self.maximum
@@ -1111,28 +2960,15 @@ class FastQC(object):
 
     @run_info
     def get_actg_content(self):
-        # what is the longest string ?
-        lengths = [len(x) for x in self.sequences]
-        max_length = max(lengths)
-
-        # count ACGTN in each columns for all sequences
-        Nseq = len(self.sequences)
-        from collections import Counter
-        data = []
-        for pos in range(max_length):
-            # we add empty strings to have all sequences with same lengths
-            data.append(Counter([
-                (self.sequences[i] + " " * (max_length - len(self.sequences[i])) )[pos] 
-                for i in range(Nseq)]))
-
-        # remove the empty strings to normalise the data
-        df = pd.DataFrame.from_records(data)
-        if " " in df.columns:
-            df.drop(" ", axis=1, inplace=True)
-        df.fillna(0, inplace=True)
+        """Return proportion of A, C, G, T (and N) at each position
+
+        All reads are used. The N column is included only if N letters were
+        found.
+        """
+        df = pd.DataFrame(self.position_bases, columns=list(_BASES) + ["other"])
         df = df.divide(df.sum(axis=1), axis=0)
 
-        if "N" in df.columns:
+        if self.position_bases[:, _BASES.index("N")].sum():
             df = df[["A", "C", "G", "T", "N"]]
         else:
             df = df[["A", "C", "G", "T"]]
@@ -16,9 +16,11 @@
 ##############################################################################
 import glob
 import os
+from itertools import islice
 
 from sequana.lazy import  pandas as pd
 from sequana import FastQ, FastA
+from sequana.stats import LengthHistogram
 from sequana.lazy import pylab
 
 
@@ -96,11 +98,21 @@ class IsoSeq(object):
             results['hq_isoform'] = self.hq_sequence.stats() # number of polished HQ isoform
 
         if self.ccs:
-            seq = [ read.sequence for read in self.ccs]
+            # lengths are accumulated in a histogram by chunks of reads
+            hist = LengthHistogram()
+            reads = iter(self.ccs)
+            while True:
+                lengths = [len(read.sequence) for read in islice(reads, 100000)]
+                if not lengths:
+                    break
+                hist.update(lengths)
+            stats = hist.get_stats()
             results["CCS"] = {
-                "mean_length" : pylab.mean(seq),
-                "number_ccs_bases" : sum(seq),
-                "number_ccs_reads" : len(seq)
+                "mean_length" : stats["mean"],
+                "median_length": stats["median"],
+                "N50": stats["N50"],
+                "number_ccs_bases" : stats["total_bases"],
+                "number_ccs_reads" : stats["N"]
             }
 
         self.idents_v = []
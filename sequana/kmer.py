@@ -39,3 +39,79 @@ def get_kmer(sequence, k=7):
     """
     for i in range(0, len(sequence)-k+1):
         yield sequence[i:i+k]
+
+
+def _get_base_codes():
+    # A, C, G, T encoded on 2 bits. Other letters (including N and lower
+    # cases) are invalid (4)
+    import numpy as np
+    codes = np.full(256, 4, dtype=np.uint8)
+    for i, letter in enumerate(b"ACGT"):
+        codes[letter] = i
+    return codes
+
+
+def get_kmer_codes(bases, lengths, k=7):
+    """Encode all kmers of a set of reads into integers
+
+    :param bases: concatenated sequences of the reads (uint8 array)
+    :param lengths: length of each read
+    :param int k: length of the kmers (at most 16)
+    :return: a tuple made of the codes of the kmers made of A, C, G, T
+        letters only (uint32 array) and the positions in **bases** of the
+        kmers containing other letters (e.g. N).
+
+    Each base is encoded on 2 bits (A=0, C=1, G=2, T=3) so that a kmer of
+    length k is an integer lower than 4**k. Kmers spanning two reads are
+    ignored.
+
+    .. doctest::
+
+        >>> import numpy as np
+        >>> from sequana.kmer import get_kmer_codes
+        >>> bases = np.frombuffer(b"ACGTAC", dtype=np.uint8)
+        >>> codes, others = get_kmer_codes(bases, [6], k=5)
+        >>> list(codes)
+        [108, 433]
+
+    """
+    import numpy as np
+    assert k <= 16, "kmers must be at most 16 bases long"
+    lengths = np.asarray(lengths, dtype=np.int64)
+    N = len(bases) - k + 1
+    if N <= 0:
+        return np.array([], dtype=np.uint32), np.array([], dtype=np.int64)
+
+    encoded = _get_base_codes()[bases]
+    codes = np.zeros(N, dtype=np.uint32)
+    for j in range(k):
+        codes <<= 2
+        codes |= encoded[j:j+N] & 3
+
+    # a kmer must start in a read at least k bases before its end
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    inside = np.zeros(len(bases) + 1, dtype=np.int64)
+    valid = lengths >= k
+    np.add.at(inside, starts[valid], 1)
+    np.add.at(inside, ends[valid] - k + 1, -1)
+    inside = np.cumsum(inside[0:N]) > 0
+
+    # number of invalid letters in each kmer
+    invalid = np.concatenate([[0], np.cumsum(encoded == 4)])
+    invalid = (invalid[k:k+N] - invalid[0:N]) > 0
+
+    return codes[inside & ~invalid], np.flatnonzero(inside & invalid)
+
+
+def decode_kmers(codes, k=7):
+    """Convert integer codes (see :func:`get_kmer_codes`) into kmers
+
+    :return: list of kmers (bytes)
+    """
+    import numpy as np
+    codes = np.asarray(codes, dtype=np.uint32)
+    shifts = 2 * np.arange(k - 1, -1, -1, dtype=np.uint32)
+    digits = (codes[:, None] >> shifts) & 3
+    letters = np.frombuffer(b"ACGT", dtype=np.uint8)[digits]
+    return np.ascontiguousarray(letters).view("S%s" % k).ravel().tolist()
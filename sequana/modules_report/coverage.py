@@ -35,11 +35,14 @@ class CoverageModule(SequanaBaseModule):
     """ Write HTML report of coverage analysis. This class takes either a
     :class:`GenomeCov` instances or a csv file where analysis are stored.
     """
-    def __init__(self, data):
+    def __init__(self, data, html_list=None):
         """.. rubric:: constructor
 
         :param data: it can be a csv filename created by sequana_coverage or a
         :class:`bedtools.GenomeCov` object.
+        :param list html_list: the HTML pages of the chromosomes if they were
+            already created (e.g. with :class:`ChromosomeCoverageModule`). In
+            such case, only the main page is created.
         """
         super().__init__()
         try:
@@ -51,7 +54,8 @@ class CoverageModule(SequanaBaseModule):
         except TypeError:
             self.bed = data
         try:
-            html_list = self.create_reports()
+            if html_list is None:
+                html_list = self.create_reports()
         except TypeError:
             msg = ("Data must be either a csv file or a :class:`GenomeCov` "
                    "instance where zscore is computed.")
@@ -92,8 +92,12 @@ class FastQStatsModule(SequanaBaseModule):
         else:
             df = pd.read_json(filenames[0])
             df.index = ['R1']
-        df = df[["A", "C", "G", "T", "N", "n_reads", "mean quality", "GC content",
-                "average read length", "total bases"]]
+        columns = ["A", "C", "G", "T", "N", "n_reads", "mean quality",
+            "GC content", "average read length", "total bases"]
+        # not available in older results
+        if "duplication (%)" in df.columns:
+            columns.append("duplication (%)")
+        df = df[columns]
         for this in "ACGTN":
             df[this] /= df["total bases"] 
             df[this] *= 100
@@ -116,7 +120,9 @@ class FastQStatsModule(SequanaBaseModule):
 
         html = """<p>The following table gives some basic statistics about the data before any filtering.
    The A, C, G, T, N columns report the percentage of each bases in the overall sequences.
-   The GC content is provided in percentage as well. </p>
+   The GC content is provided in percentage as well. The duplication is the
+   estimated percentage of reads that are copies of another read (based on
+   the first 50 bases). </p>
    <div>{} {}</div>
    <div>""".format(html_tab, js)
 
@@ -22,6 +22,8 @@ import shutil
 import glob
 import sys
 import argparse
+import contextlib
+import io
 from optparse import OptionParser
 from argparse import RawTextHelpFormatter
 
@@ -32,7 +34,7 @@ from sequana.utils import config
 from sequana import logger
 from sequana.bedtools import GenomeCov, FilteredGenomeCov
 
-from easydev import shellcmd, mkdirs
+from easydev import mkdirs
 from easydev.console import purple
 
 from pylab import show, figure, savefig
@@ -57,10 +59,14 @@ class Options(argparse.ArgumentParser):
     - a BED file that is a tabulated file at least 3 columns.
       The first column being the reference, the second is the position 
       and the third column contains the coverage itself. 
-    - or a BAM file that is converted automatically
-      into a BED file using the following command:
+    - or a BAM file. The coverage is then computed directly from the
+      alignments as with:
 
-        samtools depth -aa input.bam > output.bed
+        bedtools genomecov -d -ibam input.bam > output.bed
+
+      A fourth column is added with the coverage of the alignments that have
+      a mapping quality above zero. The BAM file should be indexed so that
+      the chromosomes are processed one at a time.
 
     If the reference is provided, an additional plot showing the coverage versus
     GC content is also shown.
@@ -112,8 +118,8 @@ Issues: http://github.com/sequana/sequana
         group = self.add_argument_group("Required argument")
         group.add_argument("-i", "--input", dest="input", type=str,
             help=("Input file in BED or BAM format. If a BAM file is "
-                 "provided, it will be converted locally to a BED file "
-                 "using genomecov, which must be installed."))
+                 "provided, the coverage is computed directly from the "
+                 "alignments."))
 
         group = self.add_argument_group("Optional biological arguments")
         group.add_argument(
@@ -140,6 +146,11 @@ Issues: http://github.com/sequana/sequana
         group.add_argument('--no-report', dest="create_report",
             default=True, action='store_false',
             help="""Do not create any HTML report""")
+        group.add_argument("--threads", "--processes", dest="threads",
+            default=1, type=int,
+            help="""Number of processes used to analyse the chromosomes/contigs
+            in parallel (largest first). Output is the same whatever the
+            number of processes.""")
         group.add_argument("--logging-level", dest="logging_level",
             default="INFO",
             help="set to DEBUG, INFO, WARNING, CRITICAL, ERROR")
@@ -170,6 +181,14 @@ Issues: http://github.com/sequana/sequana
                  useful in the presence of long deleted regions.""",
             default=4001)
 
+        group.add_argument("--block-size", dest="block_size", type=int,
+            default=0,
+            help="""Chromosomes longer than this value are analysed by blocks
+                 of this size so that the running median and zscore of the
+                 entire chromosome are not kept in memory (e.g. 10000000 for
+                 chromosomes of several hundreds of Mb). Results are the
+                 same. Requires --no-report since the report plots the
+                 entire chromosome. Default 0 (disabled)""")
         group.add_argument("-k", "--mixture-models", dest="k", type=int,
             help="""Number of mixture models to use (default 2, although if sequencing
         depth is below 8, k is set to 1 automatically). To ignore that behaviour
@@ -245,17 +264,13 @@ def main(args=None):
         logger.info("Reading %s. This may take time depending on "
             "your input file" % options.input)
 
-    # Convert BAM to BED
-    if options.input.endswith(".bam"):
-        bedfile = options.input.replace(".bam", ".bed")
-        if options.verbose:
-            logger.info("Converting BAM into BED file")
-        shellcmd("bedtools genomecov -d -ibam %s > %s" % (options.input, bedfile))
-    elif options.input.endswith(".bed"):
-        bedfile = options.input
-    else:
+    # The coverage of a BAM file is computed directly (no BED file)
+    if not options.input.endswith((".bam", ".bed")):
         raise ValueError("Input file must be a BAM or BED file")
 
+    if options.block_size and options.create_report:
+        raise ValueError("--block-size can only be used with --no-report")
+
     # Set the thresholds
     if options.low_threshold is None:
         options.low_threshold = -options.threshold
@@ -267,24 +282,24 @@ def main(args=None):
     config.output_dir = options.output_directory
     config.sample_name = os.path.basename(options.input).split('.')[0]
 
-    # Now we can create the instance of GenomeCoverage
-    gc = GenomeCov(bedfile, options.genbank, options.low_threshold,
+    # Now we can create the instance of GenomeCoverage. The BED file is only
+    # scanned here; the chromosomes are read one at a time
+    gc = GenomeCov(options.input, options.genbank, options.low_threshold,
                    options.high_threshold, options.double_threshold,
-                    options.double_threshold)
+                    options.double_threshold, lazy=True,
+                    threads=options.threads)
 
     # if we have the reference, let us use it
     if options.reference:
         logger.info('Computing GC content')
         gc.compute_gc_content(options.reference, options.w_gc,
-                              options.circular)
+                              options.circular, threads=options.threads)
 
     # Now we scan the chromosomes,
     if len(gc.chr_list) == 1:
         if options.verbose:
             logger.warning("There is only one chromosome. Selected automatically.")
-        chrom = gc.chr_list[0]
-        chromosomes = [chrom]
-        run_analysis(chrom, options, gc.feature_dict)
+        chromosomes = [gc.chr_list[0]]
     elif options.chromosome <=-1 or options.chromosome > len(gc.chr_list):
         raise ValueError("invalid chromosome index ; must be in [1-{}]".format(len(gc.chr_list)+1))
     else: # chromosome index is zero 
@@ -299,19 +314,33 @@ def main(args=None):
             for this in gc.chr_list:
                 print("    {}".format(this.chrom_name))
 
-        for i, chrom in enumerate(chromosomes):
-            if options.verbose:
-                print("==================== analysing chrom/contig %s/%s (%s)"
-                      % (i + options.chromosome, len(gc),
-                      chrom.chrom_name))
-            run_analysis(chrom, options, gc.feature_dict)
+    if options.create_report and options.verbose:
+        logger.info("Creating report in %s. Please wait" % config.output_dir)
+
+    html_list = []
+    datatable = None
+    if options.threads > 1 and not options.chromosome and len(gc) > 1:
+        html_list = run_parallel_analysis(gc, options)
+        chromosomes = []
+    for i, chrom in enumerate(chromosomes):
+        if options.verbose and len(gc) > 1:
+            print("==================== analysing chrom/contig %s/%s (%s)"
+                  % (i + options.chromosome, len(gc),
+                  chrom.chrom_name))
+        run_analysis(chrom, options, gc.feature_dict)
+
+        # In the multi chromosome case, the report of a chromosome is created
+        # as soon as it is analysed so that its data can be released.
+        if options.create_report and not options.chromosome:
+            if datatable is None:
+                datatable = CoverageModule.init_roi_datatable(chrom)
+            logger.info("Creating coverage report {}".format(chrom.chrom_name))
+            html_list.append(ChromosomeCoverageModule(chrom, datatable).html_page)
+            chrom.release()
 
     if options.create_report is False:
         return
 
-    if options.verbose:
-        logger.info("Creating report in %s. Please wait" % config.output_dir)
-
     if options.chromosome:
         cc = options.chromosome - 1
         datatable = CoverageModule.init_roi_datatable(gc[cc])
@@ -319,7 +348,7 @@ def main(args=None):
         page = "{0}{1}{2}.cov.html".format(config.output_dir, os.sep,
                                            chrom.chrom_name)
     else:
-        CoverageModule(gc)
+        CoverageModule(gc, html_list)
         page = "{0}{1}coverage.html".format(config.output_dir, os.sep)
 
     if options.show_html:
@@ -327,43 +356,131 @@ def main(args=None):
         onweb(page)
 
 
-def run_analysis(chrom, options, feature_dict):
+# GenomeCov instance and options shared with the workers of the pool
+_worker_data = {}
 
-    if options.verbose:
-        print(chrom)
 
-    if options.verbose:
-        logger.info('Computing running median (w=%s)' % options.w_median)
+def _init_worker(gc, options):
+    _worker_data["gc"] = gc
+    _worker_data["options"] = options
 
-    # compute running median
-    chrom.running_median(n=options.w_median, circular=options.circular)
 
+def _analyse_chromosome(index):
+    # analyse a chromosome in a worker. The standard output is returned so
+    # that the parent prints it in the order of the chromosomes
+    gc = _worker_data["gc"]
+    options = _worker_data["options"]
+    chrom = gc[index]
+    stdout = io.StringIO()
+    page = None
+    with contextlib.redirect_stdout(stdout):
+        if options.verbose:
+            print("==================== analysing chrom/contig %s/%s (%s)"
+                  % (index + options.chromosome, len(gc), chrom.chrom_name))
+        run_analysis(chrom, options, gc.feature_dict)
+        if options.create_report:
+            # all ROI tables have the same columns hence the same datatable
+            datatable = CoverageModule.init_roi_datatable(chrom)
+            page = ChromosomeCoverageModule(chrom, datatable).html_page
+    summary = chrom.summary
+    chrom.release()
+    return stdout.getvalue(), page, summary
+
+
+def run_parallel_analysis(gc, options):
+    """Analyse all chromosomes with a pool of processes
+
+    Chromosomes are sent to the workers largest first. The results
+    (standard output, HTML page and summary of the chromosome) are gathered
+    in the order of the chromosomes so that the output is the same as with
+    one process.
+
+    :return: list of HTML pages of the chromosomes
+    """
+    from multiprocessing import Pool
+
+    # the number of mixture models must be the same as with one process
+    chrom = gc[0]
+    loaded = chrom.is_loaded
+    set_mixture_models(chrom, options)
+    if not loaded:
+        chrom.release()
+
+    # directories of the report are created here and not by the workers
+    if options.create_report:
+        from sequana.modules_report.base_module import SequanaBaseModule
+        for directory in SequanaBaseModule.required_dir + ("coverage_reports",):
+            mkdirs(os.sep.join([config.output_dir, directory]))
+
+    order = sorted(range(len(gc)), key=lambda i: -len(gc[i]))
+    pool = Pool(options.threads, initializer=_init_worker,
+                initargs=(gc, options))
+    try:
+        jobs = {i: pool.apply_async(_analyse_chromosome, (i,)) for i in order}
+        html_list = []
+        for i, chrom in enumerate(gc):
+            stdout, page, summary = jobs.pop(i).get()
+            sys.stdout.write(stdout)
+            if options.create_report:
+                logger.info("Creating coverage report {}".format(
+                    chrom.chrom_name))
+                html_list.append(page)
+            chrom.summary = summary
+    finally:
+        pool.close()
+        pool.join()
+    return html_list
+
+
+def set_mixture_models(chrom, options):
+    # the number of mixture models depends on the sequencing depth of the
+    # first chromosome analysed unless set by the user
     stats = chrom.get_stats(output="dataframe")
     stats.set_index("name", inplace=True)
 
-    DOC = stats.ix['DOC'].Value
+    DOC = stats.loc['DOC'].Value
     if options.k is None and DOC < 8:
         options.k = 1
     elif options.k is None:
         options.k = 2
 
+
+def run_analysis(chrom, options, feature_dict):
+
+    if options.verbose:
+        print(chrom)
+
+    by_block = options.block_size and len(chrom) > options.block_size
+
+    # compute running median
+    if not by_block:
+        if options.verbose:
+            logger.info('Computing running median (w=%s)' % options.w_median)
+        chrom.running_median(n=options.w_median, circular=options.circular)
+
+    set_mixture_models(chrom, options)
+
     if options.verbose:
         print("Number of mixture model %s " % options.k)
         print('Computing zscore')
 
     # Compute zscore
-    chrom.compute_zscore(k=options.k, verbose=options.verbose)
+    if by_block:
+        if options.verbose:
+            logger.info('Computing running median (w=%s) and zscore by '
+                        'blocks of %s bases' % (options.w_median,
+                        options.block_size))
+        # positions needed for the centralness (3 and 4 sigma) are kept
+        # when the ROIs are computed so that blocks are computed only once
+        thresholds = chrom.thresholds
+        chrom.compute_zscore_by_block(options.w_median, options.circular,
+            k=options.k, block_size=options.block_size,
+            limits=(-3 * thresholds.ldtr, 3 * thresholds.hdtr))
+    else:
+        chrom.compute_zscore(k=options.k, verbose=options.verbose)
 
     # Save the CSV file of the ROIs
-    high = chrom.thresholds.high2
-    low = chrom.thresholds.low2
-    query = "zscore > @high or zscore < @low"
-    if feature_dict and chrom.chrom_name in feature_dict:
-        f = FilteredGenomeCov(chrom.df.query(query),
-                        chrom.thresholds,
-                        feature_list=feature_dict[chrom.chrom_name])
-    else:
-        f = FilteredGenomeCov(chrom.df.query(query), chrom.thresholds)
+    f = chrom.get_roi()
     directory = options.output_directory 
     directory += os.sep + "coverage_reports" 
     directory += os.sep + chrom.chrom_name
@@ -54,7 +54,7 @@ Issues: http://github.com/sequana/sequana
 
 def get_fastq_stats(filename, sample=1e16):
     from sequana import FastQC
-    ff = FastQC(filename, max_sample=sample, verbose=False)
+    ff = FastQC(filename, max_sample=sample, verbose=False, cache=True)
     stats = ff.get_stats()
     return stats
 
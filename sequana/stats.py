@@ -22,7 +22,7 @@ from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 
 
-__all__ = ["moving_average", "evenness"] 
+__all__ = ["moving_average", "evenness", "LengthHistogram", "get_length_stats"]
 
 
 def moving_average(data, n):
@@ -66,3 +66,90 @@ def evenness(data):
     else:
         
         return 1. - (len(D2) - sum(D2) / C) / len(coverage)
+
+
+def get_length_stats(hist):
+    """Return statistics of a distribution of lengths given its histogram
+
+    :param hist: number of sequences for each length (hist[i] is the number
+        of sequences of length i)
+    :return: dictionary with the number of sequences (N), the total number
+        of bases, the mean, median, minimum and maximum lengths and the N50
+        and N90.
+
+    The N50 is the length such that sequences of this length or longer
+    contain at least half of the bases.
+
+    ::
+
+        >>> from sequana.stats import get_length_stats
+        >>> get_length_stats([0, 0, 1, 0, 2])["N50"]
+        4
+
+    """
+    hist = np.asarray(hist, dtype=np.int64)
+    N = int(hist.sum())
+    if N == 0:
+        return {"N": 0, "total_bases": 0, "mean": np.nan, "median": np.nan,
+            "min": np.nan, "max": np.nan, "N50": np.nan, "N90": np.nan}
+    lengths = np.flatnonzero(hist)
+    counts = hist[lengths]
+    bases = lengths * counts
+    total = int(bases.sum())
+
+    # median as in numpy (mean of the two middle values if N is even)
+    cumsum = np.cumsum(counts)
+    middle = [(N - 1) // 2, N // 2]
+    median = lengths[np.searchsorted(cumsum, middle, side="right")].mean()
+
+    # cumulative number of bases starting from the longest sequences
+    cumbases = np.cumsum(bases[::-1])
+    stats = {"N": N, "total_bases": total, "mean": total / float(N),
+        "median": float(median), "min": int(lengths[0]),
+        "max": int(lengths[-1])}
+    for name, fraction in [("N50", 0.5), ("N90", 0.9)]:
+        index = np.searchsorted(cumbases, fraction * total)
+        stats[name] = int(lengths[::-1][index])
+    return stats
+
+
+class LengthHistogram(object):
+    """Histogram of lengths with integer bins computed on the fly
+
+    Lengths are added by arrays (e.g. lengths of a batch of reads). Only the
+    number of sequences for each length is stored so that the memory does
+    not depend on the number of sequences. The histogram grows with the
+    longest sequence found::
+
+        >>> from sequana.stats import LengthHistogram
+        >>> hist = LengthHistogram()
+        >>> hist.update([100, 150, 150])
+        >>> hist.get_stats()["median"]
+        150.0
+
+    """
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def update(self, lengths):
+        """Add an array of lengths"""
+        hist = np.bincount(np.asarray(lengths, dtype=np.int64))
+        if len(hist) > len(self.counts):
+            self.counts = np.concatenate([self.counts,
+                np.zeros(len(hist) - len(self.counts), dtype=np.int64)])
+        self.counts[0:len(hist)] += hist
+
+    def __iadd__(self, other):
+        counts = other.counts
+        hist = np.zeros(max(len(self.counts), len(counts)), dtype=np.int64)
+        hist[0:len(self.counts)] += self.counts
+        hist[0:len(counts)] += counts
+        self.counts = hist
+        return self
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def get_stats(self):
+        """See :func:`get_length_stats`"""
+        return get_length_stats(self.counts)
@@ -18,12 +18,15 @@
 ##############################################################################
 """General tools"""
 import os
+import hashlib
 import string
 import glob
 import json
 import re
 import gzip
 import io
+import struct
+import zlib
 from collections import Counter
 
 from sequana.lazy import pandas as pd
@@ -34,6 +37,7 @@ from pysam import FastxFile
 from easydev import precision
 from easydev.misc import cmd_exists
 import subprocess
+import collections
 
 __all__ = ['StatsBAM2Mapped', 'bam_to_mapped_unmapped_fastq', "GZLineCounter"]
 
@@ -69,10 +73,12 @@ def reverse(seq):
 
 class StatsBAM2Mapped(DataContainer):
 
-    def __init__(self, bamfile=None, wkdir=None, verbose=True):
+    def __init__(self, bamfile=None, wkdir=None, verbose=True, threads=4,
+            compress=False):
         super(StatsBAM2Mapped, self).__init__(wkdir=wkdir)
         if bamfile.endswith(".bam"):
-            self.data = bam_to_mapped_unmapped_fastq(bamfile, wkdir, verbose)
+            self.data = bam_to_mapped_unmapped_fastq(bamfile, wkdir, verbose,
+                threads=threads, compress=compress)
         elif bamfile.endswith(".json"):
             self.data = self.read_json(bamfile)
 
@@ -96,7 +102,82 @@ class StatsBAM2Mapped(DataContainer):
         return html
 
 
-def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True):
+class _FastQWriter(object):
+    """Buffered FastQ writer used by :func:`bam_to_mapped_unmapped_fastq`
+
+    Records are accumulated as lists of names, sequences and qualities and
+    written by blocks. Reverse reads are reverse-complemented in bulk when
+    a block is flushed. If the output filename ends in .gz, each block is
+    compressed as a gzip member by a (shared) pool of threads.
+    """
+    def __init__(self, filename, pool=None, level=6):
+        self.filename = filename
+        self.pool = pool if filename.endswith(".gz") else None
+        self.level = level
+        self.fout = open(filename, "wb")
+        self.jobs = collections.deque()
+        self._reset()
+
+    def _reset(self):
+        self.names = []
+        self.sequences = []
+        self.qualities = []
+        self.reverse = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, sequence, quality, reverse=False):
+        if reverse:
+            self.reverse.append(len(self.names))
+        self.names.append("@" + name)
+        self.sequences.append(sequence)
+        self.qualities.append(quality)
+
+    def flush(self):
+        if not self.names:
+            return
+        if self.reverse:
+            # translating and reversing the joined reads reverse-complements
+            # all of them at once (the reads are then in reversed order)
+            seqs = "\n".join(self.sequences[i] for i in self.reverse)
+            seqs = seqs.translate(_translate)[::-1].split("\n")
+            quals = "\n".join(self.qualities[i] for i in self.reverse)
+            quals = quals[::-1].split("\n")
+            for i, seq, qual in zip(reversed(self.reverse), seqs, quals):
+                self.sequences[i] = seq
+                self.qualities[i] = qual
+
+        N = len(self.names)
+        lines = [None] * (4 * N)
+        lines[0::4] = self.names
+        lines[1::4] = self.sequences
+        lines[2::4] = ["+"] * N
+        lines[3::4] = self.qualities
+        lines.append("")
+        data = "\n".join(lines).encode()
+        self._reset()
+
+        if self.pool is None:
+            self.fout.write(data)
+            return
+        self.jobs.append(self.pool.apply_async(gzip.compress, (data, self.level)))
+        # bounded number of blocks waiting for compression
+        while len(self.jobs) > 2:
+            self.fout.write(self.jobs.popleft().get())
+
+    def close(self):
+        self.flush()
+        while self.jobs:
+            self.fout.write(self.jobs.popleft().get())
+        if self.pool is not None and self.fout.tell() == 0:
+            # an empty file is not a valid gzip file
+            self.fout.write(gzip.compress(b"", self.level))
+        self.fout.close()
+
+
+def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True,
+        threads=4, compress=False, level=6, batch_size=10000):
     """Create mapped and unmapped fastq files from a BAM file
 
     :context: given a reference, one or two FastQ files are mapped onto the
@@ -106,6 +187,12 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True):
 
     :param filename: input BAM file
     :param output_directory: where to save the mapped and unmapped files
+    :param int threads: number of threads used by pysam to decompress the
+        BAM file and to compress the output files
+    :param bool compress: if True, the FastQ files are gzipped directly
+        (extension .fastq.gz)
+    :param int level: compression level of gzipped outputs
+    :param int batch_size: number of alignments buffered before writing
     :return: dictionary with number of reads for each file (mapped/unmapped for
         R1/R2) as well as the mode (paired or not), the number of unpaired
         reads, and the number of duplicated reads. The unpaired reads should
@@ -115,9 +202,11 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True):
     In the paired-end case, 4 files are created.
 
     Note that this function is efficient in that it does not create intermediate
-    files limiting IO in the process. As compared to standard tools such as 
-    bedtools bamtofastq, it is 1.5 to 2X slower but it does create the mapped
-    AND unmapped reads.
+    files limiting IO in the process. Alignments are decoded by pysam with
+    several threads and routed using their flags only. Records are then
+    written by blocks: reverse reads are reverse-complemented in bulk and,
+    if **compress** is set, blocks are compressed by a pool of threads while
+    the BAM is still being read.
 
     :Details: Secondary alignment (flag 256) are dropped so as to remove any
         ambiguous alignments. The output dictionary stores "secondary" key to
@@ -146,12 +235,23 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True):
         total reads = unmappeds reads + R1 mapped + R2 mapped - supplementary
         reads (those with flag 2048).
     """
-    bam = BAM(filename)
-    # figure out if this is paired or unpaired
+    import pysam
+    from itertools import chain
+    from multiprocessing.pool import ThreadPool
+
+    bam = pysam.AlignmentFile(filename, "rb", check_sq=False, threads=threads)
+    alignments = bam.fetch(until_eof=True)
+
+    # figure out if this is paired or unpaired using the first alignment
+    try:
+        first = next(alignments)
+        alignments = chain([first], alignments)
+        is_paired = first.is_paired
+    except StopIteration:
+        is_paired = False
 
     newname, ext = os.path.splitext(filename)
 
-    import collections
     stats = collections.defaultdict(int)
     stats['R1_unmapped'] = 0
     stats['R1_mapped'] = 0
@@ -167,100 +267,92 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, verbose=True):
 
     rt1 = "_R1_"
     rt2 = "_R2_"
+    suffix = ".fastq.gz" if compress else ".fastq"
 
-    R1_mapped = open(newname + "{}.mapped.fastq".format(rt1), "wb")
-    R1_unmapped = open(newname + "{}.unmapped.fastq".format(rt1), "wb")
+    pool = ThreadPool(threads) if compress else None
+    writers = {
+        "R1_mapped": _FastQWriter(newname + rt1 + ".mapped" + suffix, pool, level),
+        "R1_unmapped": _FastQWriter(newname + rt1 + ".unmapped" + suffix, pool, level)}
     stats['duplicated'] = 0
     stats['unpaired'] = 0
 
-    unpaired = 0
-
     # if paired, let open other files
-    if bam.is_paired:
+    if is_paired:
         stats['mode'] = "pe"
         stats['R2_unmapped'] = 0
         stats['R2_mapped'] = 0
-        R2_mapped = open(newname + "{}.mapped.fastq".format(rt2), "wb")
-        R2_unmapped = open(newname + "{}.unmapped.fastq".format(rt2), "wb")
+        writers["R2_mapped"] = _FastQWriter(newname + rt2 + ".mapped" + suffix, pool, level)
+        writers["R2_unmapped"] = _FastQWriter(newname + rt2 + ".unmapped" + suffix, pool, level)
     else:
         stats['mode'] = "se"
 
-    # loop through the BAM (make sure it is rewinded)
-    bam.reset()
-
     if verbose:
-        from easydev import Progress
-        pb = Progress(len(bam))
-
-    for i, this in enumerate(bam):
-        if this.flag & 256:
-            # Unmapped reads are in the BAM file but have no valid assigned
-            # position (N.B., they may have an assigned position, but it should be ignored).
-            # It's typically the case that a number of reads can't be aligned, due to things
-            # like sequencing errors, imperfect matches between the DNA sequenced and the
-            # reference, random e. coli or other contamination, etc..
-            # A secondary alignment occurs when a given read could align reasonably well to
-            # more than one place. One of the possible reported alignments is termed "primary"
-            # and the others will be marked as "secondary".
-            stats['secondary'] += 1
-            if this.is_paired is False:
-                stats['unpaired'] += 1
-        else:
-            # in pysam, seq is a string and qual a bytes....
-            if this.is_reverse is True:
-                txt = b"@" + bytes(this.qname, "utf-8") + b"\n"
-                revcomp = reverse_complement(this.seq)
-                txt += bytes(revcomp, "utf-8") + b"\n"
-                txt += b"+\n"
-                txt += bytes(this.qual[::-1], 'utf-8') + b"\n"
-            else:
-                txt = b"@" + bytes(this.qname, "utf-8") + b"\n"
-                txt += bytes(this.seq, "utf-8") + b"\n"
-                txt += b"+\n"
-                txt += bytes(this.qual,"utf-8") + b"\n"
-
-            # Here, we must be careful as to keep the pairs. So if R1 is mapped
-            # but R2 is unmapped (or the inverse), then the pair is mapped
-            if this.is_read1:
-                if this.is_unmapped and this.mate_is_unmapped:
-                    R1_unmapped.write(txt)
-                    stats['R1_unmapped'] += 1
-                else:
-                    R1_mapped.write(txt)
-                    stats['R1_mapped'] += 1
-            elif this.is_read2:
-                if this.is_unmapped and this.mate_is_unmapped:
-                    R2_unmapped.write(txt)
-                    stats['R2_unmapped'] += 1
-                else:
-                    R2_mapped.write(txt)
-                    stats['R2_mapped'] += 1
+        # the number of alignments is only known (cheaply) for indexed BAM
+        try:
+            from easydev import Progress
+            pb = Progress(bam.mapped + bam.unmapped)
+        except ValueError:
+            pb = None
+
+    # flags: paired (1), unmapped (4), mate unmapped (8), reverse (16),
+    # read1 (64), read2 (128), secondary (256), duplicate (1024)
+    count = 0
+    try:
+        for this in alignments:
+            count += 1
+            if count % batch_size == 0:
+                for writer in writers.values():
+                    writer.flush()
+                if verbose and pb:
+                    pb.animate(count)
+
+            flag = this.flag
+            if flag & 256:
+                # Unmapped reads are in the BAM file but have no valid
+                # assigned position (N.B., they may have an assigned
+                # position, but it should be ignored). It's typically the
+                # case that a number of reads can't be aligned, due to
+                # things like sequencing errors, imperfect matches between
+                # the DNA sequenced and the reference, random e. coli or
+                # other contamination, etc.. A secondary alignment occurs
+                # when a given read could align reasonably well to more
+                # than one place. One of the possible reported alignments
+                # is termed "primary" and the others will be marked as
+                # "secondary".
+                stats['secondary'] += 1
+                if not flag & 1:
+                    stats['unpaired'] += 1
+                continue
+
+            # Here, we must be careful as to keep the pairs. So if R1 is
+            # mapped but R2 is unmapped (or the inverse), then the pair is
+            # mapped
+            if flag & 64:
+                unmapped = flag & 12 == 12
+                key = "R1_unmapped" if unmapped else "R1_mapped"
+            elif flag & 128:
+                unmapped = flag & 12 == 12
+                key = "R2_unmapped" if unmapped else "R2_mapped"
             else:
                 # This should be a single read
-                #assert self.is_paired is False
                 stats['unpaired'] += 1
-                if this.is_unmapped:
-                    R1_unmapped.write(txt)
-                    stats['R1_unmapped'] += 1
-                else:
-                    R1_mapped.write(txt)
-                    stats['R1_mapped'] += 1
+                key = "R1_unmapped" if flag & 4 else "R1_mapped"
+            stats[key] += 1
+            writers[key].add(this.query_name, this.query_sequence,
+                this.qual, flag & 16)
 
-            if this.is_duplicate:
+            if flag & 1024:
                 stats['duplicated'] += 1
-
-        if verbose:
-            pb.animate(i+1)
-
-    if bam.is_paired:
-        R2_mapped.close()
-        R2_unmapped.close()
+    finally:
+        for writer in writers.values():
+            writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        bam.close()
 
     if verbose:
-        print("\nNumber of entries in the BAM: %s" % str(i+1))
-
-    R1_mapped.close()
-    R1_unmapped.close()
+        print("\nNumber of entries in the BAM: %s" % count)
 
     _x = stats['R1_mapped']
     _y = stats['R1_unmapped']
@@ -320,52 +412,95 @@ def bam_get_paired_distance(filename):
     return distances
 
 
-def _base_content(filename, window_size, letters, circular=False):
+def _get_window_content(sequence, window_size, letters, circular=False):
+    """Fraction of letters in a sliding window centered on each position
+
+    :param sequence: a sequence (str or bytes)
+    :return: float32 array of the same length as the sequence. Without
+        circular wrapping, positions whose window does not fit in the sequence
+        are set to NaN.
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    table = np.zeros(256, dtype=bool)
+    for letter in letters:
+        table[ord(letter)] = True
+    mask = table[np.frombuffer(sequence, dtype=np.uint8)]
+
+    N = len(mask)
+    mid = int(window_size / 2)
+    if circular and mid:
+        mask = np.concatenate([mask[-mid:], mask, mask[:mid]])
+
+    # number of letters in each window from the difference of a cumulative sum
+    dtype = np.int32 if len(mask) < 2**31 else np.int64
+    cumsum = np.zeros(len(mask) + 1, dtype=dtype)
+    np.cumsum(mask, dtype=dtype, out=cumsum[1:])
+    counts = cumsum[window_size:] - cumsum[:-window_size]
+
+    content = np.empty(N, dtype=np.float32)
+    content[:] = np.nan
+    if circular:
+        counts = counts[:N]
+        content[:len(counts)] = counts
+    else:
+        content[mid:mid + len(counts)] = counts
+    content /= window_size
+    return content
+
+
+def _window_content_worker(args):
+    name, sequence, window_size, letters, circular = args
+    return name, _get_window_content(sequence, window_size, letters, circular)
+
+
+def _base_content(filename, window_size, letters, circular=False, threads=1):
     # DOC: see gc_content
     fasta = FastxFile(filename)
-    checker = set(letters)
+    jobs = ((chrom.name, chrom.sequence, window_size, letters, circular)
+            for chrom in fasta)
+    if threads == 1:
+        return dict(map(_window_content_worker, jobs))
+
+    # chromosomes are processed in parallel. Only a few of them are sent in
+    # advance to limit the memory used by pending sequences
+    import multiprocessing
     chrom_gc_content = dict()
-    for chrom in fasta:
-        mid = int(window_size / 2)
-        # Create gc_content array
-        gc_content = np.empty(len(chrom.sequence))
-        gc_content[:] = np.nan
-        if circular:
-            chrom.sequence = (chrom.sequence[-mid:] + chrom.sequence +
-                    chrom.sequence[:mid])
-            # Does not shift index of array
-            mid = 0
-        # Count first window content
-        counter = Counter(chrom.sequence[0:window_size])
-        gc_count = 0
-        for letter in letters:
-            gc_count += counter[letter]
-
-        gc_content[mid] = gc_count
-        for i in range(1, len(chrom.sequence) - window_size + 1):
-            if chrom.sequence[i - 1] in checker:
-                gc_count -= 1
-            if chrom.sequence[i + window_size - 1] in checker:
-                gc_count += 1
-            gc_content[i + mid] = gc_count
-        chrom_gc_content[chrom.name] = gc_content / window_size
+    pending = collections.deque()
+    pool = multiprocessing.Pool(threads)
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(_window_content_worker, (job,)))
+            if len(pending) > threads:
+                name, content = pending.popleft().get()
+                chrom_gc_content[name] = content
+        while pending:
+            name, content = pending.popleft().get()
+            chrom_gc_content[name] = content
+    finally:
+        pool.close()
+        pool.join()
     return chrom_gc_content
 
 
 def gc_content(filename, window_size, circular=False, 
-        letters=['G', 'C', 'c', 'g']):
+        letters=['G', 'C', 'c', 'g'], threads=1):
     """Return GC content for the different sequences found in a FASTA file
 
     :param filename: fasta formated file
     :param window_size: window length used to compute GC content
     :param circular: set to True if sequences are circular.
-    :return: dictionary with keys as fasta names and values as GC content vecor
-
-    .. todo:: case when the genome is not circular -> Add NaN at start and stop of
-        the np.arange()
-
+    :param int threads: number of chromosomes processed in parallel
+    :return: dictionary with keys as fasta names and values as GC content
+        vector (float32). If the sequences are not circular, the positions
+        closer to the ends than half the window size are set to NaN.
+
+    The content of each sliding window is obtained with NumPy from the
+    cumulative sum of a boolean mask of the letters, so that no Python loop
+    over the bases is required.
     """
-    return _base_content(filename, window_size, letters, circular=circular)
+    return _base_content(filename, window_size, letters, circular=circular,
+        threads=threads)
 
 def genbank_features_parser(input_filename):
     """ Return dictionary with features contains inside a genbank file.
@@ -435,89 +570,376 @@ def genbank_features_parser(input_filename):
 
 
 
+def is_bgzf(filename):
+    """Return True if the file is compressed with BGZF (e.g. bgzip)
+
+    BGZF files are standard gzip files made of independent blocks of at most
+    64Kb. The size of each block is stored in the header (BC extra field)
+    so that blocks can be located and decompressed independently.
+    """
+    with open(filename, "rb") as fh:
+        header = fh.read(18)
+    return _get_bgzf_block_size(header) is not None
+
+
+def _get_bgzf_block_size(header):
+    # Return total size of a BGZF block given its header or None if this is
+    # not a BGZF block
+    if len(header) < 18 or header[0:4] != b"\x1f\x8b\x08\x04":
+        return None
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = header[12:12 + xlen]
+    # scan the subfields of the extra field to find BC
+    pos = 0
+    while pos + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[pos+2:pos+4])[0]
+        if extra[pos:pos+2] == b"BC" and slen == 2:
+            return struct.unpack("<H", extra[pos+4:pos+6])[0] + 1
+        pos += 4 + slen
+    return None
+
+
+def iter_bgzf_blocks(filename, start=0, chunksize=16*1024*1024):
+    """Iterate over the compressed blocks of a BGZF file
+
+    :param int start: offset of the first block to read
+    :return: iterator over tuples made of the offset of a block in the file
+        and the compressed block (bytes)
+
+    Blocks are located using their header only (no decompression).
+    """
+    with open(filename, "rb") as fh:
+        fh.seek(start)
+        offset = start
+        buf = b""
+        pos = 0
+        while True:
+            if len(buf) - pos < 18 + 65536:
+                buf = buf[pos:] + fh.read(chunksize)
+                pos = 0
+            if pos >= len(buf):
+                break
+            size = _get_bgzf_block_size(buf[pos:pos+18 + 256])
+            if size is None:
+                raise ValueError("Invalid BGZF block at offset %s" % offset)
+            yield offset, buf[pos:pos+size]
+            pos += size
+            offset += size
+
+
+def inflate_bgzf_block(block):
+    """Return decompressed content of a BGZF block"""
+    # skip header (18 bytes) and footer (CRC32 + ISIZE)
+    return zlib.decompress(block[18:-8], -15)
+
+
+def _count_block_lines(block):
+    return inflate_bgzf_block(block).count(b"\n")
+
+
 class GZLineCounter(object):
     """Fast GZipped line counter
 
-    Uses zcat if possible, otherwise gzip library (twice as slow).
+    The file is decompressed by large blocks, in which end-of-line characters
+    are counted. Files compressed with BGZF (see :func:`is_bgzf`) are made
+    of independent blocks, which are decompressed in parallel by several
+    threads (zlib releases the GIL).
+
+    The number of lines can be cached (see the *cache* argument) in a small
+    sidecar file stored in the user cache directory together with the size
+    and modification time of the input file, so that the count is not
+    repeated by other tools of a pipeline. A sidecar that does not match the
+    current file is ignored. If the directory is not writable, the count is
+    simply not cached.
 
     .. doctest::
 
         >>> from sequana import sequana_data
-        >>> from sequana.misc import GZLineCounter
+        >>> from sequana.tools import GZLineCounter
         >>> gz = GZLineCounter(sequana_data("test.fastq.gz"))
         >>> len(gz)
-        100
+        1000
 
     """
-    def __init__(self, filename):
+    def __init__(self, filename, threads=4, cache=False, directory=None):
+        """.. rubric:: constructor
+
+        :param filename: a gzipped file
+        :param int threads: number of threads used for BGZF files
+        :param bool cache: read and write the sidecar file
+        :param directory: where sidecar files are stored. Defaults to the
+            nlines_cache directory in the sequana configuration path.
+        """
         self.filename = filename
-        if cmd_exists("zcat"):
-            self.use_zcat = True
-        else:
-            self.use_zcat = False
+        self.threads = threads
+        self.cache = cache
+        if directory is None:
+            from sequana import sequana_config_path
+            directory = os.path.join(sequana_config_path, "nlines_cache")
+        path = os.path.realpath(filename).encode()
+        self.sidecar = os.path.join(directory,
+            hashlib.md5(path).hexdigest() + ".nlines")
 
     def __len__(self):
-        if self.use_zcat:
-            return self._use_zcat()
-        else:
-            return self._use_gzip()
+        if self.cache:
+            count = self._read_sidecar()
+            if count is not None:
+                return count
 
-    def _use_zcat(self):
+        if is_bgzf(self.filename):
+            count = self._use_bgzf()
+        else:
+            count = self._use_gzip()
+
+        if self.cache:
+            self._write_sidecar(count)
+        return count
+
+    def _get_fingerprint(self):
+        stat = os.stat(self.filename)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def _read_sidecar(self):
+        try:
+            with open(self.sidecar, "r") as fh:
+                data = json.load(fh)
+            fingerprint = self._get_fingerprint()
+            if data["size"] == fingerprint["size"] and \
+                    data["mtime"] == fingerprint["mtime"]:
+                return data["lines"]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _write_sidecar(self, count):
+        data = self._get_fingerprint()
+        data["lines"] = count
+        try:
+            os.makedirs(os.path.dirname(self.sidecar), exist_ok=True)
+            with open(self.sidecar, "w") as fh:
+                json.dump(data, fh)
+        except (IOError, OSError):
+            pass
+
+    def _use_gzip(self, chunksize=4*1024*1024):
         i = 0
-        p = subprocess.Popen(["zcat", self.filename], stdout=subprocess.PIPE)
-        for line in p.stdout:
-            i +=1
+        with gzip.open(self.filename) as gz_file:
+            for chunk in iter(lambda: gz_file.read(chunksize), b""):
+                i += chunk.count(b"\n")
         return i
 
-    """twice as fast as the other method below but large memory print
-    def _use_gzip(self):
-        with gzip.open(self.filename) as gz_file:
-            data = gz_file.read()
-        return len(data.splitlines())
-    """
-    def _use_gzip(self):
+    def _use_bgzf(self, group=512):
+        # blocks are processed by groups to limit memory usage
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.threads)
         i = 0
-        with gzip.open(self.filename) as gz_file:
-            with io.BufferedReader(gz_file) as f:
-                for line in f:
-                    i += 1
+        try:
+            blocks = []
+            for offset, block in iter_bgzf_blocks(self.filename):
+                blocks.append(block)
+                if len(blocks) == group:
+                    i += sum(pool.map(_count_block_lines, blocks))
+                    blocks = []
+            i += sum(pool.map(_count_block_lines, blocks))
+        finally:
+            pool.close()
+            pool.join()
         return i
 
 
+def iter_in_thread(iterable, size=4):
+    """Consume an iterable in a background thread
+
+    :param iterable: any iterable (e.g. batches of reads from a file)
+    :param int size: maximum number of items read in advance
+    :return: an iterator over the same items
+
+    Useful to decompress/parse several files at the same time since zlib
+    releases the GIL. Exceptions raised in the thread are raised again in
+    the caller.
+    """
+    import threading
+    import queue
+    items = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def run():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put((item, None))
+        except Exception as err:
+            items.put((None, err))
+        items.put((done, None))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if err is not None:
+                raise err
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        # unblock the thread if the queue is full
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
 
 class PairedFastQ(object):
+    """Check and repair the synchronisation of paired FastQ files
+
+    Reads in R1 and R2 files must be in the same order. This class compares
+    the identifiers of the two files, that is the first word of the
+    identifiers without the /1 or /2 suffixes. Files are decompressed and
+    parsed in two threads::
 
+        pf = PairedFastQ("test_R1.fastq.gz", "test_R2.fastq.gz")
+        pf.is_synchronised()
+        pf.check_synchronisation()["mismatches"]
+
+    If the files are not synchronised (e.g. after trimming with a tool that
+    is not aware of the pairs), the mates can be paired again::
+
+        pf.repair("fixed_R1.fastq.gz", "fixed_R2.fastq.gz")
+
+    """
     def __init__(self, fq1, fq2):
         self.fq1 = fq1
         self.fq2 = fq2
 
-    def is_synchronised(self):
+    def _iter_batches(self):
+        # batches of the two files, parsed in two threads
         from sequana import FastQ
-        N = 0
-        for a, b in zip(FastQ(self.fq1), FastQ(self.fq2)):
-            a = a['identifier'].decode()
-            b = b['identifier'].decode()
-            a = a.split()[0]
-            b = b.split()[0]
-
-            if a.endswith("/1"):
-                id1 = a.rsplit("/1")[0]
-            elif a.endswith("/2"):
-                id1 = a.rsplit("/2")[0]
-            else:
-                id1 = a
-            if b.endswith("/1"):
-                id2 = b.rsplit("/1")[0]
-            elif b.endswith("/2"):
-                id2 = b.rsplit("/2")[0]
-            else:
-                id2 = b
-
-            if id1 != id2:
-                print("%s differs from %s" % (id1, id2))
-                print(a)
-                print(b)
-                return False
-            N += 1
-        print(N)
+        batches1 = iter_in_thread(FastQ(self.fq1).iter_batches())
+        batches2 = iter_in_thread(FastQ(self.fq2).iter_batches())
+        for batch1 in batches1:
+            yield batch1, next(batches2, None)
+        for batch2 in batches2:
+            yield None, batch2
+
+    def check_synchronisation(self, max_positions=100):
+        """Compare identifiers of the two files
+
+        :param int max_positions: maximum number of mismatch positions to
+            report
+        :return: dictionary with the number of reads in each file (R1 and
+            R2), the number of pairs with different identifiers
+            (mismatches) and the positions (read index) of the first
+            mismatches.
+        """
+        from sequana.fastq import _get_keys
+        N1, N2 = 0, 0
+        mismatches = 0
+        positions = []
+        for batch1, batch2 in self._iter_batches():
+            keys1 = _get_keys(batch1) if batch1 else []
+            keys2 = _get_keys(batch2) if batch2 else []
+            offset = min(N1, N2)
+            N1 += len(keys1)
+            N2 += len(keys2)
+            if keys1 == keys2:
+                continue
+            for i, (a, b) in enumerate(zip(keys1, keys2)):
+                if a != b:
+                    mismatches += 1
+                    if len(positions) < max_positions:
+                        positions.append(offset + i)
+        return {"R1": N1, "R2": N2, "mismatches": mismatches,
+                "positions": positions}
+
+    def is_synchronised(self):
+        """Return True if reads of the two files are in the same order"""
+        results = self.check_synchronisation(max_positions=1)
+        if results["R1"] != results["R2"]:
+            print("Number of reads differ: %s and %s" % (results["R1"],
+                results["R2"]))
+            return False
+        if results["mismatches"]:
+            print("%s pairs differ. First difference at read %s" % (
+                results["mismatches"], results["positions"][0]))
+            return False
         return True
+
+    def repair(self, output_filename1, output_filename2, buffer_size=1000000):
+        """Pair the mates again and save the pairs into two new files
+
+        :param str output_filename1: output file for R1 (gzipped if the
+            extension is .gz)
+        :param str output_filename2: output file for R2
+        :param int buffer_size: maximum number of reads waiting for their mate
+            (for each file). If the buffer is full, the oldest read is
+            considered as an orphan.
+        :return: dictionary with the number of pairs written, the number
+            of orphans (reads without mates) and the number of duplicated
+            read names in each file
+
+        Reads that are in the same order in the two files are written
+        directly. Other reads wait in a hash table until their mate is
+        found. Orphans are dropped. If a read name is found again while the
+        first read is still waiting for its mate, the first read is
+        considered as an orphan (and counted as a duplicate).
+        """
+        from sequana.fastq import _get_keys, _open_output
+        pending1, pending2 = {}, {}
+        pairs = 0
+        orphans = [0, 0]
+        duplicates = [0, 0]
+
+        def add(pending, key, record, index):
+            if key in pending:
+                del pending[key]
+                duplicates[index] += 1
+                orphans[index] += 1
+            pending[key] = record
+            if len(pending) > buffer_size:
+                del pending[next(iter(pending))]
+                orphans[index] += 1
+
+        with _open_output(output_filename1) as fout1, \
+                _open_output(output_filename2) as fout2:
+            for batch1, batch2 in self._iter_batches():
+                keys1 = _get_keys(batch1) if batch1 else []
+                keys2 = _get_keys(batch2) if batch2 else []
+                if keys1 == keys2 and not pending1 and not pending2:
+                    fout1.write(batch1.data[0:batch1.record_end[-1]])
+                    fout2.write(batch2.data[0:batch2.record_end[-1]])
+                    pairs += len(keys1)
+                    continue
+
+                out1, out2 = [], []
+                for i in range(max(len(keys1), len(keys2))):
+                    if i < len(keys1):
+                        key, record = keys1[i], batch1.get_record(i)
+                        if key in pending2:
+                            out1.append(record)
+                            out2.append(pending2.pop(key))
+                        else:
+                            add(pending1, key, record, 0)
+                    if i < len(keys2):
+                        key, record = keys2[i], batch2.get_record(i)
+                        if key in pending1:
+                            out1.append(pending1.pop(key))
+                            out2.append(record)
+                        else:
+                            add(pending2, key, record, 1)
+                fout1.write(b"".join(out1))
+                fout2.write(b"".join(out2))
+                pairs += len(out1)
+        orphans[0] += len(pending1)
+        orphans[1] += len(pending2)
+        if sum(duplicates):
+            from sequana import logger
+            logger.warning("Duplicated read names dropped: %s in R1, %s in R2"
+                % tuple(duplicates))
+        return {"pairs": pairs, "orphans_R1": orphans[0],
+                "orphans_R2": orphans[1], "duplicates_R1": duplicates[0],
+                "duplicates_R2": duplicates[1]}
@@ -75,3 +75,23 @@ def test_input(tmpdir):
         print(err)
         assert True
     assert os.path.exists(str(directory_run) + os.sep + 'JB409847.cov.html')
+
+
+def test_threads(tmpdir):
+    import os
+    # two contigs analysed in parallel give the same ROIs as one process
+    bedfile = str(tmpdir.join("test.bed"))
+    lines = open(sequana_data('JB409847.bed')).readlines()
+    with open(bedfile, "w") as fout:
+        for i, line in enumerate(lines):
+            name = "ctg1" if i < len(lines) // 2 else "ctg2"
+            fout.write(name + line[line.index("\t"):])
+    for threads in ("1", "2"):
+        coverage.main([prog, '-i', bedfile, "--output-directory",
+                       str(tmpdir.join(threads)), "-w", "1001",
+                       "--threads", threads])
+    for name in ("ctg1", "ctg2"):
+        rois = [open(os.sep.join([str(tmpdir), threads, "coverage_reports",
+                name, "rois.csv"])).read() for threads in ("1", "2")]
+        assert rois[0] == rois[1]
+    assert os.path.exists(str(tmpdir.join("2", "sequana_coverage.html")))
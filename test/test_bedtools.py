@@ -98,7 +98,10 @@ def test_genomecov():
     for chrom in bed:
         chrom.moving_average(n=501)
         chrom.running_median(n=501, circular=True)
+        chrom.running_median(n=501, circular=False, method="pandas")
+        rm = chrom.data["rm"].copy()
         chrom.running_median(n=501, circular=False)
+        assert all(rm == chrom.data["rm"])
 
         chrom.compute_zscore()
         roi = chrom.get_roi()
@@ -147,3 +150,178 @@ def test_gc_content():
         ch.to_csv(fh.name)
 
     ch.get_max_gc_correlation(fasta)
+
+
+def test_lazy():
+    filename = sequana_data('JB409847.bed')
+    bed = bedtools.GenomeCov(filename)
+    lazy = bedtools.GenomeCov(filename, lazy=True)
+    chrom = lazy[0]
+    assert chrom.is_loaded is False
+    assert len(chrom) == len(bed[0])
+    assert chrom.chrom_name == bed[0].chrom_name
+    assert all(chrom.df["cov"] == bed[0].df["cov"])
+    assert chrom.is_loaded
+    chrom.release()
+    assert chrom.is_loaded is False
+    assert chrom.get_mean_cov() == bed[0].get_mean_cov()
+    assert lazy.get_stats() == bed.get_stats()
+    assert chrom.is_loaded is False
+
+    # several chromosomes and small blocks
+    with TempFile(suffix=".bed") as fh:
+        with open(filename) as fin, open(fh.name, "w") as fout:
+            for i, line in enumerate(fin):
+                if i == 1000:
+                    break
+                name = "chr1" if i < 10 else "chr2" if i < 11 else "chr3"
+                fout.write(name + line[line.index("\t"):])
+        ranges = bedtools._scan_bed(fh.name, chunksize=100)
+        assert [x[0] for x in ranges] == ["chr1", "chr2", "chr3"]
+        assert [x[3] for x in ranges] == [10, 1, 989]
+        lazy = bedtools.GenomeCov(fh.name, lazy=True)
+        bed = bedtools.GenomeCov(fh.name)
+        assert len(lazy) == 3
+        assert lazy == bed
+
+    # GC content from a reference that cannot be indexed (gzip)
+    import gzip
+    import shutil
+    import tempfile
+    import numpy as np
+    fasta = sequana_data("JB409847.fasta")
+    bed = bedtools.GenomeCov(filename)
+    bed.compute_gc_content(fasta)
+    with tempfile.TemporaryDirectory() as wkdir:
+        fastagz = os.path.join(wkdir, "JB409847.fa.gz")
+        with open(fasta, "rb") as fin, gzip.open(fastagz, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+        lazy = bedtools.GenomeCov(filename, lazy=True)
+        lazy.compute_gc_content(fastagz)
+        assert np.allclose(lazy[0].df["gc"], bed[0].df["gc"], equal_nan=True)
+
+
+def test_bam():
+    import shutil
+    import tempfile
+    import numpy as np
+    import pysam
+    with tempfile.TemporaryDirectory() as wkdir:
+        filename = os.path.join(wkdir, "measles.bam")
+        shutil.copy(sequana_data("measles.fa.sorted.bam"), filename)
+
+        # expected coverage (all mapped reads and reads with MAPQ > 0)
+        bam = pysam.AlignmentFile(filename)
+        cov = np.zeros(bam.lengths[0], int)
+        mapq0 = np.zeros(bam.lengths[0], int)
+        for read in bam.fetch(until_eof=True):
+            if not read.is_unmapped:
+                cov[read.reference_start:read.reference_end] += 1
+                if read.mapping_quality:
+                    mapq0[read.reference_start:read.reference_end] += 1
+
+        # without index, all contigs are computed at once
+        gc = bedtools.GenomeCov(filename, lazy=True)
+        assert gc[0].is_loaded
+        assert gc[0].chrom_name == bam.references[0]
+        assert all(gc[0].data["cov"] == cov)
+        assert all(gc[0].data["mapq0"] == mapq0)
+        assert gc[0].df["pos"].iloc[0] == 1
+
+        pysam.index(filename)
+        lazy = bedtools.GenomeCov(filename, lazy=True)
+        assert lazy[0].is_loaded is False
+        assert lazy == gc
+        assert bedtools.GenomeCov(filename, threads=2) == gc
+
+
+def test_zscore_by_block():
+    filename = sequana_data('JB409847.bed')
+    chrom = bedtools.GenomeCov(filename)[0]
+    lazy = bedtools.GenomeCov(filename, lazy=True)[0]
+    for circular in (False, True):
+        chrom.running_median(n=2001, circular=circular)
+        chrom.compute_zscore(k=2)
+        lazy.compute_zscore_by_block(2001, circular, k=2, block_size=5000)
+        assert "zscore" not in lazy.data
+        assert lazy.best_gaussian == chrom.best_gaussian
+        assert lazy.get_roi().df.equals(chrom.get_roi().df)
+        assert lazy.get_centralness() == chrom.get_centralness()
+
+        # positions within the limits are kept and blocks are not computed
+        # again for other thresholds within the limits
+        lazy.compute_zscore_by_block(2001, circular, k=2, block_size=5000,
+            limits=(-1.5, 1.5))
+        lazy.get_roi()
+        cache = lazy._block_cache
+        for low, high in [(-3, 3), (-4, 4), (-6, 3)]:
+            for this in (chrom, lazy):
+                this.thresholds.low, this.thresholds.high = low, high
+            assert lazy.get_roi().df.equals(chrom.get_roi().df)
+            assert lazy.get_centralness() == chrom.get_centralness()
+            assert lazy._block_cache is cache
+        # wider thresholds: computed again
+        for this in (chrom, lazy):
+            this.thresholds.low, this.thresholds.high = -2, 2
+        assert lazy.get_roi().df.equals(chrom.get_roi().df)
+        assert lazy._block_cache is not cache
+        for this in (chrom, lazy):
+            this.thresholds = bedtools.DoubleThresholds()
+
+
+def test_merge_region():
+    import pandas as pd
+    pos = [10, 11, 12, 13, 20, 21, 30, 31, 32, 40]
+    df = pd.DataFrame({"chr": "chr1", "pos": pos, "cov": range(1, 11),
+                       "rm": [10.] * 10,
+                       "zscore": [3, 5, 6, 3, -5, -3, 5, -5, -5, 6]},
+                      index=pos)
+    thresholds = bedtools.DoubleThresholds(-4, 4, 0.5, 0.5)
+    rois = bedtools.FilteredGenomeCov(df, thresholds).df
+    # a change of sign starts a new region; as before, a last region made
+    # of a single position (40) is ignored
+    assert list(rois["start"]) == [11, 20, 30, 31]
+    assert list(rois["end"]) == [13, 21, 31, 33]
+    assert list(rois["mean_cov"]) == [2.5, 5, 7, 8.5]
+    assert list(rois["max_cov"]) == [3, 5, 7, 9]
+    assert list(rois["max_zscore"]) == [6, -5, 5, -5]
+
+
+def test_annotation():
+    import pandas as pd
+    pos = list(range(100, 111)) + list(range(300, 306)) + list(range(500, 506))
+    zscore = [5.] * 11 + [-5.] * 6 + [5.] * 6
+    df = pd.DataFrame({"chr": "chr1", "pos": pos, "cov": 1, "rm": 10.,
+                       "zscore": zscore}, index=pos)
+    thresholds = bedtools.DoubleThresholds(-4, 4, 0.5, 0.5)
+    features = [
+        {"type": "source", "gene_start": 1, "gene_end": 1000, "strand": "+"},
+        {"type": "CDS", "gene_start": 50, "gene_end": 400, "strand": "+",
+         "gene": "long", "product": "p1"},
+        {"type": "CDS", "gene_start": 90, "gene_end": 100, "strand": "-",
+         "locus_tag": "nested", "note": "n2"},
+        {"type": "gene", "gene_start": 480, "gene_end": 520, "strand": "+"},
+        {"type": "CDS", "gene_start": 302, "gene_end": 303, "strand": "+"}]
+    rois = bedtools.FilteredGenomeCov(df, thresholds, features).df
+    # regions are annotated with all overlapping features (excluding the
+    # source and gene types) or kept without annotation
+    assert list(rois["start"]) == [100, 100, 300, 300, 500]
+    assert list(rois["gene_name"]) == ["long", "nested", "long", "None", None]
+    assert list(rois["product"]) == ["p1", "n2", "p1", "None", None]
+    assert list(rois["gene_start"]) == ["50", "90", "50", "302", "nan"]
+
+    # same result with the index built once
+    index = bedtools._FeatureIndex(features, {"gene", "regulatory", "source"})
+    assert bedtools.FilteredGenomeCov(df, thresholds, index).df.equals(rois)
+
+
+def test_df_inplace():
+    import numpy as np
+    chrom = bedtools.GenomeCov(sequana_data('JB409847.bed'))[0]
+    cov = chrom.data["cov"].astype(np.int64)
+    # changes of the dataframe are written back to the arrays
+    chrom.df["cov"] += 1000
+    chrom.df.loc[chrom.df.index[0], "cov"] = 0
+    assert chrom.data["cov"][0] == 0
+    assert (chrom.data["cov"][1:] == cov[1:] + 1000).all()
+    assert chrom.get_mean_cov() == np.mean(chrom.data["cov"])
@@ -42,6 +42,24 @@ def test_fastq_unzipped():
             selection = f.select_random_reads(10, fh.name)
             f.select_random_reads(selection, fh.name)
 
+        # paired mode with gzipped outputs and reproducible selection
+        with TempFile(suffix=".gz") as fh1, TempFile(suffix=".gz") as fh2:
+            selection = f.select_random_reads(10, fh1.name, seed=1,
+                paired_filename=thisdata, paired_output_filename=fh2.name)
+            assert len(selection) == 10
+            assert selection == f.select_random_reads(10, fh1.name, seed=1)
+            assert FastQ(fh2.name).count_reads() == 10
+
+        # a truncated mate file must be reported, not silently ignored
+        with TempFile() as mate, TempFile() as fh1, TempFile() as fh2:
+            f.extract_head(400, mate.name)
+            try:
+                f.select_random_reads(10, fh1.name, paired_filename=mate.name,
+                    paired_output_filename=fh2.name)
+                assert False
+            except ValueError as err:
+                assert "different numbers of reads" in str(err)
+
 
 def test_split():
     # general tests
@@ -74,7 +92,22 @@ def test_split():
     remove_files(outputs)
 
 
-    f.split_lines(1000000) is None # too many
+    assert f.split_lines(1000000) is None # too many
+
+    outputs = f.split_chunks(3)
+    assert len(outputs) == 3
+    assert [FastQ(x).count_reads() for x in outputs] == [84, 83, 83]
+    remove_files(outputs)
+    outputs = f.split_chunks(1)
+    assert [FastQ(x).count_reads() for x in outputs] == [250]
+    remove_files(outputs)
+
+    # the remainder is spread over the first files
+    with TempFile(suffix=".fastq") as fh:
+        f.select_random_reads(9, fh.name)
+        outputs = FastQ(fh.name).split_chunks(4, gzip=False)
+        assert [FastQ(x).count_reads() for x in outputs] == [3, 2, 2, 2]
+        remove_files(outputs)
 
 def test_filter():
     f = fastq.FastQ(data)
@@ -95,6 +128,22 @@ def test_filter():
         ff = FastQ(fh.name)
         assert len(ff) == 0
 
+    # identifiers from a list or a file, gzipped outputs and paired mode
+    identifiers = [x["identifier"].split()[0] for x in FastQ(data)][0:10]
+    with TempFile(suffix=".gz") as fh:
+        assert f.filter(identifiers, output_filename=fh.name,
+            progressbar=False) == 240
+        assert FastQ(fh.name).count_reads() == 240
+    with TempFile() as fh, TempFile() as fout1, TempFile(suffix=".gz") as fout2:
+        with open(fh.name, "wb") as fid:
+            fid.write(b"\n".join(identifiers))
+        assert f.filter(fh.name, output_filename=fout1.name, remove=False,
+            progressbar=False) == 10
+        assert f.filter(fh.name, output_filename=fout1.name,
+            paired_filename=datagz, paired_output_filename=fout2.name,
+            progressbar=False) == 240
+        assert FastQ(fout2.name).count_reads() == 240
+
 def remove_files(filenames):
     for filename in filenames:
         os.remove(filename)
@@ -122,12 +171,26 @@ def test_identifiers():
 def test_others():
     # kmer
     f = fastq.FastQ(data)
-    f.to_kmer_content()
+    ts = f.to_kmer_content()
+    assert ts.sum() == 25250 - 250 * 6
+    assert ts.equals(f.to_kmer_content(threads=2))
+    ts = f.to_kmer_content(k=13)
+    assert ts.sort_index().equals(f._to_kmer_content_slow(13).sort_index())
 
     #krona
     with TempFile() as fh:
         f.to_krona(5, fh.name)
 
+    # fasta
+    from pysam import FastxFile
+    for thisdata in [data, datagz]:
+        for suffix in [".fasta", ".fasta.gz"]:
+            with TempFile(suffix=suffix) as fh:
+                assert fastq.FastQ(thisdata).to_fasta(fh.name) == 250
+                reads = [x for x in FastxFile(fh.name)]
+                assert len(reads) == 250
+                assert reads[0].quality is None
+
     assert f == f
 
     f1 = fastq.FastQ(data)
@@ -148,6 +211,24 @@ def test_fastqc():
     qc.histogram_sequence_coordinates()
     qc.plot_acgt_content()
 
+    df = qc.get_quality_per_position()
+    assert len(df) == 101
+    assert (df["10%"] <= df["50%"]).all() and (df["50%"] <= df["90%"]).all()
+    # a position covered by a single read has no dispersion
+    import numpy as np
+    hist = np.zeros((1, 42), dtype=int)
+    hist[0, 30] = 1
+    assert fastq._get_quality_per_position(hist)["std"][0] == 0
+    assert qc.get_length_stats()["N50"] == 101
+    assert len(qc.lengths) == 250
+
+    stats = fastq.FastQ(datagz).stats()
+    assert stats["N"] == 250
+    assert stats["median_read_length"] == 101
+    assert stats["total_bases"] == 25250
+    assert qc.position_quality.sum() == 25250
+    assert qc.position_bases.sum() == 25250
+
     stats = qc.get_stats()
     assert stats['A'][0] == 6952
     assert stats['T'][0] == 6400
@@ -155,3 +236,181 @@ def test_fastqc():
     assert stats['G'][0] == 5768
 
 
+
+def test_iter_batches():
+    for thisdata in [data, datagz]:
+        f = fastq.FastQ(thisdata)
+        batches = list(f.iter_batches(batch_size=100, chunksize=1000))
+        assert [len(x) for x in batches] == [100, 100, 50]
+        batch = batches[0]
+        first = f.next()
+        assert batch.get_identifier(0) == first['identifier']
+        assert batch.get_sequence(0) == first['sequence']
+        assert batch.get_quality(0) == first['quality']
+        assert batch.get_record(0).count(b"\n") == 4
+        assert len(batch.get_sequences()) == batch.lengths.sum()
+        assert len(batch.get_qualities()) == batch.lengths.sum()
+        assert sum([x.lengths.sum() for x in batches]) == 25250
+
+def test_fastqc_parallel():
+    for thisdata in [data, datagz]:
+        qc1 = fastq.FastQC(thisdata, max_sample=100, verbose=False)
+        qc2 = fastq.FastQC(thisdata, max_sample=100, verbose=False, threads=2)
+        assert qc1.get_stats().equals(qc2.get_stats())
+        assert qc1.mean_qualities == qc2.mean_qualities
+        assert list(qc1.gc_list) == list(qc2.gc_list)
+        assert (qc1.position_quality == qc2.position_quality).all()
+        # sampled reads spread over several chunks
+        qc1 = fastq.FastQC(thisdata, max_sample=200, verbose=False)
+        qc2 = fastq.FastQC(thisdata, max_sample=200, verbose=False, threads=3)
+        assert qc1.get_stats().equals(qc2.get_stats())
+        assert len(qc2.mean_qualities) == 200
+        assert qc1.mean_qualities == qc2.mean_qualities
+
+
+def test_random_access():
+    import pysam
+    with TempFile(suffix=".fastq.gz") as fh:
+        pysam.tabix_compress(data, fh.name, force=True)
+        for thisdata in [data, datagz, fh.name]:
+            f = fastq.FastQ(thisdata)
+            reads = list(f.iter_batches(batch_size=1000))[0]
+            # the index is kept in memory, no .fqi file is written
+            assert f[5]['identifier'] == reads.get_identifier(5)
+            assert not os.path.exists(thisdata + ".fqi")
+            f._index = None
+            index = f.get_index(K=7)
+            assert len(index) == 250
+            assert f[0]['identifier'] == reads.get_identifier(0)
+            assert f[100]['sequence'] == reads.get_sequence(100)
+            assert f[-1]['quality'] == reads.get_quality(249)
+            assert [x['identifier'] for x in f[10:20:3]] == \
+                [reads.get_identifier(i) for i in range(10, 20, 3)]
+            assert len(f[245:300]) == 5
+            try:
+                f[250]
+                assert False
+            except IndexError:
+                assert True
+
+        # saved index is used to select reads directly
+        f = fastq.FastQ(fh.name)
+        f.get_index(K=10, save=True)
+        assert os.path.exists(fh.name + ".fqi")
+        with TempFile() as fout:
+            f.select_random_reads([5, 123, 249], fout.name)
+            assert fastq.FastQ(fout.name).count_reads() == 3
+        os.remove(fh.name + ".fqi")
+
+
+def test_fastqc_cache():
+    import tempfile
+    import shutil
+    directory = tempfile.mkdtemp()
+    try:
+        cache = fastq.FastQCCache(directory)
+        qc1 = fastq.FastQC(datagz, verbose=False, cache=cache)
+        stats = qc1.get_stats()
+        assert len(os.listdir(directory)) == 1
+        qc2 = fastq.FastQC(datagz, verbose=False, cache=cache)
+        assert qc2.N == 250
+        assert qc2.get_stats().equals(stats)
+        assert (qc1.position_quality == qc2.position_quality).all()
+        assert list(qc1.lengths) == list(qc2.lengths)
+        # mean qualities are rebuilt from a histogram
+        assert len(qc2.mean_qualities) == 250
+        assert max(abs(x - y) for x, y in zip(sorted(qc1.mean_qualities),
+            qc2.mean_qualities)) <= 0.005
+        # a different max_sample does not use the entry
+        assert cache.load(datagz, 10) is None
+        cache.invalidate(datagz)
+        assert cache.load(datagz, 500000) is None
+        fastq.FastQC(datagz, verbose=False, cache=cache).get_stats()
+        assert cache.size > 0
+        cache.max_size = 0
+        cache.evict()
+        assert cache.size == 0
+        # an entry larger than the cache is not saved
+        qc = fastq.FastQC(datagz, verbose=False, cache=cache)
+        qc.get_stats()
+        assert cache.size == 0
+        # the entry does not depend on the number of reads
+        assert not hasattr(qc._profile, "gc_list")
+        arrays = qc._profile._get_arrays()
+        assert "mean_qualities" not in arrays
+        assert len(arrays["mean_quality_hist"]) <= 256 * 100
+        assert list(qc.gc_list) == sorted(qc.gc_list)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_fastq_profile():
+    qc = fastq.FastQC(data, verbose=False, dotile=True)
+    profile = qc.get_profile()
+    stats = profile.get_stats()
+    assert stats["n_reads"][0] == 250
+    assert stats[["A", "C", "G", "T", "N"]].equals(
+        qc.get_stats()[["A", "C", "G", "T", "N"]])
+    assert profile.length_hist[101] == 250
+    assert profile.gc_hist.sum() == 250
+    assert profile.get_tile_stats()["n_reads"].sum() == 250
+
+    # profiles of two lanes
+    other = fastq.FastQC(datagz, verbose=False, dotile=True).get_profile()
+    total = sum([profile, other])
+    assert total.N == 500
+    assert total.get_stats()["GC content"][0] == stats["GC content"][0]
+    assert (total.position_quality == 2 * profile.position_quality).all()
+
+    with TempFile(suffix=".npz") as fh:
+        total.save(fh.name)
+        loaded = fastq.FastQProfile.load(fh.name)
+        assert loaded.get_stats().equals(total.get_stats())
+        assert loaded.tiles == total.tiles
+
+
+def test_duplication():
+    f = fastq.FastQ(datagz)
+    dup = f.get_duplication()
+    stats = dup.get_stats()
+    assert stats["n_reads"] == 250
+    hist = dup.get_histogram()
+    assert hist.sum() == stats["distinct"]
+    assert (hist * hist.index).sum() == 250
+
+    sketch = f.get_duplication(mode="sketch", max_size=100)
+    assert abs(sketch.get_distinct() - stats["distinct"]) < 0.05 * 250
+    # estimators can be added
+    sketch += f.get_duplication(mode="sketch", max_size=100)
+    assert sketch.N == 500
+    dup += f.get_duplication()
+    assert dup.get_distinct() == stats["distinct"]
+
+    # the table is merged batch after batch
+    import numpy as np
+    small = fastq.DuplicationEstimator()
+    for batch in f.iter_batches(batch_size=7):
+        small.update(batch)
+        small._merge()
+    assert small.get_histogram().equals(hist)
+    hashes = np.concatenate([fastq._hash_prefixes(b, 50)
+                             for b in f.iter_batches()])
+    assert (small.hashes == np.unique(hashes)).all()
+
+    # estimated with the other statistics of FastQC (and cached)
+    import shutil, tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        cache = fastq.FastQCCache(directory)
+        sketch = f.get_duplication(mode="sketch").get_stats()
+        for threads in (1, 2):
+            qc = fastq.FastQC(datagz, verbose=False, duplication=True,
+                threads=threads, cache=cache)
+            assert qc.get_duplication().get_stats() == sketch
+        cache.invalidate()
+        fastq.FastQC(datagz, verbose=False, cache=cache).get_stats()
+        qc = fastq.FastQC(datagz, verbose=False, duplication=True, cache=cache)
+        assert qc._partial is None
+        assert qc.get_duplication().get_stats() == sketch
+    finally:
+        shutil.rmtree(directory)
@@ -1,4 +1,4 @@
-from sequana.kmer import build_kmer, get_kmer
+from sequana.kmer import build_kmer, get_kmer, get_kmer_codes, decode_kmers
 
 
 
@@ -19,3 +19,12 @@ def test_get_kmer():
     res = list(get_kmer('ACGTAAAA', k=4))
     assert res == ['ACGT', 'CGTA', 'GTAA', 'TAAA', 'AAAA']
 
+
+
+def test_get_kmer_codes():
+    import numpy as np
+    bases = np.frombuffer(b"ACGTACNAAAAGGT", dtype=np.uint8)
+    codes, others = get_kmer_codes(bases, [6, 3, 5], k=3)
+    assert decode_kmers(codes, 3) == [b'ACG', b'CGT', b'GTA', b'TAC',
+        b'AAG', b'AGG', b'GGT']
+    assert list(others) == [6]
@@ -18,3 +18,36 @@ def test_running_median():
         assert True
     except:
         assert True
+
+
+def test_running_median_wavelet():
+    import numpy as np
+    import pandas as pd
+    x = randn(1000)
+    for circular in (False, True):
+        rm1 = RunningMedian(x, 31, method="wavelet", circular=circular).run()
+        rm2 = RunningMedian(x, 31, circular=circular).run()
+        assert all(rm1 == rm2)
+
+    # integer data (e.g. coverage) and even window
+    from sequana.running_median import _rolling_median
+    x = np.random.poisson(20, 1000)
+    for W in (30, 31):
+        rm = pd.Series(x).rolling(W, center=True).median().values
+        assert np.allclose(_rolling_median(x, W), rm, equal_nan=True)
+    rm = _rolling_median(x, 31, circular=True)
+    assert rm[0] == np.median(np.concatenate([x[-15:], x[:16]]))
+
+    # integer data with the wavelet method: no cast of the NaN edges into
+    # integers; edges are the data as with the bisect method
+    import warnings
+    for circular in (False, True):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            rm1 = RunningMedian(x, 31, method="wavelet",
+                circular=circular).run()
+        rm2 = RunningMedian(x, 31, circular=circular).run()
+        assert rm1.dtype == float
+        assert (rm1 == rm2).all()
+        if not circular:
+            assert (rm1[:15] == x[:15]).all() and (rm1[-15:] == x[-15:]).all()
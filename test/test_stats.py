@@ -1,4 +1,4 @@
-from sequana.stats import moving_average, evenness
+from sequana.stats import moving_average, evenness, get_length_stats, LengthHistogram
 
 
 def test_ma():
@@ -8,3 +8,19 @@ def test_ma():
 def test_evenness():
     assert evenness([1,1,1,1,4,4,4,4]) == 0.75
     assert evenness([1,1,1,1]) == 1
+
+def test_length_stats():
+    stats = get_length_stats([0, 0, 1, 0, 2])
+    assert stats["N"] == 3
+    assert stats["total_bases"] == 10
+    assert stats["median"] == 4
+    assert stats["N50"] == 4
+    assert stats["N90"] == 2
+    hist = LengthHistogram()
+    hist.update([100, 150, 150])
+    other = LengthHistogram()
+    other.update([3])
+    hist += other
+    assert len(hist) == 4
+    assert hist.get_stats()["median"] == 125
+    assert hist.get_stats()["min"] == 3
@@ -4,14 +4,36 @@ from sequana.tools import bam_get_paired_distance, GZLineCounter, PairedFastQ
 
 
 def test_StatsBAM2Mapped():
+    import tempfile
     data = sequana_data("test.bam", "testing")
-    res = StatsBAM2Mapped(data)
+    with tempfile.TemporaryDirectory() as wkdir:
+        res = StatsBAM2Mapped(data, wkdir)
 
 
 def test_bam2fastq():
+    import gzip
+    import hashlib
+    import tempfile
+    from sequana import FastQ
     data = sequana_data("test.bam", "testing")
-    res = bam_to_mapped_unmapped_fastq(data)
-
+    # checksums of the R1 mapped reads (no unmapped reads)
+    R1_md5 = "7eb525bdd4a52e972f6cb9caf4615e59"
+    with tempfile.TemporaryDirectory() as wkdir:
+        res = bam_to_mapped_unmapped_fastq(data, wkdir)
+        assert res["R1_mapped"] == 451
+        assert res["R2_mapped"] == 485
+        assert res["secondary"] == 64
+        R1 = open(wkdir + "/test_R1_.mapped.fastq", "rb").read()
+        assert hashlib.md5(R1).hexdigest() == R1_md5
+
+        # gzipped outputs written directly, identical content
+        res2 = bam_to_mapped_unmapped_fastq(data, wkdir, compress=True,
+            batch_size=100, threads=2)
+        assert res2 == res
+        R1 = gzip.open(wkdir + "/test_R1_.mapped.fastq.gz").read()
+        assert hashlib.md5(R1).hexdigest() == R1_md5
+        assert len(FastQ(wkdir + "/test_R1_.mapped.fastq.gz")) == 451
+        assert len(FastQ(wkdir + "/test_R2_.unmapped.fastq.gz")) == 0
 
 
 def test_reverse_complement():
@@ -31,14 +53,95 @@ def test_distance():
 def test_gc_content():
     from sequana.tools import gc_content
     data = sequana_data('test.fasta', "testing")
-    gc_content(data, 10)['seq1']
+    gc = gc_content(data, 10)['seq1']
+    assert gc.dtype == "float32"
+
+    import numpy as np
+    from easydev import TempFile
+    with TempFile(suffix=".fa") as fh:
+        with open(fh.name, "w") as fout:
+            fout.write(">a\nGGCCAATTGC\n>b\nAACGTTAA\n")
+        gc = gc_content(fh.name, 3)
+        assert np.isnan(gc["a"][0]) and np.isnan(gc["a"][-1])
+        assert np.allclose(gc["a"][1:-1], [1, 1, 2/3., 1/3., 0, 0, 1/3., 2/3.])
+        gc = gc_content(fh.name, 3, circular=True, threads=2)
+        assert np.allclose(gc["a"][[0, -1]], [1, 1])
+        assert np.allclose(gc["b"], [0, 1/3., 2/3., 2/3., 1/3., 0, 0, 0])
 
 def test_gzlinecounter():
     assert len(GZLineCounter(sequana_data("test.fastq.gz"))) == 1000
 
 
+def test_gzlinecounter_cache():
+    # BGZF file and sidecar cache
+    import os
+    import pysam
+    from easydev import TempFile
+    from sequana.tools import is_bgzf
+    import tempfile
+    with TempFile(suffix=".fastq.gz") as fh, \
+            tempfile.TemporaryDirectory() as cachedir:
+        pysam.tabix_compress(sequana_data("test.fastq"), fh.name, force=True)
+        assert is_bgzf(fh.name)
+        gz = GZLineCounter(fh.name)
+        assert len(gz) == 1000
+        assert not os.path.exists(gz.sidecar)
+        gz = GZLineCounter(fh.name, cache=True, directory=cachedir)
+        assert len(gz) == 1000
+        assert os.path.dirname(gz.sidecar) == cachedir
+        assert len(gz) == 1000
+
+    # opt-in cache of FastQ (sidecar in the default directory)
+    from sequana import FastQ
+    with TempFile(suffix=".fastq.gz") as fh:
+        pysam.tabix_compress(sequana_data("test.fastq"), fh.name, force=True)
+        sidecar = GZLineCounter(fh.name).sidecar
+        assert FastQ(fh.name).count_lines() == 1000
+        assert not os.path.exists(sidecar)
+        try:
+            assert FastQ(fh.name, cache=True).count_lines() == 1000
+            assert os.path.exists(sidecar)
+            assert FastQ(fh.name, cache=True).count_reads() == 250
+        finally:
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+
+
 def test_paired_file():
     f1 = sequana_data("test.fastq.gz")
     f2 = sequana_data("test.fastq.gz")
 
     assert PairedFastQ(f1,f2).is_synchronised()
+
+    # R2 with a missing read
+    from easydev import TempFile
+    from sequana import FastQ
+    with TempFile() as fh, TempFile() as fout1, TempFile(suffix=".gz") as fout2:
+        records = [x for x in FastQ(f1)]
+        with open(fh.name, "wb") as fout:
+            for record in records[0:10] + records[11:]:
+                fout.write(b"\n".join([record["identifier"],
+                    record["sequence"], b"+", record["quality"]]) + b"\n")
+        pf = PairedFastQ(f1, fh.name)
+        assert pf.is_synchronised() is False
+        results = pf.check_synchronisation()
+        assert results["R2"] == 249
+        assert results["positions"][0] == 10
+        results = pf.repair(fout1.name, fout2.name)
+        assert results["pairs"] == 249
+        assert results["orphans_R1"] == 1
+        assert PairedFastQ(fout1.name, fout2.name).is_synchronised()
+
+    # R2 with a duplicated read name (both copies waiting for their mate)
+    with TempFile() as fh, TempFile() as fout1, TempFile() as fout2:
+        with open(fh.name, "wb") as fout:
+            for record in records[0:10] + [records[200]] * 2 + \
+                    records[10:200] + records[201:]:
+                fout.write(b"\n".join([record["identifier"],
+                    record["sequence"], b"+", record["quality"]]) + b"\n")
+        results = PairedFastQ(f1, fh.name).repair(fout1.name, fout2.name)
+        assert results["pairs"] == 250
+        assert results["duplicates_R1"] == 0
+        assert results["duplicates_R2"] == 1
+        assert results["orphans_R2"] == 1
+        assert PairedFastQ(fout1.name, fout2.name).is_synchronised()